@@ -0,0 +1,75 @@
+# -*- mode: python; coding: utf-8 -*
+# Copyright (c) 2019 Radio Astronomy Software Group
+# Licensed under the 3-clause BSD License
+
+"""
+Benchmarks of beam evaluation.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import io
+import os
+import numpy as np
+
+from healvis import beam_model
+
+from . import common
+
+
+def _angles(Npix):
+    az = np.random.uniform(0, 2 * np.pi, Npix)
+    za = np.random.uniform(0, np.pi / 2, Npix)
+    return az, za
+
+
+class AnalyticBeamVal(object):
+    params = (['gaussian', 'airy'], [1000, 100000])
+    param_names = ['beam_type', 'Npix']
+
+    def setup(self, beam_type, Npix):
+        self.beam = beam_model.AnalyticBeam(beam_type, gauss_width=10., diameter=14.)
+        self.az, self.za = _angles(Npix)
+        self.freqs = np.linspace(100e6, 200e6, 64)
+
+    def time_beam_val(self, beam_type, Npix):
+        self.beam.beam_val(self.az, self.za, self.freqs)
+
+
+class _PowerBeam(object):
+    """
+    Uses the HERA dipole beamfits in the healvis data directory. Skipped if it is not present.
+    """
+    timeout = 300
+
+    def _setup(self, healpix=False):
+        if not os.path.exists(common.BEAM_FILE):
+            raise NotImplementedError("{} not found".format(common.BEAM_FILE))
+        self.freqs = np.linspace(120e6, 180e6, 32)
+        self.beam = beam_model.PowerBeam(common.BEAM_FILE)
+        if healpix:
+            self.beam.to_healpix(nside=64)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.beam.interp_freq(self.freqs, inplace=True)
+
+
+class PowerBeamVal(_PowerBeam):
+    params = (['az_za', 'healpix'], [1000, 100000])
+    param_names = ['pixel_coordinate_system', 'Npix']
+
+    def setup(self, pixel_coordinate_system, Npix):
+        self._setup(healpix=pixel_coordinate_system == 'healpix')
+        self.az, self.za = _angles(Npix)
+
+    def time_beam_val(self, pixel_coordinate_system, Npix):
+        self.beam.beam_val(self.az, self.za, self.freqs, pol='xx')
+
+
+class PowerBeamSmooth(_PowerBeam):
+
+    def setup(self):
+        self._setup()
+
+    def time_smooth_beam(self):
+        self.beam.smooth_beam(self.freqs, inplace=False, freq_ls=2.0, noise=1e-10)
@@ -0,0 +1,184 @@
+# -*- mode: python; coding: utf-8 -*
+# Copyright (c) 2019 Radio Astronomy Software Group
+# Licensed under the 3-clause BSD License
+
+"""
+Benchmarks of the geometry, fringes and end-to-end visibility calculation.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import io
+import numpy as np
+
+from healvis import observatory
+
+from . import common
+
+
+class MakeFringe(object):
+    params = ([1000, 10000], [10, 100])
+    param_names = ['Npix', 'Nfreqs']
+
+    def setup(self, Npix, Nfreqs):
+        self.az = np.random.uniform(0, 2 * np.pi, Npix)
+        self.za = np.random.uniform(0, np.pi / 2, Npix)
+        self.freqs = np.linspace(100e6, 200e6, Nfreqs)
+        self.enus = common.antenna_enus()[1:11] - common.antenna_enus()[0]
+
+    def time_make_fringe(self, Npix, Nfreqs):
+        observatory.make_fringe(self.az, self.za, self.freqs, self.enus[0])
+
+    def time_make_fringes(self, Npix, Nfreqs):
+        observatory.make_fringes(self.az, self.za, self.freqs, self.enus)
+
+    def time_make_fringes_recurrence(self, Npix, Nfreqs):
+        observatory.make_fringes(self.az, self.za, self.freqs, self.enus, recurrence=True)
+
+
+class CalcAzza(object):
+    params = ([32, 128, 256], [30., 180.])
+    param_names = ['Nside', 'fov']
+
+    def setup(self, Nside, fov):
+        self.obs = observatory.Observatory(common.latitude, common.longitude)
+        self.obs.set_fov(fov)
+
+    def time_calc_azza(self, Nside, fov):
+        self.obs.calc_azza(Nside, [20.3, common.latitude], [200.3, 90 + common.latitude], return_inds=True)
+
+
+class SetPointings(object):
+    params = ([10, 1000], ['astropy', 'lst'])
+    param_names = ['Ntimes', 'method']
+
+    def setup(self, Ntimes, method):
+        self.obs = observatory.Observatory(common.latitude, common.longitude)
+        self.times = 2458000.2 + np.arange(Ntimes) * 11. / 86400.
+
+    def time_set_pointings(self, Ntimes, method):
+        # Clear the cache, to time the calculation itself.
+        observatory._pointing_cache.clear()
+        self.obs.set_pointings(self.times, method=method)
+
+
+class _MakeVisibilities(object):
+    """
+    make_visibilities on a drift scan of the bundled GSM (resampled to Nside and Nfreqs),
+    with a baseline subset of HERA65.
+    Subclasses vary one parameter from the defaults.
+    """
+    timeout = 300
+    Nside = 32
+    Nfreqs = 10
+    Nbls = 20
+    Ntimes = 8
+    Nprocs = 1
+
+    def _setup(self, **kwargs):
+        for key, val in kwargs.items():
+            setattr(self, key, val)
+        self.sky = common.gsm_sky(self.Nside, self.Nfreqs)
+        self.obs = common.drift_observatory(self.Nbls, self.sky.freqs, self.Ntimes)
+
+    def _run(self, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.obs.make_visibilities(self.sky, Nprocs=self.Nprocs, **kwargs)
+
+
+class MakeVisibilitiesNside(_MakeVisibilities):
+    params = [16, 32, 64, 128]
+    param_names = ['Nside']
+
+    def setup(self, Nside):
+        self._setup(Nside=Nside)
+
+    def time_make_visibilities(self, Nside):
+        self._run()
+
+    def peakmem_make_visibilities(self, Nside):
+        self._run()
+
+
+class MakeVisibilitiesNfreqs(_MakeVisibilities):
+    params = [10, 50, 200]
+    param_names = ['Nfreqs']
+
+    def setup(self, Nfreqs):
+        self._setup(Nfreqs=Nfreqs)
+
+    def time_make_visibilities(self, Nfreqs):
+        self._run()
+
+
+class MakeVisibilitiesNbls(_MakeVisibilities):
+    params = [1, 20, 100, 400]
+    param_names = ['Nbls']
+
+    def setup(self, Nbls):
+        self._setup(Nbls=Nbls)
+
+    def time_make_visibilities(self, Nbls):
+        self._run()
+
+
+class MakeVisibilitiesNprocs(_MakeVisibilities):
+    params = [1, 2, 4]
+    param_names = ['Nprocs']
+    Ntimes = 24
+
+    def setup(self, Nprocs):
+        self._setup(Nprocs=Nprocs)
+
+    def time_make_visibilities(self, Nprocs):
+        self._run()
+
+
+class MakeVisibilitiesEngine(_MakeVisibilities):
+    params = ['direct', 'topocentric', 'mmode']
+    param_names = ['engine']
+    Ntimes = 36
+
+    def setup(self, engine):
+        self._setup()
+        self.obs.pointing_centers = [[10.3 + 10 * ti, common.latitude] for ti in range(self.Ntimes)]
+
+    def time_make_visibilities(self, engine):
+        self._run(engine=engine)
+
+
+class MakeVisibilitiesFreqChunk(_MakeVisibilities):
+    """
+    A short snapshot run with many channels, split over four processes by frequency.
+    """
+    params = [None, 50, 25]
+    param_names = ['freq_chunk']
+    Nside = 128
+    Nfreqs = 200
+    Nbls = 100
+    Ntimes = 2
+    Nprocs = 4
+
+    def setup(self, freq_chunk):
+        self._setup()
+
+    def time_make_visibilities(self, freq_chunk):
+        self._run(freq_chunk=freq_chunk)
+
+
+class MakeVisibilitiesBlTile(_MakeVisibilities):
+    """
+    A short snapshot run with many baselines, split over four processes by baseline.
+    """
+    params = [400, 100, None]
+    param_names = ['bl_tile']
+    Nbls = 400
+    Ntimes = 2
+    Nprocs = 4
+
+    def setup(self, bl_tile):
+        self._setup()
+
+    def time_make_visibilities(self, bl_tile):
+        self._run(bl_tile=bl_tile)
@@ -0,0 +1,100 @@
+# -*- mode: python; coding: utf-8 -*
+# Copyright (c) 2019 Radio Astronomy Software Group
+# Licensed under the 3-clause BSD License
+
+"""
+Benchmarks of SkyModel construction and I/O.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from healvis import sky_model
+
+from . import common
+
+
+class ReadWriteHDF5(object):
+    params = [32, 128]
+    param_names = ['Nside']
+
+    def setup(self, Nside):
+        self.tmpdir = tempfile.mkdtemp()
+        self.infile = os.path.join(self.tmpdir, 'sky_in.hdf5')
+        self.outfile = os.path.join(self.tmpdir, 'sky_out.hdf5')
+        self.sky = common.gsm_sky(Nside)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.sky.write_hdf5(self.infile)
+
+    def teardown(self, Nside):
+        shutil.rmtree(self.tmpdir)
+
+    def time_read_hdf5(self, Nside):
+        with contextlib.redirect_stdout(io.StringIO()):
+            sky_model.SkyModel().read_hdf5(self.infile)
+
+    def time_read_hdf5_shared(self, Nside):
+        with contextlib.redirect_stdout(io.StringIO()):
+            sky_model.SkyModel().read_hdf5(self.infile, shared_memory=True)
+
+    def time_write_hdf5(self, Nside):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.sky.write_hdf5(self.outfile, clobber=True)
+
+
+class HDF5Layouts(object):
+    """
+    Writing a shell with each HDF5 layout, and reading a subset of its channels.
+    """
+    layouts = {
+        'gzip9': dict(),
+        'gzip1_chunked': dict(compression_opts=1, chunks=(4096, 8)),
+        'lzf_chunked': dict(compression='lzf', chunks=(4096, 8)),
+        'contiguous': dict(compression=None),
+    }
+    params = (list(layouts.keys()), [64, 128])
+    param_names = ['layout', 'Nside']
+
+    def setup(self, layout, Nside):
+        self.tmpdir = tempfile.mkdtemp()
+        self.infile = os.path.join(self.tmpdir, 'sky_in.hdf5')
+        self.outfile = os.path.join(self.tmpdir, 'sky_out.hdf5')
+        self.sky = common.flat_sky(Nside, 128)
+        self.chans = np.arange(60, 68)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.sky.write_hdf5(self.infile, **self.layouts[layout])
+
+    def teardown(self, layout, Nside):
+        shutil.rmtree(self.tmpdir)
+
+    def time_write_hdf5(self, layout, Nside):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.sky.write_hdf5(self.outfile, clobber=True, **self.layouts[layout])
+
+    def time_read_channel_subset(self, layout, Nside):
+        with contextlib.redirect_stdout(io.StringIO()):
+            sky_model.SkyModel().read_hdf5(self.infile, freq_chans=self.chans)
+
+    def track_file_size_MB(self, layout, Nside):
+        return os.path.getsize(self.infile) / 1e6
+    track_file_size_MB.unit = 'MB'
+
+
+class FlatSpectrumNoiseShell(object):
+    params = ([64, 128], [1, 4])
+    param_names = ['Nside', 'Nskies']
+
+    def setup(self, Nside, Nskies):
+        self.freqs = np.linspace(100e6, 120e6, 64)
+
+    def time_flat_spectrum_noise_shell(self, Nside, Nskies):
+        sky_model.flat_spectrum_noise_shell(1.0, self.freqs, Nside, Nskies)
+
+    def peakmem_flat_spectrum_noise_shell(self, Nside, Nskies):
+        sky_model.flat_spectrum_noise_shell(1.0, self.freqs, Nside, Nskies)
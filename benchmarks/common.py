@@ -0,0 +1,83 @@
+# -*- mode: python; coding: utf-8 -*
+# Copyright (c) 2019 Radio Astronomy Software Group
+# Licensed under the 3-clause BSD License
+
+"""
+Shared inputs for the benchmarks, built from the data bundled with healvis.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import io
+import os
+import numpy as np
+import healpy as hp
+
+from healvis import observatory, sky_model
+from healvis.data import DATA_PATH
+
+GSM_FILE = os.path.join(DATA_PATH, "gsm_nside32.hdf5")
+LAYOUT_FILE = os.path.join(DATA_PATH, "configs", "HERA65_layout.csv")
+BEAM_FILE = os.path.join(DATA_PATH, "HERA_NF_dipole_power.beamfits")
+
+latitude = -30.7215277777
+longitude = 21.4283055554
+
+
+def antenna_enus():
+    """ ENU positions [m] of the antennas in the HERA65 layout. """
+    return np.loadtxt(LAYOUT_FILE, skiprows=1, usecols=(3, 4, 5))
+
+
+def baselines(Nbls):
+    """ The first Nbls baselines (not autos) of the HERA65 layout. """
+    enus = antenna_enus()
+    bls = []
+    for i in range(len(enus)):
+        for j in range(i + 1, len(enus)):
+            bls.append(observatory.Baseline(enus[i], enus[j]))
+            if len(bls) == Nbls:
+                return bls
+    return bls
+
+
+def gsm_sky(Nside=32, Nfreqs=None):
+    """
+    The bundled GSM shell, resampled to Nside.
+
+    If Nfreqs differs from the file's channel count, the spectra are linearly
+    interpolated onto Nfreqs channels spanning the same band.
+    """
+    gsm = sky_model.SkyModel()
+    with contextlib.redirect_stdout(io.StringIO()):
+        gsm.read_hdf5(GSM_FILE)
+    data, freqs = gsm.data[0], gsm.freqs
+    if Nside != gsm.Nside:
+        data = np.array([hp.ud_grade(data[:, fi], Nside) for fi in range(gsm.Nfreqs)]).T
+    if Nfreqs is not None and Nfreqs != gsm.Nfreqs:
+        freqs = np.linspace(gsm.freqs[0], gsm.freqs[-1], Nfreqs)
+        pos = np.interp(freqs, gsm.freqs, np.arange(gsm.Nfreqs))
+        lo = np.minimum(pos.astype(int), gsm.Nfreqs - 2)
+        frac = pos - lo
+        data = data[:, lo] * (1 - frac) + data[:, lo + 1] * frac
+    return sky_model.SkyModel(Nside=Nside, freqs=freqs, data=data[np.newaxis], Nskies=1)
+
+
+def flat_sky(Nside, Nfreqs):
+    """ A flat-spectrum noise shell, in shared memory. """
+    sky = sky_model.SkyModel(Nside=Nside, freqs=np.linspace(100e6, 120e6, Nfreqs), ref_chan=0, Nskies=1)
+    sky.make_flat_spectrum_shell(1.0, shared_memory=True)
+    return sky
+
+
+def drift_observatory(Nbls, freqs, Ntimes, fov=30., beam='gaussian', **beam_kwargs):
+    """ An Observatory at the HERA site, with Ntimes zenith pointings spaced by 1 degree in RA. """
+    obs = observatory.Observatory(latitude, longitude, array=baselines(Nbls), freqs=freqs)
+    obs.pointing_centers = [[10.3 + ti, latitude] for ti in range(Ntimes)]
+    obs.times_jd = 2458000. + np.arange(Ntimes) / 360.
+    obs.set_fov(fov)
+    if not beam_kwargs and beam == 'gaussian':
+        beam_kwargs = dict(gauss_width=10.)
+    obs.set_beam(beam, **beam_kwargs)
+    return obs
@@ -11,7 +11,7 @@ from scipy.special import j1
 
 from pyuvdata import UVBeam
 
-from .utils import mparray
+from .utils import mparray, precision_dtypes
 
 try:
     from sklearn import gaussian_process as gp
@@ -97,7 +97,7 @@ class PowerBeam(UVBeam):
     Interface for using beamfits files.
     """
 
-    def __init__(self, beamfits=None):
+    def __init__(self, beamfits=None, precision='double'):
         """
         Initialize a PowerBeam object
 
@@ -106,9 +106,12 @@ class PowerBeam(UVBeam):
                 A path to beamfits file or a UVBeam object
             interp_mode : str
                 Interpolation method. See pyuvdata.UVBeam
+            precision : str
+                'single' or 'double'. Precision of the stored data_array and of beam values.
         """
         # initialize
         super(PowerBeam, self).__init__()
+        self.precision = precision
 
         # read a beamfits
         if beamfits is not None:
@@ -121,10 +124,34 @@ class PowerBeam(UVBeam):
 
         # Put data array in shared memory
         dat = self.data_array
-        pdat = mparray(dat.shape, dtype=float)
+        pdat = mparray(dat.shape, dtype=precision_dtypes(precision)[0])
         pdat[()] = dat[()]
         self.data_array = pdat
-        self._data_array.expected_type = float
+        self.set_precision(precision)
+
+    def set_precision(self, precision):
+        """
+        Set the precision of the beam values, casting data_array to it, and the type that
+        UVBeam.check expects of data_array to match.
+
+        Args:
+            precision : str
+                'single' or 'double'
+        """
+        self.precision = precision
+        self.data_array = self._to_precision(self.data_array)
+        real_dtype, complex_dtype = precision_dtypes(precision)
+        self._data_array.expected_type = complex_dtype if np.iscomplexobj(self.data_array) else real_dtype
+
+    def _to_precision(self, arr):
+        """
+        Cast an array to the precision of this beam, keeping it real or complex.
+        """
+        # UVBeam objects recast as PowerBeam may not have a precision set.
+        real_dtype, complex_dtype = precision_dtypes(getattr(self, 'precision', 'double'))
+        if np.iscomplexobj(arr):
+            return arr.astype(complex_dtype, copy=False)
+        return arr.astype(real_dtype, copy=False)
 
     def interp_freq(self, freqs, inplace=False, kind='linear', run_check=True):
         """
@@ -145,7 +172,7 @@ class PowerBeam(UVBeam):
         else:
             new_beam = copy.deepcopy(self)
         interp_data, interp_bp = super(PowerBeam, self)._interp_freq(freqs, kind=kind)
-        new_beam.data_array = interp_data
+        new_beam.data_array = new_beam._to_precision(interp_data)
         new_beam.Nfreqs = interp_data.shape[3]
         new_beam.freq_array = freqs.reshape(1, -1)
         new_beam.bandpass_array = interp_bp
@@ -199,7 +226,7 @@ class PowerBeam(UVBeam):
                 interp_data.append(sdata)
 
         # insert into new_beam
-        new_beam.data_array = np.asarray(interp_data)[np.newaxis, np.newaxis]
+        new_beam.data_array = new_beam._to_precision(np.asarray(interp_data)[np.newaxis, np.newaxis])
 
         # smooth bandpass array too
         new_beam.bandpass_array = smooth_beam(new_beam.freq_array[0], new_beam.bandpass_array.T, freq_ls=freq_ls, noise=noise, output_freqs=freqs).T
@@ -233,7 +260,8 @@ class PowerBeam(UVBeam):
             pol : str, requested visibility polarization, Ex: 'XX' or 'pI'.
 
         Returns:
-            beam_value : ndarray of beam power, with shape (Npix, Nfreqs) where Npix = len(za)
+            beam_value : ndarray of beam power, with shape (Npix, Nfreqs) where Npix = len(za),
+                in the precision of the PowerBeam
         """
         # type checks
         assert self.beam_type == 'power', "beam_type must be power. See efield_to_power()"
@@ -276,12 +304,12 @@ class PowerBeam(UVBeam):
             # healpix interpolation
             interp_beam, interp_basis, interp_bandpass = self._interp_healpix_bilinear(az_array=az, za_array=za, freq_array=freqs, polarizations=[pol])
 
-        return interp_beam[0, 0, 0].T
+        return self._to_precision(interp_beam[0, 0, 0].T)
 
 
 class AnalyticBeam(object):
 
-    def __init__(self, beam_type, gauss_width=None, diameter=None, spectral_index=0.0, ref_freq=None):
+    def __init__(self, beam_type, gauss_width=None, diameter=None, spectral_index=0.0, ref_freq=None, precision='double'):
         """
         Instantiate an analytic beam model.
 
@@ -299,6 +327,8 @@ class AnalyticBeam(object):
                 If set, this sets the reference frequency for the beam width power law.
             diameter : float
                 dish diameter [meter] used for airy beam
+            precision : str
+                'single' or 'double'. Precision of the beam values returned by beam_val.
 
         Notes:
             Uniform beam is a flat-top beam across the entire sky.
@@ -312,6 +342,7 @@ class AnalyticBeam(object):
         if beam_type not in ['uniform', 'gaussian', 'airy'] and not callable(beam_type):
             raise NotImplementedError("Beam type " + str(beam_type) + " not available yet.")
         self.beam_type = beam_type
+        self.precision = precision
         if beam_type == 'gaussian':
             if gauss_width is None:
                 raise KeyError("gauss_width required for gaussian beam")
@@ -338,7 +369,8 @@ class AnalyticBeam(object):
             kwargs : keyword arguments to pass if self.beam_type is callable
 
         Returns:
-            beam_value : ndarray of beam power, with shape (Npix, Nfreqs) where Npix = len(za)
+            beam_value : ndarray of beam power, with shape (Npix, Nfreqs) where Npix = len(za),
+                in the precision of the AnalyticBeam
         """
         if isinstance(az, (float, np.float, int, np.int)):
             az = np.array([az])
@@ -365,4 +397,4 @@ class AnalyticBeam(object):
         elif callable(self.beam_type):
             beam_value = self.beam_type(za, freqs, **kwargs)
 
-        return beam_value
+        return np.asarray(beam_value).astype(precision_dtypes(self.precision)[0], copy=False)
@@ -7,31 +7,49 @@ from __future__ import absolute_import, division, print_function
 import numpy as np
 import multiprocessing as mp
 import sys
+import os
+import hashlib
+import json
+from collections import OrderedDict
 import resource
 import warnings
 import time
 import copy
+import traceback
+import queue
 import healpy as hp
 from astropy.time import Time
 from astropy.constants import c
 from astropy.coordinates import Angle, AltAz, EarthLocation, ICRS
 from astropy import units
+try:
+    import erfa
+except ImportError:     # astropy < 4.2
+    from astropy import _erfa as erfa
 
 from .beam_model import PowerBeam, AnalyticBeam
-from .utils import jy2Tsr, mparray
+from .utils import jy2Tsr, mparray, precision_dtypes, StageTimer, merge_stage_reports, max_rss_GB, file_lock
 from .cosmology import c_ms
 
 # -----------------------
 # Classes and methods to calculate visibilities from HEALPix maps.
 # -----------------------
 
+# Pointings from set_pointings, by location, method and time array.
+_pointing_cache = {}
+_pointing_cache_size = 16
 
-def make_fringe(az, za, freq, enu):
+
+def make_fringe(az, za, freq, enu, recurrence=False, precision='double'):
     """
     az, za = Azimuth, zenith angle, radians
     freq = frequeny in Hz
     enu = baseline vector in meters
+    recurrence = Use the frequency recurrence for uniformly spaced freq. See make_fringes.
+    precision = 'single' or 'double', precision of the returned fringe. See make_fringes.
     """
+    if recurrence or precision != 'double':
+        return make_fringes(az, za, freq, enu, recurrence=recurrence, precision=precision)[:, 0, :].T
     pos_l = np.sin(az) * np.sin(za)
     pos_m = np.cos(az) * np.sin(za)
     pos_n = np.cos(za)
@@ -42,6 +60,358 @@ def make_fringe(az, za, freq, enu):
     return fringe
 
 
+def _phasor(bdotl, freq, out):
+    """
+    Write exp(2 pi i bdotl freq / c) into the complex array out.
+
+    For single precision, the phase is reduced to within half a cycle in double precision
+    before it is cast, so long baselines lose no accuracy.
+    """
+    if out.dtype == np.complex128:
+        np.multiply(bdotl, 2 * np.pi / c_ms * freq, out=out.imag)
+    else:
+        cycles = bdotl * (freq / c_ms)
+        cycles -= np.rint(cycles)
+        np.multiply(cycles, 2 * np.pi, out=out.imag, casting='same_kind')
+    np.cos(out.imag, out=out.real)
+    np.sin(out.imag, out=out.imag)
+    return out
+
+
+def _uniform_spacing(freqs, rtol=1e-9):
+    """
+    Return the channel spacing of freqs if it is uniform (to within rtol), otherwise None.
+    """
+    freqs = np.asarray(freqs, dtype=float).ravel()
+    if freqs.size < 3:
+        return None
+    dfs = np.diff(freqs)
+    if np.allclose(dfs, dfs[0], rtol=rtol, atol=0):
+        return dfs[0]
+    return None
+
+
+def make_fringes(az, za, freqs, enus, recurrence=False, anchor_interval=64, out=None, precision='double'):
+    """
+    Fringes for a set of baselines, evaluated together.
+
+    az, za = Azimuth, zenith angle, radians
+    freqs = frequencies in Hz
+    enus = baseline vectors in meters, shape (Nbls, 3)
+    recurrence = If True and freqs are uniformly spaced, build each channel from the previous one
+                 by multiplying by the phasor of the channel spacing, rather than evaluating cos/sin.
+                 The exact phasor is recomputed every anchor_interval channels to stop rounding errors
+                 from accumulating. Non-uniform freqs fall back to direct evaluation.
+    out = Optional complex array of shape (Nfreqs, Nbls, Npix) to write the fringes into.
+    precision = 'single' or 'double'. Sets the dtype of the fringes (complex64 or complex128),
+                if out is not given. Phases are always computed in double precision.
+
+    Returns fringes of shape (Nfreqs, Nbls, Npix). The frequency axis comes first
+    so that the pixel sum for each frequency is a single matrix product.
+    """
+    pos_l = np.sin(az) * np.sin(za)
+    pos_m = np.cos(az) * np.sin(za)
+    pos_n = np.cos(za)
+    lmn = np.vstack((pos_l, pos_m, pos_n))
+    bdotl = np.dot(np.atleast_2d(enus), lmn)  # In meters, shape (Nbls, Npix)
+    freqs = np.atleast_1d(np.asarray(freqs, dtype=float))
+    dfreq = _uniform_spacing(freqs) if recurrence else None
+    if out is None:
+        fringe = np.empty((freqs.size,) + bdotl.shape, dtype=precision_dtypes(precision)[1])
+    else:
+        fringe = out
+    if dfreq is None:
+        if fringe.dtype == np.complex128:
+            # Hold the phase in the imaginary part, so no temporary arrays are needed.
+            np.multiply((2 * np.pi / c_ms) * freqs.reshape(-1, 1, 1), bdotl, out=fringe.imag)
+            np.cos(fringe.imag, out=fringe.real)
+            np.sin(fringe.imag, out=fringe.imag)
+        else:
+            for fi in range(freqs.size):
+                _phasor(bdotl, freqs[fi], fringe[fi])
+        return fringe
+
+    step = _phasor(bdotl, dfreq, np.empty(bdotl.shape, dtype=fringe.dtype))
+    for fi in range(freqs.size):
+        if fi % anchor_interval == 0:
+            _phasor(bdotl, freqs[fi], fringe[fi])
+        else:
+            np.multiply(fringe[fi - 1], step, out=fringe[fi])
+    return fringe
+
+
+class GeometryCache(object):
+    """
+    Cache of the zenith angles, azimuths and HEALPix indices computed by Observatory.calc_azza.
+
+    Entries are keyed by Nside, field of view, pointing center, north and horizon taper settings.
+    They are kept in memory, up to max_memory GB per process, with the least recently used
+    dropped first. If cache_dir is given, entries are also saved there as .npz files, so they are
+    shared among worker processes, polarizations and later runs with the same pointings.
+
+    Returned arrays are read-only.
+    """
+
+    def __init__(self, cache_dir=None, max_memory=1.0):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_memory * 1e9)
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def key(Nside, fov, center, north, horizon_taper, pix_area_sr):
+        """
+        Hash of the parameters that determine the output of calc_azza.
+        """
+        if north is None:
+            north = [0, 90.]
+        if not horizon_taper:
+            pix_area_sr = 0.
+        params = np.array([Nside, fov, center[0], center[1], north[0], north[1], bool(horizon_taper), pix_area_sr], dtype=float)
+        return hashlib.sha1(params.tobytes()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, 'azza_{}.npz'.format(key))
+
+    def get(self, key):
+        """
+        Return (za, az, pix) for key, or None if it is not cached.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        if self.cache_dir is not None and os.path.exists(self._path(key)):
+            with np.load(self._path(key)) as f:
+                entry = (f['za'], f['az'], f['pix'])
+            self._store(key, entry)
+            return self._entries.get(key, entry)
+        return None
+
+    def put(self, key, za, az, pix):
+        """
+        Add (za, az, pix) to the cache under key.
+        """
+        if self.cache_dir is not None and not os.path.exists(self._path(key)):
+            # Write to a temporary file first, so other processes never see a partial file.
+            tmp = self._path(key) + '.{}.tmp.npz'.format(os.getpid())
+            np.savez(tmp, za=za, az=az, pix=pix)
+            os.replace(tmp, self._path(key))
+        self._store(key, (za, az, pix))
+
+    def _store(self, key, entry):
+        nbytes = sum(arr.nbytes for arr in entry)
+        if nbytes > self.max_bytes:
+            return
+        for arr in entry:
+            arr.flags.writeable = False
+        while self._nbytes + nbytes > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self._nbytes -= sum(arr.nbytes for arr in old)
+        self._entries[key] = entry
+        self._nbytes += nbytes
+
+    def clear(self):
+        """
+        Empty the in-memory cache. Files in cache_dir are kept.
+        """
+        self._entries.clear()
+        self._nbytes = 0
+
+
+class VisCheckpoint(object):
+    """
+    Checkpoint of the (time, channel, baseline) tiles of visibilities finished by make_visibilities.
+
+    Workers save their finished tiles to checkpoint_dir as .npy files, at most every interval seconds
+    and when they run out of work, and list them in index.json. (When streaming with a block_callback,
+    the main process saves the tiles of each time chunk instead, as it is finished.) The index also holds a fingerprint of
+    the inputs (any JSON-serializable value, e.g., hashes of the obsparams and SkyModel), the shape and
+    dtype of the output and the tiling. Without resume, an existing checkpoint is discarded.
+    With resume, make_visibilities checks that the fingerprint and shape match, loads the tiles
+    in the index and computes only the others, using the same tiling.
+    """
+
+    def __init__(self, checkpoint_dir, fingerprint=None, interval=600., resume=False):
+        self.checkpoint_dir = checkpoint_dir
+        self.fingerprint = fingerprint
+        self.interval = interval
+        self.resume = resume
+        if not os.path.exists(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.checkpoint_dir, 'index.json')
+
+    def _tile_path(self, tile):
+        return os.path.join(self.checkpoint_dir, 'vis_t{}-{}_f{}-{}_b{}-{}.npy'.format(*tile))
+
+    def read_index(self):
+        """
+        Return the index, or None if there is no checkpoint.
+        """
+        if not os.path.exists(self._index_path):
+            return None
+        with open(self._index_path, 'r') as jfile:
+            return json.load(jfile)
+
+    def _write_index(self, index):
+        tmp = self._index_path + '.{}.tmp'.format(os.getpid())
+        with open(tmp, 'w') as jfile:
+            json.dump(index, jfile)
+        os.replace(tmp, self._index_path)
+
+    def start(self, shape, dtype, tiling):
+        """
+        Begin a run, called by make_visibilities.
+
+        shape, dtype : Of the output array, of shape (Ntimes, Nunique, Npols, Nskies, Nfreqs).
+        tiling : dict of the time_chunk, freq_chunk and bl_tile of the run.
+
+        Returns:
+            tiling : The tiling to use. When resuming, this is the tiling of the checkpoint.
+            tiles : list of the finished tiles, as (t0, t1, f0, f1, b0, b1) tuples of index ranges.
+        """
+        index = self.read_index()
+        new = OrderedDict([('fingerprint', self.fingerprint), ('shape', list(shape)),
+                           ('dtype', np.dtype(dtype).str), ('tiling', dict(tiling)), ('tiles', [])])
+        if self.resume and index is not None:
+            for key in ['fingerprint', 'shape', 'dtype']:
+                if index[key] != new[key]:
+                    raise ValueError("The {} of the checkpoint in {} does not match this simulation.".format(key, self.checkpoint_dir))
+            if index['tiling'] != new['tiling']:
+                warnings.warn("Resuming with the tiling of the checkpoint, {}.".format(index['tiling']))
+            return index['tiling'], [tuple(tile) for tile in index['tiles']]
+        if index is not None:
+            self.clear()
+        self._write_index(new)
+        return new['tiling'], []
+
+    def save(self, vis_array, tiles, time_offset=0):
+        """
+        Save the given tiles of vis_array, and add them to the index.
+        If vis_array holds the times from time_offset on (e.g., one time chunk), its rows are offset accordingly.
+        """
+        if len(tiles) == 0:
+            return
+        for tile in tiles:
+            t0, t1, f0, f1, b0, b1 = tile
+            # Write to a temporary file first, so a tile is never listed before it is complete.
+            tmp = self._tile_path(tile) + '.{}.tmp.npy'.format(os.getpid())
+            np.save(tmp, vis_array[t0 - time_offset:t1 - time_offset, b0:b1, ..., f0:f1])
+            os.replace(tmp, self._tile_path(tile))
+        with file_lock(self._index_path + '.lock'):
+            index = self.read_index()
+            index['tiles'].extend([list(tile) for tile in tiles])
+            self._write_index(index)
+
+    def load(self, vis_array, tiles, time_offset=0):
+        """
+        Fill in vis_array from the saved tiles. time_offset is as for save.
+        """
+        for tile in tiles:
+            t0, t1, f0, f1, b0, b1 = tile
+            vis_array[t0 - time_offset:t1 - time_offset, b0:b1, ..., f0:f1] = np.load(self._tile_path(tile))
+
+    def clear(self):
+        """
+        Remove the index and tiles. The directory is kept.
+        """
+        for fname in os.listdir(self.checkpoint_dir):
+            if fname == 'index.json' or fname == 'index.json.lock' or (fname.startswith('vis_t') and fname.endswith('.npy')):
+                os.remove(os.path.join(self.checkpoint_dir, fname))
+
+
+def _pol_list(beam_pol):
+    """
+    Return beam_pol as a list of polarizations.
+    """
+    if isinstance(beam_pol, str):
+        return [beam_pol]
+    return list(beam_pol)
+
+
+def _mmode_synthesis(cm, phis):
+    """
+    Evaluate the real function f(phi) = Re[c_0 + 2 sum_{m>0} c_m exp(-i m phi)].
+
+    cm : array of shape (..., Nm), coefficients for m = 0 ... Nm - 1
+    phis : array of angles (radians)
+
+    If phis are uniformly spaced by 2 pi / len(phis), the sum is done by FFT.
+    Otherwise, it is summed directly.
+
+    Returns:
+        Array of shape (len(phis), ...)
+    """
+    cm = np.array(cm, dtype=complex)
+    cm[..., 1:] *= 2
+    Nt = len(phis)
+    Nm = cm.shape[-1]
+    m = np.arange(Nm)
+    phi0 = phis[0]
+    if Nt > 1 and np.allclose(np.diff(np.unwrap(phis)), 2 * np.pi / Nt, rtol=0, atol=1e-10):
+        # Fold m modulo Nt, since exp(-i m phi_t) repeats.
+        cm *= np.exp(-1j * m * phi0)
+        folded = np.zeros(cm.shape[:-1] + (Nt,), dtype=complex)
+        for k in range(0, Nm, Nt):
+            folded[..., :min(Nt, Nm - k)] += cm[..., k:k + Nt]
+        vals = np.fft.fft(folded, axis=-1).real
+    else:
+        vals = np.dot(cm, np.exp(-1j * np.outer(m, phis))).real
+    return np.moveaxis(vals, -1, 0)
+
+
+def group_redundant_baselines(enus, tol=1e-3):
+    """
+    Group baseline vectors that agree to within a tolerance.
+
+    enus = baseline vectors in meters, shape (Nbls, 3)
+    tol = maximum distance [meters] from a baseline to the first vector of its group.
+          If None, every baseline is its own group.
+
+    Returns:
+        unique_enus : ndarray of shape (Nunique, 3), the first baseline vector of each group
+        group_inds : integer ndarray of shape (Nbls,), the group of each baseline
+    """
+    enus = np.atleast_2d(np.asarray(enus, dtype=float))
+    Nbls = enus.shape[0]
+    if tol is None:
+        return enus.copy(), np.arange(Nbls)
+    unique_enus = np.zeros_like(enus)
+    group_inds = np.zeros(Nbls, dtype=int)
+    Nunique = 0
+    for bi in range(Nbls):
+        if Nunique > 0:
+            dists = np.linalg.norm(unique_enus[:Nunique] - enus[bi], axis=1)
+            gi = np.argmin(dists)
+            if dists[gi] <= tol:
+                group_inds[bi] = gi
+                continue
+        unique_enus[Nunique] = enus[bi]
+        group_inds[bi] = Nunique
+        Nunique += 1
+    return unique_enus[:Nunique], group_inds
+
+
+def _get_buffer(workspace, name, shape, dtype):
+    """
+    Get a C-contiguous array of the given shape from a reusable flat buffer.
+
+    workspace = dict of flat buffers, keyed by name
+    The buffer is reallocated only when it is too small or of a different dtype.
+    The contents of the returned array are undefined.
+    """
+    size = int(np.prod(shape))
+    buf = workspace.get(name, None)
+    if buf is None or buf.size < size or buf.dtype != np.dtype(dtype):
+        buf = np.empty(size, dtype=dtype)
+        workspace[name] = buf
+    return buf[:size].reshape(shape)
+
+
 class Baseline(object):
 
     def __init__(self, ant1_enu=None, ant2_enu=None, enu_vec=None):
@@ -57,12 +427,12 @@ class Baseline(object):
     def get_uvw(self, freq_Hz):
         return self.enu / (c_ms / float(freq_Hz))
 
-    def get_fringe(self, az, za, freq_Hz, degrees=False):
+    def get_fringe(self, az, za, freq_Hz, degrees=False, recurrence=False, precision='double'):
         if degrees:
             az *= np.pi / 180.
             za *= np.pi / 180.
         freq_Hz = freq_Hz.astype(float)
-        return make_fringe(az, za, freq_Hz, self.enu)
+        return make_fringe(az, za, freq_Hz, self.enu, recurrence=recurrence, precision=precision)
 
     def plot_fringe(self, az, za, freq=None, degrees=False, pix=None, Nside=None):
         import pylab as pl
@@ -116,28 +486,133 @@ class Observatory(object):
         self.do_horizon_taper = False
         self.pix_area_sr = pix_area_sr  # If doing horizon taper, need to set pixel area
 
+        self.bl_chunk = None    # Number of baselines to evaluate together. Set by `make_visibilities`.
+        self.fringe_recurrence = False  # Evaluate fringes by frequency recurrence. Set by `make_visibilities`.
+        self.unique_enus = None     # Baseline vectors that are simulated, one per redundant group. Set by `make_visibilities`.
+        self.pix_block = None   # Number of pixels to evaluate together. Set by `make_visibilities`.
+        self.max_memory = None  # Memory budget [GB] for per-process work buffers. Set by `make_visibilities`.
+        self.precision = 'double'   # Precision of the beam, fringe and output arrays. Set by `make_visibilities`.
+        self.geometry_cache = None  # GeometryCache for the outputs of calc_azza.
+        self.report = None      # Timing and memory report from the last call to `make_visibilities`.
+        self._timer = StageTimer()  # Times stages of the calculation in this process.
+        self.engine = 'direct'      # Visibility engine, 'direct', 'topocentric' or 'mmode'. Set by `make_visibilities`.
+        self._topo = None       # Beam table on the topocentric grid, for engine='topocentric'.
+        self._Nsteps = None     # Number of (time, frequency block) steps in `make_visibilities`, for progress reports.
+        self._pix_rows = None   # Row of the SkyModel data for each HEALPix pixel, if it is a partial sky. Set by `make_visibilities`.
+        self._topo_table_bytes = 2**30      # Largest topocentric beam table, if max_memory is None.
+        self._topo_oversample = 2       # Nside of the topocentric beam grid, relative to that of the sky.
+        self._topo_beam_tol = 1e-3      # Relative beam interpolation error above which the topocentric engine warns.
+        self._fringe_chunk_bytes = 2**28    # Size of the fringe array per baseline chunk, if bl_chunk and max_memory are None.
+        self._min_pix_block = 1024      # Smallest pixel block to use when fitting to max_memory.
+        self._tile_overhead_bls = 16    # Cost of the per-time work of a tile, in baselines per polarization. See `_bl_tile_size`.
+        self._stream_buffer_bytes = 2**30   # Size of the pool of output slots with a block_callback, if time_chunk is None.
+
         if freqs is not None:
             self.Nfreqs = len(freqs)
 
-    def set_pointings(self, time_arr):
+    def set_pointings(self, time_arr, method='astropy'):
         """
         Set the pointing centers (in ra/dec) based on array location and times.
             Dec = self.lat
         Also sets the north pole positions in ICRS.
         RA  = What RA is at zenith at a given JD?
+
+        method : 'astropy' or 'lst'
+            'astropy' transforms the zenith and north directions at all times to ICRS in one call.
+            'lst' places the zenith at the apparent LST and the observatory latitude in the
+            true equator and equinox of date, and rotates to ICRS by the IAU 2006/2000A
+            precession-nutation matrix. This neglects aberration, so the positions agree with 'astropy'
+            to within about 21 arcsec, and is much faster.
+
+        Results are cached by location, method and time array, so repeated calls are free.
         """
+        with self._timer.stage('pointing'):
+            self._set_pointings(time_arr, method=method)
+
+    def _set_pointings(self, time_arr, method='astropy'):
+        time_arr = np.asarray(time_arr, dtype=float)
+        key = (self.lat, self.lon, method, time_arr.tobytes())
+        if key not in _pointing_cache:
+            if method == 'astropy':
+                centers, north_poles = self._pointings_astropy(time_arr)
+            elif method == 'lst':
+                centers, north_poles = self._pointings_lst(time_arr)
+            else:
+                raise ValueError("method must be 'astropy' or 'lst'")
+            if len(_pointing_cache) >= _pointing_cache_size:
+                _pointing_cache.pop(next(iter(_pointing_cache)))
+            _pointing_cache[key] = (centers, north_poles)
+        centers, north_poles = _pointing_cache[key]
         self.times_jd = time_arr
-        centers = []
-        north_poles = []
-        for t in Time(time_arr, scale='utc', format='jd'):
-            zen = AltAz(alt=Angle('90d'), az=Angle('0d'), obstime=t, location=self.telescope_location)
-            north = AltAz(alt=Angle('0d'), az=Angle('0d'), obstime=t, location=self.telescope_location)
-            zen_radec = zen.transform_to(ICRS)
-            north_radec = north.transform_to(ICRS)
-            centers.append([zen_radec.ra.deg, zen_radec.dec.deg])
-            north_poles.append([north_radec.ra.deg, north_radec.dec.deg])
-        self.pointing_centers = centers
-        self.north_poles = north_poles
+        self.pointing_centers = centers.tolist()
+        self.north_poles = north_poles.tolist()
+
+    def _pointings_astropy(self, time_arr):
+        """
+        ICRS [ra, dec] (degrees) of the zenith and the north point on the horizon, by astropy. See set_pointings.
+        """
+        t = Time(time_arr, scale='utc', format='jd')
+        Nt = t.size
+        zen = AltAz(alt=Angle(np.full(Nt, 90.), unit='deg'), az=Angle(np.zeros(Nt), unit='deg'),
+                    obstime=t, location=self.telescope_location)
+        north = AltAz(alt=Angle(np.zeros(Nt), unit='deg'), az=Angle(np.zeros(Nt), unit='deg'),
+                      obstime=t, location=self.telescope_location)
+        zen_radec = zen.transform_to(ICRS())
+        north_radec = north.transform_to(ICRS())
+        centers = np.stack([zen_radec.ra.deg, zen_radec.dec.deg], axis=-1)
+        north_poles = np.stack([north_radec.ra.deg, north_radec.dec.deg], axis=-1)
+        return centers, north_poles
+
+    def _pointings_lst(self, time_arr):
+        """
+        ICRS [ra, dec] (degrees) of the zenith and the north point on the horizon, from the LST. See set_pointings.
+        """
+        t = Time(time_arr, scale='utc', format='jd', location=self.telescope_location)
+        lst = t.sidereal_time('apparent').deg
+        # The north point on the horizon is on the meridian, 90 degrees from the zenith towards the north pole.
+        if self.lat >= 0:
+            north_hadec = [180., 90. - self.lat]
+        else:
+            north_hadec = [0., 90. + self.lat]
+        radec = np.stack([
+            np.stack([lst, np.full_like(lst, self.lat)], axis=-1),
+            np.stack([(lst - north_hadec[0]) % 360., np.full_like(lst, north_hadec[1])], axis=-1),
+        ])  # Shape (2, Ntimes, 2), [ra, dec] of date.
+        vecs = hp.ang2vec(radec[..., 0].ravel(), radec[..., 1].ravel(), lonlat=True).reshape(2, -1, 3)
+        # Rotate from the true equator and equinox of date to ICRS by the transpose of the NPB matrix.
+        rbpn = erfa.pnm06a(t.tt.jd1, t.tt.jd2)  # Shape (Ntimes, 3, 3)
+        vecs = np.einsum('tji,ktj->kti', rbpn, vecs)
+        ra, dec = hp.vec2ang(vecs.reshape(-1, 3), lonlat=True)
+        icrs = np.stack([ra % 360., dec], axis=-1).reshape(2, -1, 2)
+        return icrs[0], icrs[1]
+
+    def _fov_radius(self):
+        """
+        Radius [radians] of the region to select around each pointing center.
+        """
+        if self.fov is None:
+            raise AttributeError("Need to set a field of view in degrees")
+        radius = self.fov * np.pi / 180. * 1 / 2.
+        if self.do_horizon_taper:
+            radius += np.sqrt(self.pix_area_sr)     # Allow parts of pixels to be above the horizon.
+        return radius
+
+    def _topocentric_axes(self, center, north=None):
+        """
+        Unit vectors in the ICRS frame along the East (x), North (y) and zenith (z) directions
+        of the topocentric frame, given the pointing center and the position of North (ra/dec, degrees).
+        See calc_azza.
+        """
+        cvec = hp.ang2vec(center[0], center[1], lonlat=True)
+
+        if north is None:
+            north = np.array([0, 90.])
+        nvec = hp.ang2vec(north[0], north[1], lonlat=True)
+
+        colat = np.arccos(np.dot(cvec, nvec))  # Should be close to 90d
+        xvec = np.cross(nvec, cvec) * 1 / np.sin(colat)
+        yvec = np.cross(cvec, xvec)
+        return xvec, yvec, cvec
 
     def calc_azza(self, Nside, center, north=None, return_inds=False):
         """
@@ -156,36 +631,42 @@ class Observatory(object):
                     azimuth angles returned. Providing the north position fixes
                     this.
 
+        If self.geometry_cache (a GeometryCache) is set, results are looked up there first.
+
         Returns:
             zenith angles (radians)
             azimuth angles (radians)
             indices (if return_inds)
         """
-        if self.fov is None:
-            raise AttributeError("Need to set a field of view in degrees")
-        radius = self.fov * np.pi / 180. * 1 / 2.
-        if self.do_horizon_taper:
-            radius += np.sqrt(self.pix_area_sr)     # Allow parts of pixels to be above the horizon.
-        cvec = hp.ang2vec(center[0], center[1], lonlat=True)
+        if self.geometry_cache is not None:
+            key = GeometryCache.key(Nside, self.fov, center, north, self.do_horizon_taper, self.pix_area_sr)
+            cached = self.geometry_cache.get(key)
+            if cached is None:
+                cached = self._calc_azza(Nside, center, north)
+                self.geometry_cache.put(key, *cached)
+            za_arr, az_arr, pix = cached
+        else:
+            za_arr, az_arr, pix = self._calc_azza(Nside, center, north)
+        if return_inds:
+            return za_arr, az_arr, pix
+        return za_arr, az_arr
 
-        if north is None:
-            north = np.array([0, 90.])
-        nvec = hp.ang2vec(north[0], north[1], lonlat=True)
+    def _calc_azza(self, Nside, center, north=None):
+        """
+        Zenith angles, azimuths and HEALPix indices of the pixels in the field of view. See calc_azza.
+        """
+        radius = self._fov_radius()
+        xvec, yvec, cvec = self._topocentric_axes(center, north)
         pix = hp.query_disc(Nside, cvec, radius)
         vecs = hp.pix2vec(Nside, pix)
         vecs = np.array(vecs).T  # Shape (Npix, 3)
 
-        colat = np.arccos(np.dot(cvec, nvec))  # Should be close to 90d
-        xvec = np.cross(nvec, cvec) * 1 / np.sin(colat)
-        yvec = np.cross(cvec, xvec)
         sdotx = np.tensordot(vecs, xvec, 1)
         sdotz = np.tensordot(vecs, cvec, 1)
         sdoty = np.tensordot(vecs, yvec, 1)
-        za_arr = np.arccos(sdotz)
+        za_arr = np.arccos(np.clip(sdotz, -1, 1))
         az_arr = (np.arctan2(sdotx, sdoty)) % (2 * np.pi)  # xy plane is tangent. Increasing azimuthal angle eastward, zero at North (y axis). x is East.
-        if return_inds:
-            return za_arr, az_arr, pix
-        return za_arr, az_arr
+        return za_arr, az_arr, pix
 
     def set_fov(self, fov):
         """
@@ -193,7 +674,7 @@ class Observatory(object):
         """
         self.fov = fov
 
-    def set_beam(self, beam='uniform', freq_interp_kind='linear', **kwargs):
+    def set_beam(self, beam='uniform', freq_interp_kind='linear', precision='double', **kwargs):
         """
         Set the beam of the array.
 
@@ -205,15 +686,17 @@ class Observatory(object):
                 to a beamfits and instantiates a PowerBeam.
             freq_interp_kind : str
                 For PowerBeam, frequency interpolation option.
+            precision : str
+                'single' or 'double'. Precision of the beam data and values.
 
             kwargs : keyword arguments
                 kwargs to pass to AnalyticBeam instantiation.
         """
         if beam in ['uniform', 'gaussian', 'airy'] or callable(beam):
-            self.beam = AnalyticBeam(beam, **kwargs)
+            self.beam = AnalyticBeam(beam, precision=precision, **kwargs)
 
         else:
-            self.beam = PowerBeam(beam)
+            self.beam = PowerBeam(beam, precision=precision)
             self.beam.interp_freq(self.freqs, inplace=True, kind=freq_interp_kind)
             self.beam.freq_interp_kind = freq_interp_kind
 
@@ -256,6 +739,35 @@ class Observatory(object):
 
         return pixels
 
+    def observed_pixels(self, Nside):
+        """
+        Sorted HEALPix pixels (RING ordering) within the field of view of any pointing.
+
+        This is the union of the pixels selected by calc_azza, with a margin of two pixels for the
+        horizon taper and for the sky interpolation of the topocentric engine. A SkyModel covering
+        these pixels is enough for make_visibilities. See SkyModel.read_hdf5.
+        """
+        if self.pointing_centers is None or self.fov is None:
+            raise AssertionError("Pointing centers and FoV must be set.")
+        radius = np.radians(self.fov) / 2. + 2 * hp.nside2resol(Nside)
+        cvecs = hp.ang2vec(*np.asarray(self.pointing_centers, dtype=float).T, lonlat=True).reshape(-1, 3)
+        observed = np.zeros(hp.nside2npix(Nside), dtype=bool)
+        for cvec in cvecs:
+            observed[hp.query_disc(Nside, cvec, radius, inclusive=True)] = True
+        return np.nonzero(observed)[0]
+
+    def _sky_rows(self, pix):
+        """
+        Map HEALPix pixels to rows of the SkyModel data array, which differ if the SkyModel
+        covers only part of the sky. See make_visibilities.
+        """
+        if self._pix_rows is None:
+            return pix
+        rows = self._pix_rows[pix]
+        if np.any(rows < 0):
+            raise ValueError("The field of view extends beyond the pixels in the SkyModel.")
+        return rows
+
     def _horizon_taper(self, za_arr):
         """
         For pixels near the edge of the FoV downweight flux
@@ -270,18 +782,342 @@ class Observatory(object):
 
         return fracs
 
-    def _vis_calc(self, pcents, tinds, shell, vis_array, Nfin, beam_pol='pI'):
+    def _block_sizes(self, Npix, Nskies, Nbls):
+        """
+        Choose the number of pixels and baselines to process together for one time.
+
+        If self.max_memory [GB] is set, the sizes are chosen to keep the work buffers under it.
+        Explicitly set self.pix_block and self.bl_chunk take precedence.
+
+        Returns:
+            pix_block, bl_chunk
+        """
+        Nfreqs = self.Nfreqs
+        if self.max_memory is None:
+            pix_block = Npix if self.pix_block is None else self.pix_block
+            bl_chunk = self.bl_chunk
+            if bl_chunk is None:
+                bl_chunk = int(self._fringe_chunk_bytes // (16 * min(pix_block, Npix) * Nfreqs))
+            return max(1, min(pix_block, Npix)), max(1, min(bl_chunk, Nbls))
+
+        # Work buffer bytes per pixel: beam, gathered and weighted sky, and fringe with its baseline projections.
+        budget = self.max_memory * 1e9 - 32 * Nfreqs * Nbls * Nskies   # Less the accumulated visibilities.
+        fixed_per_pix = 8 * Nfreqs * (2 + 3 * Nskies)
+        bl_chunk = Nbls if self.bl_chunk is None else min(self.bl_chunk, Nbls)
+        pix_block = self.pix_block
+        if pix_block is None:
+            pix_block = int(budget // (fixed_per_pix + (16 * Nfreqs + 8) * bl_chunk))
+            min_block = min(Npix, self._min_pix_block)
+            if pix_block < min_block and self.bl_chunk is None:
+                # Trade baselines per chunk for a reasonable pixel block size.
+                pix_block = min_block
+                bl_chunk = int((budget / pix_block - fixed_per_pix) // (16 * Nfreqs + 8))
+        return max(1, min(pix_block, Npix)), max(1, min(bl_chunk, Nbls))
+
+    def _bl_tile_size(self, Nprocs, Nunique, Ntasks, Npols):
+        """
+        Number of unique baselines per tile, for make_visibilities to split Ntasks (time, frequency)
+        tasks among Nprocs processes.
+
+        In units of the cost of one baseline, a tile of Nb baselines is taken to cost Nb, plus
+        self._tile_overhead_bls * Npols for its geometry, beam and sky gather. Tiles are handed out
+        as processes become free, so the run time is about ceil(Ntiles / Nprocs) tiles.
+        The number of baseline blocks that minimizes this is used. It is 1 if there are enough
+        tasks to keep the processes busy.
+        """
+        overhead = self._tile_overhead_bls * Npols
+        best_cost, best_size = None, Nunique
+        for Nblocks in range(1, min(Nunique, 8 * Nprocs) + 1):
+            size = int(np.ceil(Nunique / float(Nblocks)))
+            Ntiles = Ntasks * int(np.ceil(Nunique / float(size)))
+            cost = np.ceil(Ntiles / float(Nprocs)) * (overhead + size)
+            if best_cost is None or cost < best_cost:
+                best_cost, best_size = cost, size
+        return best_size
+
+    def _vis_direct(self, center, north, shell, Nskies, workspace, beam_pols=['pI']):
+        """
+        Visibilities for one pointing, evaluating the beam and fringes at the sky pixels
+        within the field of view. For engine='topocentric', the beam is interpolated from the table
+        made by _setup_topocentric instead.
+
+        Returns an array of shape (Nfreqs, Nunique, Npols * Nskies) from the workspace.
+
+        When called for successive baseline tiles of the same pointing (see make_visibilities), the
+        geometry, and the beam-weighted sky if the pixels are taken in one block, are reused from the workspace.
+        """
+        enus = self.unique_enus     # Shape (Nunique, 3)
+        real_dtype, complex_dtype = precision_dtypes(self.precision)
+        Npols = len(beam_pols)
+        timer = self._timer
+        key = (tuple(center), None if north is None else tuple(north), self.Nfreqs, self.freqs[0], tuple(beam_pols),
+               shell.__array_interface__['data'][0])
+        same_pointing = workspace.get('pointing_key') == key
+        if same_pointing:
+            za_arr, az_arr, pix = workspace['geometry']
+        else:
+            with timer.stage('geometry'):
+                za_arr, az_arr, pix = self.calc_azza(self.Nside, center, north, return_inds=True)
+                pix = self._sky_rows(pix)
+                workspace['geometry'] = (za_arr, az_arr, pix)
+        Npix = pix.size
+        pix_block, bl_chunk = self._block_sizes(Npix, Npols * Nskies, len(enus))
+        reuse_sky = same_pointing and workspace.get('whole_sky', False) and Npix <= pix_block
+        workspace['pointing_key'] = key
+        workspace['whole_sky'] = Npix <= pix_block
+
+        # Accumulate over pixel blocks in double precision, into a buffer of shape (Nfreqs, Nunique, Npols * Nskies).
+        vis = _get_buffer(workspace, 'vis', (self.Nfreqs, len(enus), Npols * Nskies), complex)
+        vis[()] = 0
+        for p0 in range(0, Npix, pix_block):
+            blk = slice(p0, min(p0 + pix_block, Npix))
+            Np = blk.stop - blk.start
+            sky = _get_buffer(workspace, 'sky', (self.Nfreqs, Npols * Nskies, Np), complex_dtype)
+            if not reuse_sky:
+                if self.do_horizon_taper:
+                    taper = self._horizon_taper(za_arr[blk]).reshape(Np, 1).astype(real_dtype)
+
+                # Gather the sky once per block, and weight by the beam of each polarization into a buffer of
+                # shape (Nfreqs, Npols * Nskies, Np), so the fringes are shared among polarizations.
+                # The weighted sky is stored as complex so the matrix products below need no casting.
+                gathered = _get_buffer(workspace, 'gathered', (Nskies, Np, self.Nfreqs), shell.dtype)
+                with timer.stage('gather'):
+                    np.take(shell, pix[blk], axis=-2, out=gathered, mode='clip')
+                if self._topo is not None:
+                    with timer.stage('beam_interp'):
+                        rows, weights = self._topo_weights(az_arr[blk], za_arr[blk])
+                        weights = weights[..., np.newaxis].astype(real_dtype)
+                for pi, pol in enumerate(beam_pols):
+                    with timer.stage('beam_val' if self._topo is None else 'beam_interp'):
+                        if self._topo is None:
+                            beam_cube = self.beam.beam_val(az_arr[blk], za_arr[blk], self.freqs, pol=pol).astype(real_dtype, copy=False)
+                        else:
+                            beam_cube = np.sum(self._topo['beam'][pi][rows] * weights, axis=0)
+                        if self.do_horizon_taper:
+                            beam_cube = beam_cube * taper
+                    with timer.stage('gather'):
+                        np.multiply(np.transpose(gathered, (2, 0, 1)), beam_cube.T[:, np.newaxis, :],
+                                    out=sky[:, pi * Nskies:(pi + 1) * Nskies], casting='same_kind')
+
+            for b0 in range(0, len(enus), bl_chunk):
+                Nb = min(bl_chunk, len(enus) - b0)
+                fringe_cube = _get_buffer(workspace, 'fringe', (self.Nfreqs, Nb, Np), complex_dtype)
+                with timer.stage('fringe'):
+                    make_fringes(az_arr[blk], za_arr[blk], self.freqs, enus[b0:b0 + Nb], recurrence=self.fringe_recurrence, out=fringe_cube)
+                prod = _get_buffer(workspace, 'prod', (self.Nfreqs, Nb, Npols * Nskies), complex_dtype)
+                with timer.stage('contraction'):
+                    np.matmul(fringe_cube, np.transpose(sky, (0, 2, 1)), out=prod)
+                    vis[:, b0:b0 + Nb] += prod
+        return vis
+
+    def _setup_topocentric(self, beam_pols=['pI']):
+        """
+        Tabulate the beam once on a fixed HEALPix grid in the topocentric frame, from which _vis_direct
+        interpolates it for engine='topocentric'. Called by make_visibilities.
+
+        The grid is a disc of HEALPix pixels around the equator point (1, 0, 0), where the pixels are
+        most regular, with the axes relabeled so that x = East, y = North and z = up.
+        Then az = arctan2(x, y) and za = arccos(z), as in calc_azza.
+
+        The grid has self._topo_oversample times the Nside of the sky, or less if the table of shape
+        (Npols, Npix, Nfreqs) would not fit in the memory budget. Bilinear interpolation from the table
+        has an error of about (grid pixel size / beam width)**2 / 4, relative to the beam peak. This is
+        estimated by comparing with the beam halfway between grid pixels, and a warning is issued if it
+        exceeds self._topo_beam_tol.
+        """
+        real_dtype, complex_dtype = precision_dtypes(self.precision)
+        budget = self._topo_table_bytes if self.max_memory is None else self.max_memory * 1e9 / 2.
+        grid_nside = self._topo_oversample * self.Nside
+        while True:
+            # Pad the disc, so the sky pixels at the edge of the field of view have their neighbours.
+            radius = min(self._fov_radius() + 2 * hp.nside2resol(grid_nside), np.pi)
+            pix = hp.query_disc(grid_nside, [1, 0, 0], radius)
+            table_bytes = np.dtype(real_dtype).itemsize * len(beam_pols) * self.Nfreqs * pix.size
+            if table_bytes <= budget or grid_nside == 1:
+                break
+            grid_nside //= 2
+        up, east, north = hp.pix2vec(grid_nside, pix)
+        za_arr = np.arccos(np.clip(up, -1, 1))
+        az_arr = np.arctan2(east, north) % (2 * np.pi)
+        # One extra row of zeros, for neighbours outside the disc.
+        table = np.zeros((len(beam_pols), pix.size + 1, self.Nfreqs), dtype=real_dtype)
+        for pi, pol in enumerate(beam_pols):
+            table[pi, :-1] = self.beam.beam_val(az_arr, za_arr, self.freqs, pol=pol)
+        self._topo = dict(nside=grid_nside, pix=pix, beam=table)
+
+        # Estimate the interpolation error at the centers of the pixels of a grid twice as fine.
+        test_pix = hp.query_disc(2 * grid_nside, [1, 0, 0], self._fov_radius())
+        test_pix = test_pix[::max(1, test_pix.size // 10000)]
+        up, east, north = hp.pix2vec(2 * grid_nside, test_pix)
+        za_arr = np.arccos(np.clip(up, -1, 1))
+        az_arr = np.arctan2(east, north) % (2 * np.pi)
+        rows, weights = self._topo_weights(az_arr, za_arr)
+        error = 0.
+        for pi, pol in enumerate(beam_pols):
+            exact = self.beam.beam_val(az_arr, za_arr, self.freqs, pol=pol)
+            interp = np.sum(table[pi][rows] * weights[..., np.newaxis], axis=0)
+            error = max(error, np.max(np.abs(interp - exact)) / max(np.max(np.abs(exact)), np.finfo(float).tiny))
+        self._topo['beam_error'] = float(error)
+        if error > self._topo_beam_tol:
+            warnings.warn("The beam is interpolated from the topocentric grid of Nside {} with a relative error of {:.2g}. "
+                          "engine='direct' evaluates it exactly.".format(grid_nside, error))
+
+    def _topo_weights(self, az, za):
+        """
+        Rows of the topocentric beam table (see _setup_topocentric) and bilinear weights, each of
+        shape (4, Npix), at the given azimuths and zenith angles.
+        """
+        topo = self._topo
+        theta, phi = hp.vec2ang(np.array([np.cos(za), np.sin(za) * np.sin(az), np.sin(za) * np.cos(az)]).T)
+        pix, weights = hp.get_interp_weights(topo['nside'], theta, phi)
+        rows = np.clip(np.searchsorted(topo['pix'], pix), 0, topo['pix'].size - 1)
+        rows[topo['pix'][rows] != pix] = topo['pix'].size
+        return rows, weights
+
+    def _mmode_frame(self):
+        """
+        Rotation matrix from ICRS to the frame of the celestial pole of date, about which a drift scan turns.
+
+        The pole is at azimuth 0 and altitude equal to the latitude, so it is found from the pointing
+        centers and north_poles, averaged over times. Its x axis is ICRS x projected onto its equator.
+        Without north_poles, this is the identity (the pole is taken to be the ICRS pole).
+        """
+        if self.north_poles is None:
+            return np.eye(3)
+        lat = np.radians(self.lat)
+        cvecs = hp.ang2vec(*np.asarray(self.pointing_centers, dtype=float).T, lonlat=True)
+        nvecs = hp.ang2vec(*np.asarray(self.north_poles, dtype=float).T, lonlat=True)
+        zvec = np.mean(np.sin(lat) * cvecs + np.cos(lat) * nvecs, axis=0)
+        zvec /= np.linalg.norm(zvec)
+        xvec = np.array([1., 0, 0]) - zvec[0] * zvec
+        xvec /= np.linalg.norm(xvec)
+        return np.array([xvec, np.cross(zvec, xvec), zvec])
+
+    def _mmode_visibilities(self, shell, beam_pols=['pI'], lmax=None):
+        """
+        Visibilities for a drift scan, from the spherical harmonic coefficients of the
+        sky and of the beam-weighted fringes. Called by make_visibilities for engine='mmode'.
+
+        As the pointing moves in RA by phi, the beam x fringe kernel K rotates about the pole, and
+        each of its coefficients K_lm picks up a phase exp(-i m phi). For a real sky T,
+            V(phi) = sum_lm K_lm conj(T_lm) exp(-i m phi),
+        a Fourier series in phi whose coefficients are summed over l once. The real and imaginary
+        parts of K are transformed separately, as real maps.
+
+        The rotation is about the celestial pole of date (see _mmode_frame), into whose frame the sky is rotated.
+        The kernel is evaluated there at RA = 0 and the mean declination of the pointings, with North at that
+        pole, so pointings must share a declination of date. This holds for a drift scan from set_pointings,
+        whose ICRS declinations vary over a day because of precession.
+
+        Returns an array of shape (Ntimes, Nunique, Npols, Nskies, Nfreqs), in the same units as _vis_calc.
+        """
+        enus = self.unique_enus
+        Nbls = len(enus)
+        Nskies = shell.shape[0]
+        Npix = shell.shape[1]
+        Nside = self.Nside
+        if lmax is None:
+            lmax = 3 * Nside - 1
+        rot = self._mmode_frame()
+        cvecs = hp.ang2vec(*np.asarray(self.pointing_centers, dtype=float).T, lonlat=True)
+        ras, decs = hp.vec2ang(np.dot(cvecs, rot.T), lonlat=True)
+        if np.ptp(decs) > np.degrees(hp.nside2resol(Nside)) / 10.:
+            raise ValueError("engine='mmode' requires all pointing centers to be at the same declination.")
+        phis = np.radians(ras)
+
+        timer = self._timer
+        with timer.stage('geometry'):
+            za_arr, az_arr, pix = self.calc_azza(Nside, [0., np.mean(decs)], return_inds=True)
+        with timer.stage('beam_val'):
+            beam_cube = np.array([self.beam.beam_val(az_arr, za_arr, self.freqs, pol=pol) for pol in beam_pols], dtype=float)
+            if self.do_horizon_taper:
+                beam_cube *= self._horizon_taper(za_arr).reshape(pix.size, 1)
+
+        # Start of each m in the healpy alm ordering, for summing over l.
+        m_starts = hp.Alm.getidx(lmax, np.arange(lmax + 1), np.arange(lmax + 1))
+
+        bl_chunk = self.bl_chunk
+        if bl_chunk is None:
+            bl_chunk = int(self._fringe_chunk_bytes // (16 * Npix))
+        bl_chunk = max(1, min(bl_chunk, Nbls))
+
+        vis = np.zeros((self.Ntimes, Nbls, len(beam_pols), Nskies, self.Nfreqs), dtype=complex)
+        kernel_maps = np.zeros((2 * bl_chunk, Npix))
+        for fi in range(self.Nfreqs):
+            with timer.stage('map2alm'):
+                sky_alm = np.atleast_2d(hp.map2alm(np.asarray(shell[..., fi], dtype=float), lmax=lmax, pol=False, iter=0))
+                if not np.allclose(rot, np.eye(3)):
+                    for si in range(Nskies):
+                        alm = sky_alm[si].copy()
+                        hp.rotate_alm(alm, matrix=rot)
+                        sky_alm[si] = alm
+                sky_alm = sky_alm.conj()     # Shape (Nskies, Nalm)
+            for b0 in range(0, Nbls, bl_chunk):
+                Nb = min(bl_chunk, Nbls - b0)
+                with timer.stage('fringe'):
+                    fringe = make_fringes(az_arr, za_arr, self.freqs[fi:fi + 1], enus[b0:b0 + Nb])[0]
+                for pi in range(len(beam_pols)):
+                    with timer.stage('map2alm'):
+                        kernel = fringe * beam_cube[pi, :, fi]
+                        kernel_maps[:2 * Nb, pix] = np.concatenate([kernel.real, kernel.imag])
+                        kernel_alm = np.atleast_2d(hp.map2alm(kernel_maps[:2 * Nb], lmax=lmax, pol=False, iter=0))
+
+                    # Coefficients of the Fourier series, of shape (2 * Nb, Nskies, lmax + 1)
+                    with timer.stage('contraction'):
+                        cm = np.add.reduceat(kernel_alm[:, np.newaxis, :] * sky_alm[np.newaxis], m_starts, axis=-1)
+                    with timer.stage('synthesis'):
+                        re = _mmode_synthesis(cm[:Nb], phis)
+                        im = _mmode_synthesis(cm[Nb:], phis)
+                        vis[:, b0:b0 + Nb, pi, :, fi] = re + 1j * im
+        # The alms integrate over solid angle, whereas the other engines sum over pixels.
+        return vis / self.pix_area_sr
+
+    def _vis_calc(self, pcents, tinds, shell, vis_array, Nfin, beam_pol='pI', workspace=None, chans=None, bls=None,
+                  out_inds=None):
         """
         Function sent to subprocesses. Called by make_visibilities.
 
         pcents : Pointing centers to evaluate.
         tinds : Array of indices in the time array (and correspondingly in pointings/north_poles)
         shell : SkyModel data array
-        vis_array : Output array for placing results.
+        vis_array : Shared output array of shape (Ntimes, Nunique, Npols, Nskies, Nfreqs), with one entry per
+                    redundant baseline group, or a slot of it (see out_inds). Results are written in place.
+        beam_pol : Beam polarization, or list of Npols polarizations.
         Nfin : Number of finished tasks. A variable shared among subprocesses.
+        workspace : dict of reusable work buffers (see _get_buffer). Pass the same dict to
+                    successive calls to avoid reallocating them.
+        chans : slice of the channels to evaluate. Default is all. Only this slice of the shell
+                is gathered, and the beam and fringes are only evaluated at these frequencies.
+        bls : slice of the unique baselines to evaluate. Default is all.
+        out_inds : Index along the first axis of vis_array at which to write each time. Default is tinds.
         """
         if len(pcents) == 0:
             return
+        if out_inds is None:
+            out_inds = tinds
+        if bls is not None and (bls.start, bls.stop) != (0, len(self.unique_enus)):
+            # Evaluate as if these were the only baselines.
+            enus = self.unique_enus
+            self.unique_enus = enus[bls]
+            try:
+                self._vis_calc(pcents, tinds, shell, vis_array[:, bls], Nfin, beam_pol=beam_pol, workspace=workspace, chans=chans,
+                               out_inds=out_inds)
+            finally:
+                self.unique_enus = enus
+            return
+        if chans is not None and (chans.start, chans.stop) != (0, self.Nfreqs):
+            # Evaluate as if these were the only channels.
+            freqs, topo = self.freqs, self._topo
+            self.freqs = freqs[chans]
+            self.Nfreqs = self.freqs.size
+            if topo is not None:
+                self._topo = dict(topo, beam=topo['beam'][..., chans])
+            try:
+                self._vis_calc(pcents, tinds, shell[..., chans], vis_array[..., chans], Nfin, beam_pol=beam_pol, workspace=workspace,
+                               out_inds=out_inds)
+            finally:
+                self.freqs, self.Nfreqs, self._topo = freqs, freqs.size, topo
+            return
 
         # Check for North Pole attribute.
         haspoles = True
@@ -289,38 +1125,258 @@ class Observatory(object):
             warnings.warn('North pole positions not set. Azimuths may be inaccurate.')
             haspoles = False
 
+        beam_pols = _pol_list(beam_pol)
+        Nskies = vis_array.shape[3]
+        if workspace is None:
+            workspace = {}
         for count, c in enumerate(pcents):
             memory_usage_GB = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e6
             if haspoles:
                 north = self.north_poles[tinds[count]]
             else:
                 north = None
-            za_arr, az_arr, pix = self.calc_azza(self.Nside, c, north, return_inds=True)
-            beam_cube = self.beam.beam_val(az_arr, za_arr, self.freqs, pol=beam_pol)
-            if self.do_horizon_taper:
-                horizon_taper = self._horizon_taper(za_arr).reshape(1, za_arr.size, 1)
-            else:
-                horizon_taper = 1.0
-            for bi, bl in enumerate(self.array):
-                fringe_cube = bl.get_fringe(az_arr, za_arr, self.freqs)
-                vis = np.sum(shell[..., pix, :] * horizon_taper * beam_cube * fringe_cube, axis=-2)
-                vis_array.put((tinds[count], bi, vis.tolist()))
+            vis = self._vis_direct(c, north, shell, Nskies, workspace, beam_pols=beam_pols)
+            with self._timer.stage('output'):
+                vis = vis.reshape(self.Nfreqs, vis.shape[1], len(beam_pols), Nskies)
+                vis_array[out_inds[count]] = np.transpose(vis, (1, 2, 3, 0))
             with Nfin.get_lock():
                 Nfin.value += 1
             if mp.current_process().name == '0':
                 if Nfin.value > 0:
                     dt = (time.time() - self.time0)
                     sys.stdout.write('Finished: {:d}, Elapsed {:.2f}min, Remain {:.3f}hour, MaxRSS {}GB\n'.format(
-                        Nfin.value, dt / 60., (1 / 3600.) * (dt / float(Nfin.value)) * (self.Ntimes - Nfin.value), memory_usage_GB))
+                        Nfin.value, dt / 60., (1 / 3600.) * (dt / float(Nfin.value)) * (self._Nsteps - Nfin.value), memory_usage_GB))
                     sys.stdout.flush()
 
-    def make_visibilities(self, shell, Nprocs=1, times_jd=None, beam_pol='pI'):
+    def _vis_worker(self, task_queue, status_queue, shell, vis_array, Nfin, beam_pol='pI', checkpoint=None, done_queue=None):
+        """
+        Function sent to subprocesses. Called by make_visibilities.
+
+        Pulls tasks of (time indices, channel slice, list of baseline slices, slot) from task_queue and passes them
+        to _vis_calc one time at a time, for each baseline tile in turn, until a None sentinel is received.
+        If slot is None, results are written to vis_array at the time indices. Otherwise, vis_array is a pool of
+        slots of shape (Nslots, time_chunk, ...), and they are written to vis_array[slot] from its first row.
+        So the geometry and beam-weighted sky of each time are computed once per task, and reused for its tiles. On exit, puts (process name, error, report) on status_queue,
+        where error is None on success or the formatted traceback of the exception raised, and
+        report holds the worker's stage timings and peak memory (None on error).
+        If a VisCheckpoint is given, finished tiles are saved to it every checkpoint.interval seconds and on exit.
+        If done_queue is given, the first time index of each finished tile is put on it.
+        A tile is finished when the whole task is.
+        """
+        name = mp.current_process().name
+        workspace = {}
+        self._timer = StageTimer()
+        finished = []
+        last_save = time.time()
+        try:
+            while True:
+                task = task_queue.get()
+                if task is None:
+                    break
+                tinds, chans, bl_tiles, slot = task
+                out, out_inds = vis_array, tinds
+                if slot is not None:
+                    out, out_inds = vis_array[slot], tinds - tinds[0]
+                for ti in range(len(tinds)):
+                    for bls in bl_tiles:
+                        self._vis_calc([self.pointing_centers[tinds[ti]]], tinds[ti:ti + 1], shell, out, Nfin,
+                                       beam_pol=beam_pol, workspace=workspace, chans=chans, bls=bls,
+                                       out_inds=out_inds[ti:ti + 1])
+                for bls in bl_tiles:
+                    if done_queue is not None:
+                        done_queue.put(int(tinds[0]))
+                    if checkpoint is not None:
+                        finished.append((int(tinds[0]), int(tinds[-1]) + 1, chans.start, chans.stop, bls.start, bls.stop))
+                if checkpoint is not None:
+                    if time.time() - last_save >= checkpoint.interval:
+                        with self._timer.stage('checkpoint'):
+                            checkpoint.save(vis_array, finished)
+                        finished, last_save = [], time.time()
+            if checkpoint is not None:
+                with self._timer.stage('checkpoint'):
+                    checkpoint.save(vis_array, finished)
+        except Exception:
+            status_queue.put((name, traceback.format_exc(), None))
+            return
+        status_queue.put((name, None, {'stages': self._timer.report(), 'max_rss_GB': max_rss_GB()}))
+
+    def _wait_for_workers(self, procs, status_queue, poll_interval=5.0, done_queue=None, on_done=None):
+        """
+        Block until every worker process has reported on status_queue.
+
+        If a worker raises an exception, or dies without reporting (e.g., it was killed),
+        the remaining workers are terminated and a RuntimeError is raised.
+        If done_queue is given, on_done is called with each item put on it, as they arrive.
+
+        Returns:
+            dict of {process name : report} from the workers. See _vis_worker.
+        """
+        Nrunning = len(procs)
+        reports = OrderedDict()
+        try:
+            while Nrunning > 0:
+                if done_queue is not None:
+                    self._drain(done_queue, on_done)
+                try:
+                    name, err, report = status_queue.get(timeout=poll_interval)
+                except queue.Empty:
+                    dead = [p.name for p in procs if p.exitcode is not None and p.exitcode != 0]
+                    if len(dead) > 0:
+                        raise RuntimeError("Process(es) {} exited unexpectedly.".format(', '.join(dead)))
+                    continue
+                if err is not None:
+                    raise RuntimeError("Exception in process {}:\n{}".format(name, err))
+                reports[name] = report
+                Nrunning -= 1
+        except BaseException:
+            for p in procs:
+                if p.is_alive():
+                    p.terminate()
+            raise
+        finally:
+            for p in procs:
+                p.join()
+        if done_queue is not None:
+            # The workers have exited, so everything they put on done_queue is in it.
+            self._drain(done_queue, on_done)
+        return reports
+
+    @staticmethod
+    def _drain(item_queue, callback):
+        """
+        Call callback on each item in item_queue, until it is empty.
+        """
+        while True:
+            try:
+                item = item_queue.get_nowait()
+            except queue.Empty:
+                return
+            callback(item)
+
+    @staticmethod
+    def _expand_baselines(vis, bl_groups, single_pol=False):
+        """
+        Copy the visibilities of each redundant baseline group to its members.
+
+        vis : Array of shape (Nt, Nunique, Npols, Nskies, Nfreqs), as computed by the workers.
+        bl_groups : The group of each baseline. See group_redundant_baselines.
+        single_pol : Drop the polarization axis.
+
+        Returns:
+            Array of shape (Nt * Nbls, Nskies, Nfreqs, Npols), ordered by time, then baseline.
+            The polarization axis is dropped if single_pol.
+        """
+        Nt, Nunique, Npols, Nskies, Nfreqs = vis.shape
+        Nbls = len(bl_groups)
+        if Nunique < Nbls:
+            vis = vis[:, bl_groups]
+        vis = vis.reshape(Nt * Nbls, Npols, Nskies, Nfreqs)
+        if single_pol:
+            return vis[:, 0]     # Shape (Nblts, Nskies, Nfreqs)
+        return np.moveaxis(vis, 1, -1)   # Shape (Nblts, Nskies, Nfreqs, Npols)
+
+    def _make_report(self, worker_reports, **sizes):
+        """
+        Timing and memory report for make_visibilities, combining this process's stages
+        (since the last report) with those of the workers. Resets this process's timer.
+
+        Returns a JSON-serializable dict with:
+            wall_time : seconds since the start of make_visibilities
+            stages : {stage : {'time', 'count'}}, summed over processes
+            workers : {process name : {'stages', 'max_rss_GB'}}
+            max_rss_GB : peak memory of this process
+            and the engine, problem sizes, and the sizes of the tiles of work (except for the mmode engine).
+        """
+        main_stages = self._timer.report()
+        stages = merge_stage_reports([main_stages] + [rep['stages'] for rep in worker_reports.values()])
+        report = OrderedDict([('engine', self.engine), ('precision', self.precision),
+                              ('Ntimes', self.Ntimes), ('Nfreqs', self.Nfreqs), ('Nunique', len(self.unique_enus))])
+        report.update(sorted(sizes.items()))
+        report['wall_time'] = time.time() - self.time0
+        report['stages'] = stages
+        report['main'] = OrderedDict([('stages', main_stages), ('max_rss_GB', max_rss_GB())])
+        report['workers'] = OrderedDict(worker_reports)
+        report['max_rss_GB'] = max([max_rss_GB()] + [rep['max_rss_GB'] for rep in worker_reports.values()])
+        self._timer = StageTimer()
+        return report
+
+    def make_visibilities(self, shell, Nprocs=1, times_jd=None, beam_pol='pI', time_chunk=None, freq_chunk=None, bl_tile=None, bl_chunk=None,
+                          redundant_tol=1e-3, fringe_recurrence=False, pix_block=None, max_memory=None,
+                          precision='double', engine='direct', lmax=None, checkpoint=None, block_callback=None):
         """
         Make beam cube and fringe cube, multiply and sum.
         shell (Npix, Nfreq) = healpix shell, as an mparray (multiprocessing shared array)
 
         Takes a shell in Kelvin
         Returns visibility in Jy
+
+        The shell may cover only part of the sky (given by its indices), as long as it includes
+        the field of view of every pointing. See observed_pixels.
+
+        beam_pol may be a single polarization, or a list of Npols polarizations. For a list, all
+        polarizations are simulated in one pass, sharing the geometry, fringes and sky gathers,
+        and the visibilities have shape (Nblts, Nskies, Nfreqs, Npols).
+
+        Work is handed out to the Nprocs worker processes in tiles of time_chunk integrations by
+        freq_chunk channels from a shared queue, so faster workers take on more tiles.
+        By default, all channels are in one tile, and time_chunk is chosen to give each process about
+        four tiles. Splitting the channels lets runs with few times use many processes. Each worker
+        then gathers only its channels of the shell, and evaluates the beam and fringes only at them.
+        Tiles may also split the unique baselines into blocks of bl_tile. By default, this is chosen by
+        a cost model to balance the work when there are few time x frequency tiles per process
+        (see _bl_tile_size). The baseline tiles of each time chunk and frequency block are handed out in
+        only as many groups as it takes to keep the processes busy, and a worker evaluates each time of its
+        group once for all of the group's tiles, reusing the geometry and beam-weighted sky.
+        An exception raised in any worker is re-raised here as a RuntimeError.
+        If checkpoint is a VisCheckpoint, finished tiles are saved to disk as the run goes, and a resumed
+        run only computes the tiles missing from it. Checkpoints are not used by the mmode engine.
+
+        If block_callback is given, the visibilities are not returned (None is returned in their place).
+        Instead, as soon as all tiles of a time chunk are finished, block_callback(time_inds, vis) is called
+        in this process with the time indices of the chunk and their visibilities, of shape
+        (len(time_inds) * Nbls, ...), ordered as the returned visibilities would be. Chunks may be
+        passed out of order. The workers then write into a pool of 2 * Nprocs shared slots of one time chunk
+        each, rather than a buffer of all times, and the tiles of a chunk are only queued once a slot is free.
+        So only these slots, and the output of one chunk, are in memory at a time, e.g., to write it to a file.
+        By default, time_chunk is chosen to keep the pool under about 1 GB.
+
+        For each time, the pixels in the field of view are processed in blocks of pix_block pixels.
+        For each block, the fringes of bl_chunk baselines are evaluated together and
+        contracted with the beam-weighted sky as a matrix product for each frequency.
+        By default, all pixels are taken in one block and bl_chunk is chosen to keep each fringe
+        array under 256 MB. If max_memory [GB] is given instead, pix_block and bl_chunk are chosen
+        so that each process's work buffers fit in it, independently of Nside and fov.
+
+        With precision='single', beam values, the weighted sky, fringes and the returned visibilities
+        are single precision (float32/complex64). Phases, and the sum over pixel blocks, are still
+        computed in double precision.
+
+        Baselines whose vectors agree to within redundant_tol meters are simulated once,
+        and the result is copied to every baseline in the group. The default of 1 mm is below
+        the precision of the layout files. Set redundant_tol to None to simulate every baseline.
+
+        If fringe_recurrence is True and the frequencies are uniformly spaced, fringes are
+        built channel-by-channel with a complex recurrence instead of cos/sin. See make_fringes.
+
+        After the run, self.report holds the time spent in each stage of the calculation (summed over
+        processes) and the peak memory of each process. See _make_report.
+
+        engine selects how each time is evaluated:
+            'direct' : The beam and fringes are evaluated at the sky pixels in the field of view for every time.
+            'topocentric' : The beam is evaluated once, on a fixed HEALPix grid in the topocentric frame (twice
+                            as fine as the sky), and for each time it is bilinearly interpolated from that grid to
+                            the sky pixels, where the fringes are evaluated exactly as for 'direct'. This avoids
+                            evaluating the beam per time, which dominates runs with a PowerBeam. The error relative
+                            to 'direct' is that of interpolating the beam, about (grid pixel size / beam width)**2 / 4,
+                            independently of the baseline length. A warning is issued if it exceeds 1e-3.
+                            (Resampling the sky onto a fixed grid instead smooths it on the scale of the fringes
+                            of all but the shortest baselines.) See _setup_topocentric.
+            'mmode' : For drift scans, with all pointings at the same declination of date. The spherical harmonic
+                      transforms of the sky and of beam x fringe are computed once per frequency (up to lmax,
+                      3 * Nside - 1 by default), and the visibilities are evaluated as a Fourier series in
+                      the RA of the pointings, by FFT if they evenly cover the full circle. This is done in the
+                      main process, so Nprocs, time_chunk, pix_block and max_memory do not apply. The pointings
+                      are rotated about the celestial pole of date, found from north_poles. See _mmode_visibilities.
         """
 
         Nskies = shell.Nskies
@@ -334,8 +1390,22 @@ class Observatory(object):
 
         self.time0 = time.time()
         Nbls = len(self.array)
+        self.bl_chunk = bl_chunk
+        self.pix_block = pix_block
+        self.max_memory = max_memory
+        self.precision = precision
+        real_dtype, complex_dtype = precision_dtypes(precision)
+        self.fringe_recurrence = fringe_recurrence
+        self.unique_enus, bl_groups = group_redundant_baselines([bl.enu for bl in self.array], tol=redundant_tol)
+        Nunique = self.unique_enus.shape[0]
         self.Nside = Nside
         self.freqs = np.array(self.freqs)
+        # For a partial-sky SkyModel, map HEALPix pixels into its data array.
+        self._pix_rows = None
+        sky_data = shell.data
+        if shell.indices is not None and not np.array_equal(shell.indices, np.arange(12 * Nside**2)):
+            self._pix_rows = np.full(12 * Nside**2, -1, dtype=np.int64)
+            self._pix_rows[shell.indices] = np.arange(shell.indices.size)
         conv_fact = jy2Tsr(np.array(self.freqs), bm=pix_area_sr)
 
         if self.pointing_centers is None and times_jd is None:
@@ -347,41 +1417,175 @@ class Observatory(object):
             self.set_pointings(times_jd)
 
         self.Ntimes = len(self.pointing_centers)
-        pcenter_list = np.array_split(self.pointing_centers, Nprocs)
-        time_inds = np.array_split(range(self.Ntimes), Nprocs)
-        procs = []
-        man = mp.Manager()
-        vis_array = man.Queue()
-        Nfin = mp.Value('i', 0)
-
-        if Nprocs > 1 and not isinstance(shell.data, mparray):
-            warnings.warn("Caution: SkyModel data array is not in shared memory. With Nprocs > 1, this will cause duplication.")
-
-        for pi in range(Nprocs):
-            p = mp.Process(name=str(pi), target=self._vis_calc, args=(pcenter_list[pi], time_inds[pi], shell.data, vis_array, Nfin), kwargs=dict(beam_pol=beam_pol))
-            p.start()
-            procs.append(p)
-        while (Nfin.value < self.Ntimes) and np.any([p.is_alive() for p in procs]):
-            continue
-        visibilities = []
-        time_inds, baseline_inds = [], []
-
-        for (ti, bi, varr) in iter(vis_array.get, None):
-            visibilities.append(varr)
-            N = len(varr)
-            time_inds += [ti]
-            baseline_inds += [bi]
-            if vis_array.empty():
-                break
+        if engine not in ('direct', 'topocentric', 'mmode'):
+            raise ValueError("engine must be 'direct', 'topocentric' or 'mmode'")
+        self.engine = engine
+        beam_pols = _pol_list(beam_pol)
+        Npols = len(beam_pols)
+        if engine == 'topocentric':
+            # Done before the workers are started, so they share it.
+            with self._timer.stage('setup'):
+                self._setup_topocentric(beam_pols=beam_pols)
+        worker_reports = {}
+        tile_sizes = {}
+        if engine == 'mmode':
+            if checkpoint is not None:
+                warnings.warn("Checkpoints are not used by the mmode engine.")
+            if self._pix_rows is not None:
+                # The spherical harmonic transforms need the full sky. Unobserved pixels don't contribute.
+                sky_data = np.zeros((Nskies, 12 * Nside**2, Nfreqs), dtype=shell.data.dtype)
+                sky_data[:, shell.indices] = shell.data
+            vis_array = self._mmode_visibilities(sky_data, beam_pols=beam_pols, lmax=lmax).astype(complex_dtype)
+        else:
+            if freq_chunk is None:
+                freq_chunk = Nfreqs
+            freq_chunk = max(1, min(freq_chunk, Nfreqs))
+            Nfblocks = int(np.ceil(Nfreqs / float(freq_chunk)))
+            if time_chunk is None:
+                time_chunk = max(1, int(np.ceil(self.Ntimes * Nfblocks / (4. * Nprocs))))
+                if block_callback is not None:
+                    # Keep the pool of output slots (see below) small.
+                    time_bytes = np.dtype(complex_dtype).itemsize * Nunique * Npols * Nskies * Nfreqs
+                    time_chunk = min(time_chunk, max(1, int(self._stream_buffer_bytes // (2 * Nprocs * time_bytes))))
+            time_chunk = min(time_chunk, self.Ntimes)
+            if bl_tile is None:
+                bl_tile = self._bl_tile_size(Nprocs, Nunique, int(np.ceil(self.Ntimes / float(time_chunk))) * Nfblocks, Npols)
+            bl_tile = max(1, min(bl_tile, Nunique))
+            out_shape = (self.Ntimes, Nunique, Npols, Nskies, Nfreqs)
+            finished = set()
+            if checkpoint is not None:
+                with self._timer.stage('checkpoint'):
+                    tiling, tiles = checkpoint.start(out_shape, complex_dtype,
+                                                     dict(time_chunk=time_chunk, freq_chunk=freq_chunk, bl_tile=bl_tile))
+                    time_chunk, freq_chunk, bl_tile = tiling['time_chunk'], tiling['freq_chunk'], tiling['bl_tile']
+                    finished = set(tiles)
+                if len(finished) > 0:
+                    print("Resuming from checkpoint, with {} tiles done.".format(len(finished)))
+            tile_sizes = dict(time_chunk=time_chunk, freq_chunk=freq_chunk, bl_tile=bl_tile)
+            # The baseline tiles of each time chunk and frequency block are split into just enough groups to give
+            # every process work, and each group is one task. So a worker computes the geometry and beam of each
+            # time once per group, rather than once per tile.
+            Ntasks = int(np.ceil(self.Ntimes / float(time_chunk))) * Nfblocks
+            Ngroups = max(1, int(np.ceil(Nprocs / float(Ntasks))))
+            self._Nsteps = 0    # For progress reports.
+            chunk_tasks = OrderedDict()     # Tasks of each time chunk
+            Nremaining = OrderedDict()     # Number of unfinished tiles of each time chunk
+            for ci in range(0, self.Ntimes, time_chunk):
+                chunk_tasks[ci], Nremaining[ci] = [], 0
+                tinds = np.arange(ci, min(ci + time_chunk, self.Ntimes))
+                for fi in range(0, Nfreqs, freq_chunk):
+                    tiles = [(ci, int(tinds[-1]) + 1, fi, min(fi + freq_chunk, Nfreqs), bi, min(bi + bl_tile, Nunique))
+                             for bi in range(0, Nunique, bl_tile)]
+                    tiles = [tile for tile in tiles if tile not in finished]
+                    if len(tiles) == 0:
+                        continue
+                    for group in np.array_split(np.arange(len(tiles)), min(Ngroups, len(tiles))):
+                        chunk_tasks[ci].append((tinds, slice(*tiles[0][2:4]), [slice(*tiles[i][4:]) for i in group]))
+                    self._Nsteps += len(tiles) * tinds.size
+                    Nremaining[ci] += len(tiles)
+
+            task_queue = mp.Queue()
+            status_queue = mp.Queue()
+            done_queue = None if block_callback is None else mp.Queue()
+            procs = []
+            Nfin = mp.Value('i', 0)
+            if block_callback is None:
+                # Workers write directly into this shared buffer, so no results need to be pickled back.
+                vis_array = mparray(out_shape, dtype=complex_dtype)
+                if checkpoint is not None:
+                    with self._timer.stage('checkpoint'):
+                        checkpoint.load(vis_array, sorted(finished))
+                for ci in chunk_tasks:
+                    for task in chunk_tasks[ci]:
+                        task_queue.put(task + (None,))
+                for pi in range(Nprocs):
+                    task_queue.put(None)
+            else:
+                # Workers write each time chunk into one of a small pool of shared slots, and tasks are queued as
+                # slots become free. A slot is passed to block_callback, saved to the checkpoint (by this process,
+                # since the slot is then reused), and recycled when all tiles of its chunk are finished.
+                Nslots = min(len(chunk_tasks), 2 * Nprocs)
+                slots = mparray((Nslots, time_chunk) + out_shape[1:], dtype=complex_dtype)
+                free_slots = list(range(Nslots))[::-1]
+                chunk_slot = {}
+                pending = list(chunk_tasks.keys())[::-1]
 
-        srt = np.lexsort((baseline_inds, time_inds))
-        time_inds = np.array(time_inds)[srt]
-        visibilities = np.array(visibilities)[srt]      # Shape (Nblts, Nskies, Nfreqs)
+                def finish_chunk(ci):
+                    slot = chunk_slot.pop(ci)
+                    tinds = np.arange(ci, min(ci + time_chunk, self.Ntimes))
+                    if checkpoint is not None:
+                        with self._timer.stage('checkpoint'):
+                            tiles = [(task[0][0], task[0][-1] + 1, task[1].start, task[1].stop, bls.start, bls.stop)
+                                     for task in chunk_tasks[ci] for bls in task[2]]
+                            checkpoint.save(slots[slot], [tuple(int(t) for t in tile) for tile in tiles], time_offset=ci)
+                    with self._timer.stage('assembly'):
+                        vis = self._expand_baselines(slots[slot, :tinds.size] / conv_fact, bl_groups,
+                                                     single_pol=isinstance(beam_pol, str))
+                        block_callback(tinds, vis)
+                    free_slots.append(slot)
+
+                def fill_slots():
+                    while len(free_slots) > 0 and len(pending) > 0:
+                        ci = pending.pop()
+                        chunk_slot[ci] = free_slots.pop()
+                        if checkpoint is not None:
+                            with self._timer.stage('checkpoint'):
+                                checkpoint.load(slots[chunk_slot[ci]], sorted(t for t in finished if t[0] == ci), time_offset=ci)
+                        for task in chunk_tasks[ci]:
+                            task_queue.put(task + (chunk_slot[ci],))
+                        if Nremaining[ci] == 0:
+                            # Loaded whole from the checkpoint.
+                            finish_chunk(ci)
+                    if len(pending) == 0 and len(sentinels) == 0:
+                        for pi in range(Nprocs):
+                            task_queue.put(None)
+                        sentinels.append(True)
+
+                def finish_tile(ci):
+                    Nremaining[ci] -= 1
+                    if Nremaining[ci] == 0:
+                        finish_chunk(ci)
+                        fill_slots()
+
+                sentinels = []
+                vis_array = slots
+                fill_slots()
+
+            shared = isinstance(sky_data, np.memmap) or (isinstance(sky_data, mparray) and sky_data.is_shared)
+            if Nprocs > 1 and not shared:
+                warnings.warn("Caution: SkyModel data array is not in shared memory. With Nprocs > 1, this will cause duplication.")
+
+            for pi in range(Nprocs):
+                p = mp.Process(name=str(pi), target=self._vis_worker, args=(task_queue, status_queue, sky_data, vis_array, Nfin),
+                               kwargs=dict(beam_pol=beam_pols, checkpoint=checkpoint if block_callback is None else None,
+                                           done_queue=done_queue))
+                p.start()
+                procs.append(p)
+            if block_callback is None:
+                worker_reports = self._wait_for_workers(procs, status_queue)
+            else:
+                worker_reports = self._wait_for_workers(procs, status_queue, poll_interval=0.5,
+                                                        done_queue=done_queue, on_done=finish_tile)
+            self._topo = None
+
+        # Fill in redundant baselines. Output is ordered by time, then baseline.
+        visibilities = None
+        if block_callback is None or engine == 'mmode':
+            with self._timer.stage('assembly'):
+                visibilities = np.asarray(vis_array)
+                visibilities /= conv_fact
+                visibilities = self._expand_baselines(visibilities, bl_groups, single_pol=isinstance(beam_pol, str))
+                if block_callback is not None:
+                    block_callback(np.arange(self.Ntimes), visibilities)
+                    visibilities = None
+        time_inds = np.repeat(np.arange(self.Ntimes), Nbls)
         if self.times_jd is not None:
             time_array = self.times_jd[time_inds]
         else:
             time_array = None
-        baseline_array = np.array(baseline_inds)[srt]
+        baseline_array = np.tile(np.arange(Nbls), self.Ntimes)
+
+        self.report = self._make_report(worker_reports, Nprocs=Nprocs, Nbls=Nbls, Nskies=Nskies, Npols=Npols, **tile_sizes)
 
         # Time and baseline arrays are now Nblts
-        return visibilities / conv_fact, time_array, baseline_array
+        return visibilities, time_array, baseline_array
@@ -10,8 +10,11 @@ import sys
 import os
 import ast
 import copy
+import json
+import hashlib
 import warnings
 
+import h5py
 from pyuvdata import UVData, UVBeam
 from pyuvdata import utils as uvutils
 
@@ -288,13 +291,15 @@ def parse_time_params(time_params):
     return return_dict
 
 
-def complete_uvdata(uv_obj, run_check=True):
+def complete_uvdata(uv_obj, run_check=True, fill_data=True):
     """
     Given a UVData object lacking Nblts-length arrays, fill out the rest.
 
     Args:
         uv_obj : UVData object to finish.
         run_check: Run the standard UVData checks.
+        fill_data: Allocate the data (zeros), flag and nsample arrays. If False, they are left as
+            they are, e.g., to initialize a uvh5 file without holding its data in memory.
     """
     anums = uv_obj.antenna_numbers      # (Nants_telescope,)
     antnames = uv_obj.antenna_names     # (Nants_telescope,)
@@ -315,9 +320,10 @@ def complete_uvdata(uv_obj, run_check=True):
     uv_obj.set_lsts_from_time_array()
 
     # fill in data
-    uv_obj.data_array = np.zeros((uv_obj.Nblts, uv_obj.Nspws, uv_obj.Nfreqs, uv_obj.Npols), dtype=np.complex128)
-    uv_obj.flag_array = np.zeros((uv_obj.Nblts, uv_obj.Nspws, uv_obj.Nfreqs, uv_obj.Npols), dtype=np.bool)
-    uv_obj.nsample_array = np.ones((uv_obj.Nblts, uv_obj.Nspws, uv_obj.Nfreqs, uv_obj.Npols), dtype=np.float64)
+    if fill_data:
+        uv_obj.data_array = np.zeros((uv_obj.Nblts, uv_obj.Nspws, uv_obj.Nfreqs, uv_obj.Npols), dtype=np.complex128)
+        uv_obj.flag_array = np.zeros((uv_obj.Nblts, uv_obj.Nspws, uv_obj.Nfreqs, uv_obj.Npols), dtype=np.bool)
+        uv_obj.nsample_array = np.ones((uv_obj.Nblts, uv_obj.Nspws, uv_obj.Nfreqs, uv_obj.Npols), dtype=np.float64)
 
     # Other attributes
     uv_obj.set_uvws_from_antenna_positions()
@@ -476,7 +482,7 @@ def setup_uvdata(array_layout=None, telescope_location=None, telescope_name=None
 
 def setup_observatory_from_uvdata(uv_obj, fov=180, set_pointings=True, beam=None, beam_kwargs={},
                                   beam_freq_interp='cubic', smooth_beam=False, smooth_scale=2.0,
-                                  freq_chans=None, apply_horizon_taper=False, pointings=None):
+                                  freq_chans=None, apply_horizon_taper=False, pointings=None, precision=None):
     """
     Setup an Observatory object from a UVData object.
 
@@ -501,6 +507,10 @@ def setup_observatory_from_uvdata(uv_obj, fov=180, set_pointings=True, beam=None
             Frequency channel indices to use from uv_obj when setting observatory freqs.
         apply_horizon_taper : bool
             When simulating, weight pixels near horizon by the fraction of the pixel area that is up.
+        precision : str
+            'single' or 'double'. Precision of the beam data and values. Beam objects passed in
+            are copied at this precision. Default is double for beams made here, and to leave beam
+            objects as they are.
 
     Returns:
         Observatory object
@@ -539,7 +549,7 @@ def setup_observatory_from_uvdata(uv_obj, fov=180, set_pointings=True, beam=None
             obs.beam.interp_freq(obs.freqs, inplace=True, kind=beam_freq_interp)
 
         elif isinstance(beam, (str, np.str)) or callable(beam):
-            obs.set_beam(beam, freq_interp_kind=beam_freq_interp, **beam_kwargs)
+            obs.set_beam(beam, freq_interp_kind=beam_freq_interp, precision=precision or 'double', **beam_kwargs)
 
         elif isinstance(beam, beam_model.PowerBeam):
             obs.beam = beam.interp_freq(obs.freqs, inplace=False, kind=beam_freq_interp)
@@ -547,6 +557,13 @@ def setup_observatory_from_uvdata(uv_obj, fov=180, set_pointings=True, beam=None
         elif isinstance(beam, beam_model.AnalyticBeam):
             obs.beam = beam
 
+        if precision is not None and getattr(obs.beam, 'precision', 'double') != precision:
+            if isinstance(obs.beam, beam_model.AnalyticBeam):
+                obs.beam = copy.copy(obs.beam)
+                obs.beam.precision = precision
+            else:
+                obs.beam.set_precision(precision)
+
     # smooth the beam
     if isinstance(obs.beam, beam_model.PowerBeam) and smooth_beam:
         obs.beam.smooth_beam(obs.freqs, inplace=True, freq_ls=smooth_scale)
@@ -554,18 +571,45 @@ def setup_observatory_from_uvdata(uv_obj, fov=180, set_pointings=True, beam=None
     return obs
 
 
-def run_simulation(param_file, Nprocs=1, sjob_id=None, add_to_history=''):
+def _obsparam_fingerprint(param_dict):
+    """
+    SHA-1 hash of the obsparams that determine the visibilities, as a hex string.
+
+    Filing, process count, memory and tiling parameters are left out, since they
+    may change between a run and its resumption.
+    """
+    skip = ['filing', 'Nprocs', 'max_memory', 'time_chunk', 'freq_chunk', 'bl_tile', 'geometry_cache',
+            'checkpoint_dir', 'checkpoint_interval']
+    params = {k: v for k, v in param_dict.items() if k not in skip}
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def run_simulation(param_file, Nprocs=1, sjob_id=None, add_to_history='', resume=False):
     """
     Parse input parameter file, construct UVData and SkyModel objects, and run simulation.
 
     (Moved code from wrapper to here)
+
+    If the obsparam key 'checkpoint_dir' is given, finished blocks of visibilities are saved there
+    every 'checkpoint_interval' seconds (default 600), and removed once the output is written.
+    Blocks are saved as their tiles finish, so checkpointed runs split the work into tiles of one time
+    by default, rather than about four per process. Set the 'time_chunk' obsparam key for larger tiles.
+    With resume=True, a run continues from the checkpoint, after checking that it was made with the
+    same obsparams and SkyModel. See observatory.VisCheckpoint.
+
+    Returns a report of the time spent in each stage and the peak memory of each process.
+    If filing parameter 'timing_report' is True, it is also written to a JSON file next to each
+    output file (with extension .timing.json), and if 'timing_extra_keywords' is True, the
+    simulation stages are stored in the 'timing' extra keyword of the output files.
     """
+    timer = utils.StageTimer()
     # parse parameter dictionary
     if isinstance(param_file, (str, np.str)):
         with open(param_file, 'r') as yfile:
             param_dict = yaml.safe_load(yfile)
     else:
         param_dict = copy.deepcopy(param_file)
+    obsparam_fingerprint = _obsparam_fingerprint(param_dict)
 
     sys.stdout.flush()
     freq_dict = parse_frequency_params(param_dict['freq'])
@@ -586,35 +630,23 @@ def run_simulation(param_file, Nprocs=1, sjob_id=None, add_to_history=''):
     if 'Nprocs' in param_dict:
         Nprocs = param_dict['Nprocs']
     print("Nprocs: ", Nprocs)
+    max_memory = param_dict.get('max_memory', None)     # GB per process
+    time_chunk = param_dict.get('time_chunk', None)     # Times per task
+    freq_chunk = param_dict.get('freq_chunk', None)     # Channels per task, to split work over frequency
+    bl_tile = param_dict.get('bl_tile', None)   # Unique baselines per task, to split work over baselines
+    precision = param_dict.get('precision', 'double')
+    engine = param_dict.get('engine', 'direct')
+    geometry_cache = param_dict.get('geometry_cache', None)     # Directory for cached pointing geometry
+    observed_region_only = param_dict.get('observed_region_only', False)    # Only load pixels in the field of view
+    checkpoint_dir = param_dict.get('checkpoint_dir', None)     # Directory for checkpoints of finished blocks
+    checkpoint_interval = param_dict.get('checkpoint_interval', 600.)   # Seconds between checkpoints
+    if checkpoint_dir is not None and time_chunk is None:
+        # Small tiles, so a checkpoint holds most of the work done by the time it is saved.
+        time_chunk = 1
+    if resume and checkpoint_dir is None:
+        raise ValueError("Resuming requires the checkpoint_dir obsparam key.")
     sys.stdout.flush()
 
-    # ---------------------------
-    # SkyModel
-    # ---------------------------
-    # construct sky model
-    if 'Nskies' not in skyparam:
-        skyparam['Nskies'] = Nskies
-    else:
-        Nskies = skyparam['Nskies']
-    sky_type = skyparam.pop('sky_type')
-    savepath = None
-    if 'savepath' in skyparam:
-        savepath = skyparam.pop('savepath')
-
-    sky = sky_model.construct_skymodel(sky_type, **skyparam)
-
-    # If loading a healpix map from disk, confirm its frequencies match the obsparam frequencies.
-    if sky_type.lower() not in ['flat_spec', 'gsm']:
-        try:
-            assert np.allclose(freq_array, sky.freqs)
-        except AssertionError:
-            print(sky.freqs, freq_array)
-            raise ValueError('Obsparam frequencies do not match loaded frequencies.')
-    else:
-        # write to disk if requested
-        if savepath is not None:
-            sky.write_hdf5(savepath)
-
     # ---------------------------
     # UVData object
     # ---------------------------
@@ -653,34 +685,56 @@ def run_simulation(param_file, Nprocs=1, sjob_id=None, add_to_history=''):
         points = ast.literal_eval(points)
         set_pointings = False
     fov = beam_attr.pop('fov')
-    obs = setup_observatory_from_uvdata(uv_obj, fov=fov, set_pointings=set_pointings,
-                                        beam=beam_type, beam_kwargs=beam_attr, beam_freq_interp=beam_freq_interp,
-                                        smooth_beam=smooth_beam, smooth_scale=smooth_scale, apply_horizon_taper=apply_horizon_taper,
-                                        pointings=points)
+    with timer.stage('observatory'):
+        obs = setup_observatory_from_uvdata(uv_obj, fov=fov, set_pointings=set_pointings,
+                                            beam=beam_type, beam_kwargs=beam_attr, beam_freq_interp=beam_freq_interp,
+                                            smooth_beam=smooth_beam, smooth_scale=smooth_scale, apply_horizon_taper=apply_horizon_taper,
+                                            pointings=points, precision=precision)
+    if geometry_cache is not None:
+        obs.geometry_cache = observatory.GeometryCache(cache_dir=geometry_cache)
     # ---------------------------
-    # Run simulation
+    # SkyModel
+    # ---------------------------
+    # construct sky model
+    if 'Nskies' not in skyparam:
+        skyparam['Nskies'] = Nskies
+    else:
+        Nskies = skyparam['Nskies']
+    sky_type = skyparam.pop('sky_type')
+    skyparam['precision'] = precision
+    savepath = None
+    if 'savepath' in skyparam:
+        savepath = skyparam.pop('savepath')
+
+    if observed_region_only:
+        # Only make or read the part of the sky seen by the observatory.
+        skyparam['pixels'] = obs
+    with timer.stage('sky_model'):
+        sky = sky_model.construct_skymodel(sky_type, **skyparam)
+
+    # If loading a healpix map from disk, confirm its frequencies match the obsparam frequencies.
+    if sky_type.lower() not in ['flat_spec', 'gsm']:
+        try:
+            assert np.allclose(freq_array, sky.freqs)
+        except AssertionError:
+            print(sky.freqs, freq_array)
+            raise ValueError('Obsparam frequencies do not match loaded frequencies.')
+    else:
+        # write to disk if requested
+        if savepath is not None:
+            sky.write_hdf5(savepath)
+
+    # ---------------------------
+    # Fill in the UVData object and set up output files.
     # ---------------------------
-    print("Running simulation")
-    sys.stdout.flush()
-    visibility = []
     beam_sq_int = {}
-    print('Nskies: {}'.format(sky.Nskies))
-    sys.stdout.flush()
     if pols is None:
         warnings.warn("No polarization specified. Defaulting to pI")
         pols = ['pI']
     for pol in pols:
-        # calculate visibility
-        visibs, time_array, baseline_inds = obs.make_visibilities(sky, Nprocs=Nprocs, beam_pol=pol)
-        visibility.append(visibs)
         # Average Beam^2 integral across frequency
         beam_sq_int['bm_sq_{}'.format(pol)] = np.asscalar(obs.beam_sq_int(sky.ref_freq, sky.Nside, obs.pointing_centers[0], beam_pol=pol))
 
-    visibility = np.moveaxis(visibility, 0, -1)
-
-    # ---------------------------
-    # Fill in the UVData object and write out.
-    # ---------------------------
     param_history = "\nPARAMETER FILE:\nFILING\n{filing}\nSIMULATION\n{tel}\n{beam}\n" \
                     "SKYPARAM\n{sky}\n".format(filing=param_dict['filing'], tel=param_dict['telescope'], beam=param_dict['beam'],
                                                sky=param_dict['skyparam'])
@@ -689,9 +743,8 @@ def run_simulation(param_file, Nprocs=1, sjob_id=None, add_to_history=''):
     if sjob_id is None:
         sjob_id = ''
 
-    del sky.data    # Free up memory of sky model.
-
-    uv_obj = complete_uvdata(uv_obj)
+    # The data arrays are filled in from the visibilities, or never held in memory when streaming.
+    uv_obj = complete_uvdata(uv_obj, run_check=False, fill_data=False)
 
     uv_obj.extra_keywords = {'nside': sky.Nside, 'slurm_id': sjob_id, 'fov': obs.fov}
     uv_obj.extra_keywords.update(beam_sq_int)
@@ -704,18 +757,18 @@ def run_simulation(param_file, Nprocs=1, sjob_id=None, add_to_history=''):
     if sky.pspec_amp is not None:
         uv_obj.extra_keywords['skysig'] = sky.pspec_amp   # Flat spectrum sources
 
+    if 'format' in filing_params:
+        out_format = filing_params['format']
+    else:
+        out_format = 'uvh5'
+    stream = filing_params.get('stream', False)     # Write blocks of times to the output files as they are finished
+    if stream and out_format != 'uvh5':
+        raise ValueError("Streaming output requires the uvh5 format.")
+    if 'clobber' not in filing_params:
+        filing_params['clobber'] = False
+
+    outfiles = []
     for si in range(Nskies):
-        # get the sky slice
-        vis = visibility[:, si]  # vis = (Nblts, Nfreqs, Npols)
-        uv_obj.data_array = vis[:, np.newaxis, :, :]  # (Nblts, Nspws, Nfreqs, Npols)
-
-        uv_obj.check()
-
-        if 'format' in filing_params:
-            out_format = filing_params['format']
-        else:
-            out_format = 'uvh5'
-
         if 'outfile_suffix' not in filing_params:
             if Nskies > 1:
                 filing_params['outfile_suffix'] = '{}sky_uv'.format(si)
@@ -748,23 +801,98 @@ def run_simulation(param_file, Nprocs=1, sjob_id=None, add_to_history=''):
         if dirname != '' and not os.path.exists(dirname):
             os.mkdir(dirname)
 
-        print("...writing {}".format(outfile_name))
-        if 'clobber' not in filing_params:
-            filing_params['clobber'] = False
-        if out_format == 'uvh5':
-            uv_obj.write_uvh5(outfile_name, clobber=filing_params['clobber'])
-        elif out_format == 'miriad':
-            uv_obj.write_miriad(outfile_name, clobber=filing_params['clobber'])
-        elif out_format == 'uvfits':
-            uv_obj.write_uvfits(outfile_name, force_phase=True, spoof_nonessential=True)
+        outfiles.append(outfile_name)
         filing_params.pop('outfile_suffix', None)
 
+    write_block = None
+    if stream:
+        with timer.stage('write'):
+            for outfile_name in outfiles:
+                print("...initializing {}".format(outfile_name))
+                uv_obj.initialize_uvh5_file(outfile_name, clobber=filing_params['clobber'])
+
+        def write_block(time_inds, vis):
+            # Baselines are in the same order for every time, so the block is a contiguous range of blts.
+            blt_inds = np.arange(time_inds[0] * uv_obj.Nbls, (time_inds[-1] + 1) * uv_obj.Nbls)
+            flags = np.zeros((blt_inds.size, 1, uv_obj.Nfreqs, uv_obj.Npols), dtype=np.bool)
+            nsamples = np.ones(flags.shape, dtype=np.float64)
+            with timer.stage('write'):
+                for si, outfile_name in enumerate(outfiles):
+                    uv_obj.write_uvh5_part(outfile_name, vis[:, si, np.newaxis], flags, nsamples, blt_inds=blt_inds)
+
+    # ---------------------------
+    # Run simulation
+    # ---------------------------
+    print("Running simulation")
+    sys.stdout.flush()
+    print('Nskies: {}'.format(sky.Nskies))
+    sys.stdout.flush()
+    checkpoint = None
+    if checkpoint_dir is not None:
+        with timer.stage('checkpoint'):
+            fingerprint = {'obsparam': obsparam_fingerprint, 'sky': sky.fingerprint()}
+        checkpoint = observatory.VisCheckpoint(checkpoint_dir, fingerprint=fingerprint, interval=checkpoint_interval,
+                                               resume=resume)
+    # calculate visibility for all polarizations in one pass. Shape (Nblts, Nskies, Nfreqs, Npols)
+    with timer.stage('simulation'):
+        visibility, time_array, baseline_inds = obs.make_visibilities(sky, Nprocs=Nprocs, beam_pol=pols, max_memory=max_memory,
+                                                                      precision=precision, engine=engine, time_chunk=time_chunk,
+                                                                      freq_chunk=freq_chunk, bl_tile=bl_tile,
+                                                                      checkpoint=checkpoint, block_callback=write_block)
+
+    del sky.data    # Free up memory of sky model.
+
+    # ---------------------------
+    # Write out.
+    # ---------------------------
+    timing = json.dumps({name: round(stage['time'], 3) for name, stage in obs.report['stages'].items()})
+    if stream:
+        if filing_params.get('timing_extra_keywords', False):
+            # The header was written before the simulation ran.
+            for outfile_name in outfiles:
+                with h5py.File(outfile_name, 'r+') as h5f:
+                    h5f['Header/extra_keywords']['timing'] = timing
+    else:
+        if filing_params.get('timing_extra_keywords', False):
+            uv_obj.extra_keywords['timing'] = timing
+        uv_obj.flag_array = np.zeros((uv_obj.Nblts, 1, uv_obj.Nfreqs, uv_obj.Npols), dtype=np.bool)
+        uv_obj.nsample_array = np.ones(uv_obj.flag_array.shape, dtype=np.float64)
+        for si, outfile_name in enumerate(outfiles):
+            # get the sky slice
+            vis = visibility[:, si]  # vis = (Nblts, Nfreqs, Npols)
+            uv_obj.data_array = vis[:, np.newaxis, :, :]  # (Nblts, Nspws, Nfreqs, Npols)
+
+            uv_obj.check()
+
+            print("...writing {}".format(outfile_name))
+            with timer.stage('write'):
+                if out_format == 'uvh5':
+                    uv_obj.write_uvh5(outfile_name, clobber=filing_params['clobber'])
+                elif out_format == 'miriad':
+                    uv_obj.write_miriad(outfile_name, clobber=filing_params['clobber'])
+                elif out_format == 'uvfits':
+                    uv_obj.write_uvfits(outfile_name, force_phase=True, spoof_nonessential=True)
+
+    if checkpoint is not None:
+        # The output is written, so the checkpoint is no longer needed.
+        checkpoint.clear()
+
+    report = {'stages': timer.report(), 'simulation': obs.report, 'max_rss_GB': utils.max_rss_GB()}
+    if filing_params.get('timing_report', False):
+        for outfile_name in outfiles:
+            with open(outfile_name + '.timing.json', 'w') as jfile:
+                json.dump(report, jfile, indent=2)
+    return report
+
 
 def run_simulation_partial_freq(freq_chans, uvh5_file, skymod_file, fov=180, beam=None, beam_kwargs={},
                                 beam_freq_interp='linear', smooth_beam=True, smooth_scale=2.0, Nprocs=1,
-                                add_to_history=None):
+                                add_to_history=None, geometry_cache=None, observed_region_only=False,
+                                time_inds=None, write_lock=None, apply_horizon_taper=False, precision='double',
+                                engine='direct', max_memory=None, time_chunk=None, freq_chunk=None, bl_tile=None,
+                                pointings=None):
     """
-    Run a healvis simulation on a selected range of frequency channels.
+    Run a healvis simulation on a selected range of frequency channels, and optionally of times.
 
     Requires a pyuvdata.UVH5 file and SkyModel file (HDF5 format) to exist
     on disk with matching frequencies.
@@ -790,39 +918,273 @@ def run_simulation_partial_freq(freq_chans, uvh5_file, skymod_file, fov=180, bea
             Number of processes for this task
         add_to_history : str
             History string to append to file history. Default is no append to history.
+        geometry_cache : str
+            Directory in which to cache the pointing geometry, shared with other runs. See observatory.GeometryCache.
+        observed_region_only : bool
+            If True, only read the pixels of the SkyModel within the field of view of the pointings.
+        time_inds : integer 1D array
+            Indices of the (unique) times of uvh5_file to simulate. Default is all.
+        write_lock : str
+            Path of a lock file to hold while writing, so that simultaneous jobs write to uvh5_file in turn.
+        apply_horizon_taper : bool
+            When simulating, weight pixels near horizon by the fraction of the pixel area that is up.
+        precision : str
+            'single' or 'double'. Precision of the sky, beam and simulation.
+        engine, max_memory, time_chunk, freq_chunk, bl_tile :
+            Passed to Observatory.make_visibilities.
+        pointings : list
+            (RA, Dec) [deg] pointing centers of every (unique) time of uvh5_file. Default is to point at zenith.
 
     Result:
         Writes simulation result into uvh5_file
+
+    Returns:
+        Timing and memory report of the simulation. See Observatory._make_report.
     """
     # load UVH5 metadata
     uvd = UVData()
     uvd.read_uvh5(uvh5_file, read_data=False)
     pols = [uvutils.polnum2str(pol) for pol in uvd.polarization_array]
+    blt_inds = None
+    if time_inds is not None:
+        blt_inds = np.nonzero(np.isin(uvd.time_array, np.unique(uvd.time_array)[time_inds]))[0]
+        uvd.select(blt_inds=blt_inds)
+        if pointings is not None:
+            pointings = [pointings[ti] for ti in time_inds]
+
+    # setup observatory
+    obs = setup_observatory_from_uvdata(uvd, fov=fov, set_pointings=pointings is None, beam=beam, beam_kwargs=beam_kwargs,
+                                        freq_chans=freq_chans, beam_freq_interp=beam_freq_interp, smooth_beam=smooth_beam,
+                                        smooth_scale=smooth_scale, apply_horizon_taper=apply_horizon_taper,
+                                        pointings=pointings, precision=precision)
+    if geometry_cache is not None:
+        obs.geometry_cache = observatory.GeometryCache(cache_dir=geometry_cache)
 
     # load SkyModel
     sky = sky_model.SkyModel()
-    sky.read_hdf5(skymod_file, freq_chans=freq_chans, shared_memory=False)
+    sky.read_hdf5(skymod_file, freq_chans=freq_chans, shared_memory=False, precision=precision,
+                  pixels=obs if observed_region_only else None)
 
     # Check that chosen freqs are a subset of the skymodel frequencies.
     assert np.isclose(sky.freqs, uvd.freq_array[0, freq_chans]).all(), "Frequency arrays in UHV5 file {} and SkyModel file {} don't agree".format(uvh5_file, skymod_file)
 
-    # setup observatory
-    obs = setup_observatory_from_uvdata(uvd, fov=fov, set_pointings=True, beam=beam, beam_kwargs=beam_kwargs,
-                                        freq_chans=freq_chans, beam_freq_interp=beam_freq_interp, smooth_beam=smooth_beam,
-                                        smooth_scale=smooth_scale)
-
-    # run simulation
-    visibility = []
-    beam_sq_int = {}
-    for pol in pols:
-        # calculate visibility
-        visibs, time_array, baseline_inds = obs.make_visibilities(sky, Nprocs=Nprocs, beam_pol=pol)
-        visibility.append(visibs)
-
-    visibility = np.moveaxis(visibility, 0, -1)
+    # run simulation for all polarizations in one pass. Shape (Nblts, Nskies, Nfreqs, Npols)
+    visibility, time_array, baseline_inds = obs.make_visibilities(sky, Nprocs=Nprocs, beam_pol=pols, max_memory=max_memory,
+                                                                  precision=precision, engine=engine, time_chunk=time_chunk,
+                                                                  freq_chunk=freq_chunk, bl_tile=bl_tile)
     flags = np.zeros_like(visibility, np.bool)
     nsamples = np.ones_like(visibility, np.float)
 
     # write to disk
     print("...writing to {}".format(uvh5_file))
-    uvd.write_uvh5_part(uvh5_file, visibility, flags, nsamples, freq_chans=freq_chans, add_to_history=add_to_history)
+    timer = utils.StageTimer()
+    with timer.stage('write'), utils.file_lock(write_lock):
+        uvd.write_uvh5_part(uvh5_file, visibility, flags, nsamples, freq_chans=freq_chans, blt_inds=blt_inds,
+                            add_to_history=add_to_history)
+
+    return {'stages': timer.report(), 'simulation': obs.report, 'max_rss_GB': utils.max_rss_GB()}
+
+
+def _shard_marker(uvh5_file, shard):
+    """
+    Path of the file written by run_shard when a shard is finished.
+    """
+    return '{}.shard{}.json'.format(uvh5_file, shard)
+
+
+def _shard_bounds(N, Nshards):
+    """
+    Bounds of blocks of range(N) for at most Nshards shards, as a list of the start of each block and N.
+
+    All blocks have the same length, but the last, which may be shorter, so that every bound
+    is a multiple of the block length. There are fewer blocks than Nshards if N does not allow them.
+    """
+    size = int(np.ceil(N / float(max(1, min(Nshards, N)))))
+    return list(range(0, N, size)) + [N]
+
+
+def plan_shards(param_file, Nfreq_shards=1, Ntime_shards=1, plan_file=None):
+    """
+    Plan a simulation split into Nfreq_shards x Ntime_shards jobs, each running run_simulation_partial_freq
+    on one block of channels and times, e.g. as a SLURM job array. See run_shard and merge_shards.
+
+    The output uvh5 file is created without data, with chunks aligned to the shards, and
+    the SkyModel is written to skyparam savepath first if it is not read from a file.
+    Only one sky is supported.
+
+    Args:
+        param_file : str or dict
+            obsparam yaml file, or its contents. Shards use its sky, telescope, frequency, time, beam,
+            select and filing parameters, and the do_horizon_taper, geometry_cache, observed_region_only,
+            precision, engine, max_memory, time_chunk, freq_chunk, bl_tile and pointings keys.
+        Nfreq_shards : int
+            Number of blocks of channels. The blocks have equal lengths, but the last, so there may be
+            fewer. E.g., 10 channels are split into blocks of 3, 3, 3 and 1 for Nfreq_shards=4, and into
+            5 blocks of 2 for Nfreq_shards=6.
+        Ntime_shards : int
+            Number of blocks of times, split in the same way
+        plan_file : str
+            Path of the JSON plan to write. Default is the output uvh5 file, with extension .shards.json.
+
+    Returns:
+        plan : dict, as written to plan_file, with keys
+            uvh5_file, skymod_file : Output and SkyModel files
+            run_kwargs : Keyword arguments to run_simulation_partial_freq, the same for every shard
+            shards : list of dicts of the start and stop (exclusive) of the 'freq_chans' and 'time_inds' of each shard
+    """
+    if isinstance(param_file, (str, np.str)):
+        with open(param_file, 'r') as yfile:
+            param_dict = yaml.safe_load(yfile)
+    else:
+        param_dict = copy.deepcopy(param_file)
+
+    freq_array = parse_frequency_params(param_dict['freq'])['freq_array'][0]
+    time_array = parse_time_params(param_dict['time'])['time_array']
+    filing_params = param_dict['filing']
+
+    # SkyModel file
+    skyparam = param_dict['skyparam'].copy()
+    sky_type = skyparam.pop('sky_type')
+    savepath = skyparam.pop('savepath', None)
+    if int(skyparam.get('Nskies', param_dict.get('Nskies', 1))) > 1:
+        raise ValueError("Sharded simulations support only one sky.")
+    if sky_type.lower() in ['flat_spec', 'gsm', 'monopole']:
+        if savepath is None:
+            raise ValueError("Sharded simulations need a SkyModel file. Set skyparam savepath to write one.")
+        skyparam['freqs'] = freq_array
+        skyparam['precision'] = param_dict.get('precision', 'double')
+        sky = sky_model.construct_skymodel(sky_type, **skyparam)
+        sky.write_hdf5(savepath, clobber=True)
+        skymod_file = savepath
+    else:
+        skymod_file = sky_type
+
+    # Output file, without data.
+    uvd_dict = dict(param_dict['telescope'])
+    uvd_dict['freq_array'] = freq_array
+    uvd_dict['time_array'] = time_array
+    if 'pols' in param_dict['beam']:
+        uvd_dict['pols'] = param_dict['beam']['pols']
+    uvd_dict.update(param_dict.get('select', {}))
+    uvd_dict['make_full'] = False
+    uv_obj = complete_uvdata(setup_uvdata(**uvd_dict), run_check=False, fill_data=False)
+    uv_obj.history = version.history_string(notes='Sharded simulation, planned from:\n{}'.format(param_dict))
+
+    freq_bounds = _shard_bounds(uv_obj.Nfreqs, Nfreq_shards)
+    time_bounds = _shard_bounds(uv_obj.Ntimes, Ntime_shards)
+    # One chunk per time and channel block. The channel blocks have equal lengths (but the last), so every
+    # block starts at a chunk boundary and shards never share a chunk.
+    chunks = (uv_obj.Nbls, 1, freq_bounds[1] - freq_bounds[0], uv_obj.Npols)
+
+    outfile_name = filing_params.get('outfile_name', filing_params.get('outfile_prefix', 'healvis'))
+    uvh5_file = os.path.join(filing_params['outdir'], outfile_name + '.uvh5')
+    if not os.path.exists(filing_params['outdir']):
+        os.makedirs(filing_params['outdir'])
+    uv_obj.initialize_uvh5_file(uvh5_file, clobber=filing_params.get('clobber', False), chunks=chunks)
+
+    beam_attr = param_dict['beam'].copy()
+    beam_attr.pop('pols', None)
+    run_kwargs = dict(beam=beam_attr.pop('beam_type'), fov=beam_attr.pop('fov'),
+                      beam_freq_interp=beam_attr.pop('beam_freq_interp', 'cubic'),
+                      smooth_beam=beam_attr.pop('smooth_beam', False), smooth_scale=beam_attr.pop('smooth_scale', 2.0),
+                      geometry_cache=param_dict.get('geometry_cache', None),
+                      observed_region_only=param_dict.get('observed_region_only', False),
+                      apply_horizon_taper=param_dict.get('do_horizon_taper', False),
+                      precision=param_dict.get('precision', 'double'), engine=param_dict.get('engine', 'direct'),
+                      max_memory=param_dict.get('max_memory', None), time_chunk=param_dict.get('time_chunk', None),
+                      freq_chunk=param_dict.get('freq_chunk', None),
+                      bl_tile=param_dict.get('bl_tile', None))
+    if param_dict.get('pointings', None) is not None:
+        run_kwargs['pointings'] = [list(p) for p in ast.literal_eval(param_dict['pointings'])]
+    run_kwargs['beam_kwargs'] = beam_attr
+
+    shards = [dict(freq_chans=freq_bounds[fi:fi + 2], time_inds=time_bounds[ti:ti + 2])
+              for ti in range(len(time_bounds) - 1) for fi in range(len(freq_bounds) - 1)]
+    plan = dict(uvh5_file=uvh5_file, skymod_file=skymod_file, run_kwargs=run_kwargs, shards=shards)
+    if plan_file is None:
+        plan_file = os.path.splitext(uvh5_file)[0] + '.shards.json'
+    with open(plan_file, 'w') as jfile:
+        json.dump(plan, jfile, indent=2)
+    print("...wrote plan of {} shards to {}".format(len(shards), plan_file))
+    return plan
+
+
+def run_shard(plan_file, shard=None, Nprocs=1):
+    """
+    Run one shard of a plan made by plan_shards, writing its block of the output file.
+
+    Args:
+        plan_file : str
+            JSON plan file
+        shard : int
+            Index of the shard to run. Default is the SLURM_ARRAY_TASK_ID environment variable,
+            so a job array with indices 0 to Nshards - 1 runs the whole plan.
+        Nprocs : int
+            Number of processes for this shard
+
+    Returns:
+        Timing and memory report of the shard. See run_simulation_partial_freq.
+    """
+    with open(plan_file, 'r') as jfile:
+        plan = json.load(jfile)
+    if shard is None:
+        if 'SLURM_ARRAY_TASK_ID' not in os.environ:
+            raise ValueError("No shard given, and SLURM_ARRAY_TASK_ID is not set.")
+        shard = int(os.environ['SLURM_ARRAY_TASK_ID'])
+    spec = plan['shards'][shard]
+    uvh5_file = plan['uvh5_file']
+    report = run_simulation_partial_freq(np.arange(*spec['freq_chans']), uvh5_file, plan['skymod_file'],
+                                         Nprocs=Nprocs, time_inds=np.arange(*spec['time_inds']),
+                                         write_lock=uvh5_file + '.lock', **plan['run_kwargs'])
+    # Mark the shard as done.
+    with open(_shard_marker(uvh5_file, shard), 'w') as jfile:
+        json.dump(dict(shard=shard, report=report), jfile, indent=2)
+    return report
+
+
+def verify_shards(plan_file):
+    """
+    Check which shards of a plan made by plan_shards have finished.
+
+    Returns:
+        list of the indices of unfinished shards
+    """
+    with open(plan_file, 'r') as jfile:
+        plan = json.load(jfile)
+    return [si for si in range(len(plan['shards'])) if not os.path.exists(_shard_marker(plan['uvh5_file'], si))]
+
+
+def merge_shards(plan_file, cleanup=True):
+    """
+    Confirm that every shard of a plan made by plan_shards has finished, and collect their reports.
+
+    The shards write directly into the output uvh5 file, so it is complete once they have all finished.
+    Their reports are written to the output file with extension .timing.json.
+
+    Args:
+        plan_file : str
+            JSON plan file
+        cleanup : bool
+            If True, remove the shards' marker and lock files.
+
+    Returns:
+        dict of {shard index : report}
+    """
+    missing = verify_shards(plan_file)
+    with open(plan_file, 'r') as jfile:
+        plan = json.load(jfile)
+    uvh5_file = plan['uvh5_file']
+    if len(missing) > 0:
+        raise ValueError("Shard(s) {} of {} have not finished.".format(', '.join(map(str, missing)), uvh5_file))
+    reports = {}
+    for si in range(len(plan['shards'])):
+        with open(_shard_marker(uvh5_file, si), 'r') as jfile:
+            reports[si] = json.load(jfile)['report']
+    with open(uvh5_file + '.timing.json', 'w') as jfile:
+        json.dump(reports, jfile, indent=2)
+    if cleanup:
+        for si in range(len(plan['shards'])):
+            os.remove(_shard_marker(uvh5_file, si))
+        if os.path.exists(uvh5_file + '.lock'):
+            os.remove(uvh5_file + '.lock')
+    return reports
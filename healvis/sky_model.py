@@ -6,6 +6,7 @@ from __future__ import absolute_import, division, print_function
 
 import numpy as np
 import os
+import hashlib
 import warnings
 import healpy as hp
 with warnings.catch_warnings():  # noqa
@@ -13,7 +14,7 @@ with warnings.catch_warnings():  # noqa
     import h5py
 from astropy.cosmology import Planck15 as cosmo
 
-from .utils import mparray
+from .utils import mparray, precision_dtypes
 from .cosmology import f21, comoving_voxel_volume, comoving_distance
 from .version import history_string
 
@@ -95,6 +96,22 @@ class SkyModel(object):
         self.data = data
         self._update()
 
+    def fingerprint(self, block_size=2**16):
+        """
+        SHA-1 hash of the data, frequencies, Nside and pixel indices, as a hex string.
+
+        Used to check that a checkpoint was made with the same sky. The data are hashed
+        block_size pixels at a time, so memory-mapped data are not read in all at once.
+        """
+        sha = hashlib.sha1()
+        sha.update(np.array([self.Nside, self.Nskies, self.Npix, self.Nfreqs], dtype=np.int64).tobytes())
+        sha.update(np.ascontiguousarray(self.freqs, dtype=np.float64).tobytes())
+        sha.update(np.ascontiguousarray(self.indices, dtype=np.int64).tobytes())
+        for si in range(self.Nskies):
+            for p0 in range(0, self.Npix, block_size):
+                sha.update(np.ascontiguousarray(self.data[si, p0:p0 + block_size]).tobytes())
+        return sha.hexdigest()
+
     def _update(self):
         """
             Assume that whatever parameter was just changed has priority over others.
@@ -125,10 +142,11 @@ class SkyModel(object):
                     self.data = self.data.reshape((1,) + s)
         self._updated = []
 
-    def make_flat_spectrum_shell(self, sigma, shared_memory=False):
+    def make_flat_spectrum_shell(self, sigma, shared_memory=False, precision='double'):
         """
         sigma = Spectrum amplitude
         shared_memory = put data in a multiprocessing shared memory block
+        precision = 'single' or 'double' precision data array
         """
         self._update()
         required = ['freqs', 'ref_chan', 'Nside', 'Npix', 'Nfreqs']
@@ -140,12 +158,13 @@ class SkyModel(object):
             raise ValueError("Missing required parameters: " + ', '.join(missing))
 
         self.data = flat_spectrum_noise_shell(sigma, self.freqs, self.Nside, self.Nskies,
-                                              ref_chan=self.ref_chan, shared_memory=shared_memory)
+                                              ref_chan=self.ref_chan, shared_memory=shared_memory, precision=precision)
         self.ref_freq = self.freqs[self.ref_chan]
         self.pspec_amp = sigma
         self._update()
 
-    def read_hdf5(self, filename, freq_chans=None, shared_memory=False, do_not_overwrite_freqs=False):
+    def read_hdf5(self, filename, freq_chans=None, shared_memory=False, do_not_overwrite_freqs=False, precision='double',
+                  pixels=None, mmap=False):
         """
         Read HDF5 HEALpix map(s)
 
@@ -159,10 +178,22 @@ class SkyModel(object):
             do_not_overwrite_freqs : bool
                 If true and self.freqs is not None, this will attempt to read a subset of the file
                 corresponding with the current self.freqs. If it cannot find a good match it will error.
+            precision : str
+                'single' or 'double'. Precision of the data array to load into.
+            pixels : integer ndarray or Observatory
+                HEALPix pixels to read in, giving a partial-sky SkyModel with those indices.
+                If an Observatory (with pointings and fov set) is given, read the pixels
+                it observes (see Observatory.observed_pixels).
+            mmap : bool
+                If True, memory-map the data array from the file instead of reading it, so pixels are
+                only read from disk when used, and forked processes share them through the page cache.
+                The data must be stored uncompressed and contiguous (see write_hdf5), and freq_chans must
+                be a contiguous range. The data keep the precision of the file. Not available with pixels.
         """
         if not os.path.exists(filename):
             raise ValueError("File {} not found.".format(filename))
 
+        real_dtype = precision_dtypes(precision)[0]
         if freq_chans is None:
             freq_chans = slice(None)
             Nfreqs_load = None
@@ -174,35 +205,59 @@ class SkyModel(object):
             if do_not_overwrite_freqs:
                 sky_freqs_full = infile['freqs'][()]
                 # Find nearest frequency in sky_freqs for each self.freqs.
-                freq_chans = []
-                for fr in self.freqs:
-                    freq_chans.append(np.argmin(np.abs(fr - sky_freqs_full)))
+                freq_chans = np.abs(np.asarray(self.freqs)[:, np.newaxis] - sky_freqs_full).argmin(axis=1)
                 freq_chans = np.sort(freq_chans)
                 sky_freqs_part = sky_freqs_full[freq_chans]
                 if self.freqs is not None and not np.allclose(self.freqs, sky_freqs_part):
                     raise ValueError("Currently set frequencies do not match any subset of file's frequencies.")
                 Nfreqs_load = len(freq_chans)
+            # Read a contiguous range of channels as a slice, not by fancy indexing.
+            freq_chans = _chans_to_slice(freq_chans)
 
             # load lightweight attributes
             for k in infile.attrs:
                 setattr(self, k, infile.attrs[k])
+            if 'indices' in infile and 'Nside' not in infile.attrs:
+                # The Nside of a partial sky cannot be told from its number of pixels. write_hdf5 always stores it.
+                raise ValueError("File {} holds a partial sky (it has indices), but no Nside attribute.".format(filename))
+
+            # Rows of the data array to read, if selecting pixels.
+            rows = None
+            if pixels is not None:
+                if 'indices' in infile:
+                    file_inds = infile['indices'][()]
+                else:
+                    file_inds = np.arange(infile['data'].shape[-2])
+                if hasattr(pixels, 'observed_pixels'):
+                    # Without indices, the file holds a full sky.
+                    Nside = infile.attrs['Nside'] if 'Nside' in infile.attrs else hp.npix2nside(file_inds.size)
+                    pixels = pixels.observed_pixels(Nside)
+                rows = np.nonzero(np.isin(file_inds, pixels))[0]
 
             # load heavier datasets
             for k in self.dsets:
                 if k in infile:
                     if k == 'data':
-                        if shared_memory:
+                        if mmap:
+                            if rows is not None:
+                                raise ValueError("Pixel selection is not available with mmap.")
+                            self.data = _memmap_data(filename, infile[k], freq_chans)
+                        else:
                             s = list(infile[k].shape)   # Shape of infile data array
                             if Nfreqs_load is not None:
                                 s[-1] = Nfreqs_load
+                            if rows is not None:
+                                s[-2] = rows.size
                             s = tuple(s)
                             if len(s) < 3:
                                 s = (1,) + s
-                            self.data = mparray(s, dtype=np.float)
-                            self.data[()] = infile[k][..., freq_chans]   # Transfer data from infile.
-                        else:
-                            # load the data via slice
-                            setattr(self, k, infile[k][:, :, freq_chans])
+                            if shared_memory:
+                                self.data = mparray(s, dtype=real_dtype)
+                            else:
+                                self.data = np.empty(s, dtype=real_dtype)
+                            _read_data(infile[k], freq_chans, self.data, rows=rows)   # Transfer data from infile.
+                    elif k == 'indices' and rows is not None:
+                        continue
                     elif k == 'freqs':
                         setattr(self, k, infile[k][:][freq_chans])
                     elif k == 'history':
@@ -216,6 +271,11 @@ class SkyModel(object):
             # make sure Nfreq agrees
             self.Nfreqs = len(self.freqs)
 
+            if rows is not None:
+                if 'Nside' not in infile.attrs:
+                    self.Nside = hp.npix2nside(file_inds.size)
+                self.indices = file_inds[rows]
+
         if self.Nside is None:
             try:
                 self.Nside = hp.npix2nside(self.data.shape[1])
@@ -223,7 +283,7 @@ class SkyModel(object):
                 raise ValueError("Data array is not a full HEALPix map, and Nside not provided.")
         self._update()
 
-    def write_hdf5(self, filename, clobber=False):
+    def write_hdf5(self, filename, clobber=False, compression='gzip', compression_opts=None, chunks=None):
         """
         Write a SkyModel HEALpix map in celestial coordinates to HDF5.
 
@@ -232,6 +292,16 @@ class SkyModel(object):
                 Path to output HDF5 file
             clobber : bool
                 If True, overwrite output file if it exists
+            compression : str
+                HDF5 compression filter for the datasets: 'gzip', 'lzf' (fast, but only readable by h5py),
+                or None. Without compression and chunks, the data are stored contiguously,
+                so they can be memory-mapped by read_hdf5.
+            compression_opts : int
+                Compression level for gzip, 0-9. Default is 9. Lower levels write much faster.
+            chunks : tuple of int
+                (pixels, channels) in each chunk of the data array, to match how it will be read.
+                E.g., use a few channels per chunk if reading subsets of channels. Default is chosen by h5py
+                if compressing, otherwise the data are not chunked.
         """
         if os.path.exists(filename) and clobber is False:
             print("...{} exists and clobber == False, skipping".format(filename))
@@ -248,12 +318,136 @@ class SkyModel(object):
                     if np.isscalar(d):
                         dset = fileobj.create_dataset(k, data=d, dtype=self.dsets[k])
                     else:
-                        dset = fileobj.create_dataset(k, data=d, dtype=self.dsets[k], compression='gzip', compression_opts=9)
+                        opts = compression_opts
+                        if compression == 'gzip' and opts is None:
+                            opts = 9
+                        dchunks = None
+                        if k == 'data' and chunks is not None:
+                            dchunks = (1,) * (d.ndim - 2) + (min(chunks[0], d.shape[-2]), min(chunks[1], d.shape[-1]))
+                        dset = fileobj.create_dataset(k, data=d, dtype=self.dsets[k], compression=compression,
+                                                      compression_opts=opts, chunks=dchunks)
                 else:
                     fileobj.attrs[k] = d
 
 
-def flat_spectrum_noise_shell(sigma, freqs, Nside, Nskies, ref_chan=0, shared_memory=False):
+def _read_data(dset, freq_chans, out, rows=None):
+    """
+    Read the channels freq_chans of an HDF5 data array of shape (Nskies, Npix, Nfreqs), or (Npix, Nfreqs),
+    into out, of shape (Nskies, Npix, Nfreqs_load).
+
+    The array is read in blocks of pixels (of whole chunks, if it is chunked), and for each block, each run of
+    selected channels in adjacent chunks (or consecutive channels, if not chunked) is read as one slice.
+    So each chunk is read and decompressed once, and h5py's slow fancy indexing is avoided.
+
+    If rows (increasing pixel indices) are given, only those pixels are read, in runs of consecutive
+    pixels, into out of shape (Nskies, rows.size, Nfreqs_load).
+    """
+    if dset.ndim == 2:
+        out = out[0]
+    chans = np.arange(dset.shape[-1])[freq_chans]
+    Npix = dset.shape[-2]
+    pix_chunk, chan_chunk = dset.chunks[-2:] if dset.chunks is not None else (1, 1)
+
+    # Runs of selected channels in adjacent chunks.
+    order = np.argsort(chans, kind='stable')
+    chunk_ids = chans[order] // chan_chunk
+    runs = [run for run in np.split(order, np.nonzero(np.diff(chunk_ids) > 1)[0] + 1) if run.size > 0]
+    span = max([chans[run].max() - chans[run].min() + 1 for run in runs] + [1])
+
+    # Read whole chunks of pixels, about 64 MB at a time.
+    pix_block = max(1, (2**26 // (dset.dtype.itemsize * span * int(np.prod(dset.shape[:-2])))) // pix_chunk) * pix_chunk
+
+    # Runs of consecutive pixels, as (first pixel in dset, first pixel in out, number of pixels).
+    if rows is None:
+        pix_runs = [(0, 0, Npix)]
+    else:
+        breaks = np.nonzero(np.diff(rows) != 1)[0] + 1
+        starts = np.concatenate([[0], breaks]).astype(int)
+        ends = np.concatenate([breaks, [rows.size]]).astype(int)
+        pix_runs = [(rows[i0], i0, i1 - i0) for i0, i1 in zip(starts, ends) if i1 > i0]
+
+    direct = out.flags['C_CONTIGUOUS']
+    for src0, dst0, Nrun in pix_runs:
+        for p0 in range(0, Nrun, pix_block):
+            Np = min(pix_block, Nrun - p0)
+            src = slice(src0 + p0, src0 + p0 + Np)
+            dst = slice(dst0 + p0, dst0 + p0 + Np)
+            for run in runs:
+                lo, hi = chans[run].min(), chans[run].max() + 1
+                if direct and np.all(np.diff(run) == 1) and hi - lo == run.size and chans[run[0]] == lo:
+                    # Consecutive channels, into consecutive positions in out.
+                    dset.read_direct(out, np.s_[..., src, lo:hi], np.s_[..., dst, run[0]:run[-1] + 1])
+                else:
+                    block = dset[..., src, lo:hi]
+                    out[..., dst, run] = block[..., chans[run] - lo]
+
+
+def iter_freq_blocks(filename, Nfreqs_block, freq_chans=None, **kwargs):
+    """
+    Read a SkyModel HDF5 file in blocks of channels, so a frequency-chunked simulation
+    can stream through a shell too large to hold in memory.
+
+    Args:
+        filename : str
+            Path to HDF5 file with HEALpix maps in SkyModel format
+        Nfreqs_block : int
+            Number of channels in each block
+        freq_chans : integer ndarray
+            Channels to read. Default is all.
+        kwargs :
+            Other keyword arguments of SkyModel.read_hdf5 (e.g., shared_memory, precision, pixels).
+
+    Yields:
+        chans : integer ndarray
+            Channels of the file in the block
+        sky : SkyModel
+            SkyModel of those channels
+    """
+    with h5py.File(filename, 'r') as infile:
+        Nfreqs_file = infile['freqs'].shape[0]
+    if freq_chans is None:
+        freq_chans = np.arange(Nfreqs_file)
+    freq_chans = np.asarray(freq_chans)
+    for c0 in range(0, freq_chans.size, Nfreqs_block):
+        chans = freq_chans[c0:c0 + Nfreqs_block]
+        sky = SkyModel()
+        sky.read_hdf5(filename, freq_chans=chans, **kwargs)
+        yield chans, sky
+
+
+def _memmap_data(filename, dset, freq_chans):
+    """
+    Memory-map an HDF5 data array of shape (Nskies, Npix, Nfreqs), or (Npix, Nfreqs),
+    from filename. It must be stored contiguously, without compression or other filters.
+
+    Returns a read-only numpy.memmap of shape (Nskies, Npix, Nfreqs_load).
+    """
+    offset = dset.id.get_offset()
+    if dset.chunks is not None or offset is None:
+        raise ValueError("The data in {} are not stored contiguously, so cannot be memory-mapped. "
+                         "Write them with compression=None.".format(filename))
+    data = np.memmap(filename, mode='r', dtype=dset.dtype, offset=offset, shape=dset.shape)
+    if data.ndim == 2:
+        data = data.reshape((1,) + data.shape)
+    freq_chans = _chans_to_slice(freq_chans)
+    if not isinstance(freq_chans, slice):
+        raise ValueError("freq_chans must be a contiguous range to memory-map the data.")
+    return data[..., freq_chans]
+
+
+def _chans_to_slice(freq_chans):
+    """
+    Return freq_chans as a slice if it is a contiguous, increasing range of channels. Otherwise, return it as is.
+    """
+    if isinstance(freq_chans, slice):
+        return freq_chans
+    chans = np.asarray(freq_chans)
+    if chans.ndim != 1 or chans.size == 0 or not np.all(np.diff(chans) == 1):
+        return freq_chans
+    return slice(int(chans[0]), int(chans[-1]) + 1)
+
+
+def flat_spectrum_noise_shell(sigma, freqs, Nside, Nskies, ref_chan=0, shared_memory=False, precision='double'):
     """
     Make a flat-spectrum noise-like shell.
 
@@ -270,6 +464,8 @@ def flat_spectrum_noise_shell(sigma, freqs, Nside, Nskies, ref_chan=0, shared_me
             freqs reference channel index for comoving volume factor
         shared_memory : bool
             If True use mparray to generate data
+        precision : str
+            'single' or 'double' precision data array
 
     Returns:
         data : ndarray, shape (Nskies, Npix, Nfreqs)
@@ -278,10 +474,11 @@ def flat_spectrum_noise_shell(sigma, freqs, Nside, Nskies, ref_chan=0, shared_me
     # generate empty array
     Nfreqs = len(freqs)
     Npix = hp.nside2npix(Nside)
+    real_dtype = precision_dtypes(precision)[0]
     if shared_memory:
-        data = mparray((Nskies, Npix, Nfreqs), dtype=float)
+        data = mparray((Nskies, Npix, Nfreqs), dtype=real_dtype)
     else:
-        data = np.zeros((Nskies, Npix, Nfreqs), dtype=float)
+        data = np.zeros((Nskies, Npix, Nfreqs), dtype=real_dtype)
 
     # setup parameters
     dnu = np.diff(freqs)[0]
@@ -330,7 +527,8 @@ def gsm_shell(Nside, freqs, use_2016=False):
     return maps.T
 
 
-def construct_skymodel(sky_type, freqs=None, Nside=None, ref_chan=0, Nskies=1, sigma=None, amplitude=None):
+def construct_skymodel(sky_type, freqs=None, Nside=None, ref_chan=0, Nskies=1, sigma=None, amplitude=None,
+                       precision='double', pixels=None, mmap=False):
     """
     Construct a SkyModel object or read from disk
 
@@ -349,6 +547,14 @@ def construct_skymodel(sky_type, freqs=None, Nside=None, ref_chan=0, Nskies=1, s
             If sky_type == 'flat_spec', this is the power spectrum amplitude
         amplitude : float
             Monopole amplitude in K
+        precision : str
+            'single' or 'double' precision data array
+        pixels : integer ndarray or Observatory
+            If given, make a partial-sky SkyModel of only these HEALPix pixels, or of the
+            pixels observed by an Observatory. Maps on disk are only read for these pixels.
+            See SkyModel.read_hdf5.
+        mmap : bool
+            If reading sky_type from disk, memory-map its data instead of loading it. See SkyModel.read_hdf5.
 
     Returns:
         SkyModel object
@@ -358,24 +564,39 @@ def construct_skymodel(sky_type, freqs=None, Nside=None, ref_chan=0, Nskies=1, s
     sky.freqs = freqs
     sky.Nskies = Nskies
     sky.ref_chan = ref_chan
+    if hasattr(pixels, 'observed_pixels') and Nside is not None:
+        pixels = pixels.observed_pixels(Nside)
 
     # make a flat-spectrum noise shell
     if sky_type.lower() == 'flat_spec':
-        sky.make_flat_spectrum_shell(sigma, shared_memory=True)
+        sky.make_flat_spectrum_shell(sigma, shared_memory=True, precision=precision)
 
     # make a GSM shell
     elif sky_type.lower() == 'gsm':
-        sky.data = gsm_shell(Nside, freqs)
+        sky.data = gsm_shell(Nside, freqs).astype(precision_dtypes(precision)[0], copy=False)
         sky._update()
 
     elif sky_type.lower() == 'monopole':
-        Npix = 12 * Nside**2
-        sky.data = mparray((Nskies, Npix, freqs.size), dtype=float)
+        Npix = 12 * Nside**2 if pixels is None else len(pixels)
+        sky.data = mparray((Nskies, Npix, freqs.size), dtype=precision_dtypes(precision)[0])
         sky.data[()] = amplitude
+        if pixels is not None:
+            sky.indices = np.asarray(pixels)
 
     # load healpix map from disk
     else:
-        sky.read_hdf5(sky_type, shared_memory=True, do_not_overwrite_freqs=True)
+        sky.read_hdf5(sky_type, shared_memory=True, do_not_overwrite_freqs=True, precision=precision, pixels=pixels,
+                      mmap=mmap)
+        pixels = None
     sky._update()
 
+    if pixels is not None and sky.Npix == 12 * Nside**2:
+        # Generated full-sky maps are cut down to the selected pixels.
+        pixels = np.asarray(pixels)
+        data = mparray((sky.Nskies, pixels.size, sky.Nfreqs), dtype=sky.data.dtype)
+        data[()] = sky.data[:, pixels]
+        sky.data = data
+        sky.indices = pixels
+        sky._update()
+
     return sky
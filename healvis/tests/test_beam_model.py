@@ -51,6 +51,16 @@ def test_PowerBeam():
     SP = P.smooth_beam(freqs, inplace=False, freq_ls=2.0, noise=1e-10)
     assert SP.Nfreqs == len(freqs)
 
+    # single precision, which UVBeam.check accepts
+    PS = beam_model.PowerBeam(beam_path, precision='single')
+    assert PS.data_array.dtype == np.float32
+    assert PS.check()
+    assert PS.interp_freq(freqs, inplace=False).check()
+    PS.set_precision('double')
+    assert PS.data_array.dtype == np.float64
+    assert PS.check()
+    assert np.allclose(PS.data_array, P.data_array, rtol=1e-6)
+
 
 def test_AnalyticBeam():
     freqs = np.arange(120e6, 160e6, 4e6)
@@ -90,6 +100,12 @@ def test_AnalyticBeam():
     assert np.isclose(b2[0, :], 1.0).all()  # assert peak normalized
     np.testing.assert_array_almost_equal(b, b2)  # assert its the same as airy
 
+    # single precision
+    A = beam_model.AnalyticBeam('airy', diameter=15.0, precision='single')
+    b3 = A.beam_val(az, za, freqs)
+    assert b3.dtype == np.float32
+    assert np.allclose(b, b3, atol=1e-6)
+
     # exceptions
     A = beam_model.AnalyticBeam("uniform")
     simtest.assert_raises_message(NotImplementedError, 'Beam type foo not available yet.', beam_model.AnalyticBeam, "foo")
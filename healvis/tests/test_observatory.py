@@ -6,6 +6,8 @@ from __future__ import absolute_import, division, print_function
 
 import numpy as np
 import os
+import json
+import pytest
 import healpy as hp
 from astropy.time import Time
 from astropy.coordinates import EarthLocation, AltAz, ICRS, Angle
@@ -103,6 +105,27 @@ def test_pointings():
     assert np.allclose(decs, latitude, atol=1e-1)  # Within 6 arcmin
 
 
+def test_pointings_lst():
+    time_arr = 2458000.2 + np.arange(50) * 0.01
+    obs = observatory.Observatory(latitude, longitude)
+    obs.set_pointings(time_arr)
+    centers, north_poles = np.array(obs.pointing_centers), np.array(obs.north_poles)
+
+    # Cached
+    assert observatory._pointing_cache[(latitude, longitude, 'astropy', time_arr.tobytes())][0] is not None
+    obs.set_pointings(time_arr)
+    assert np.all(np.array(obs.pointing_centers) == centers)
+
+    obs.set_pointings(time_arr, method='lst')
+    for radec, radec_lst in [(centers, obs.pointing_centers), (north_poles, obs.north_poles)]:
+        vec = hp.ang2vec(radec[:, 0], radec[:, 1], lonlat=True)
+        vec_lst = hp.ang2vec(np.array(radec_lst)[:, 0], np.array(radec_lst)[:, 1], lonlat=True)
+        sep = np.degrees(np.arccos(np.clip(np.sum(vec * vec_lst, axis=1), -1, 1))) * 3600
+        assert np.all(sep < 21)  # arcsec
+
+    pytest.raises(ValueError, obs.set_pointings, time_arr, method='foo')
+
+
 def test_az_za():
     """
     Check the calculated azimuth and zenith angle of a point exactly 5 deg east on the sphere (az = 90d, za = 5d)
@@ -126,6 +149,37 @@ def test_az_za():
     assert np.isclose(np.degrees(az[ind]), 90.)
 
 
+def test_geometry_cache(tmpdir):
+    Nside = 32
+    obs = observatory.Observatory(latitude, longitude)
+    obs.set_fov(40)
+    center, north = [20.3, latitude], [200.3, 90 + latitude]
+    za, az, pix = obs.calc_azza(Nside, center, north, return_inds=True)
+
+    cache_dir = str(tmpdir.join('geometry'))
+    obs.geometry_cache = observatory.GeometryCache(cache_dir=cache_dir)
+    for i in range(2):
+        za2, az2, pix2 = obs.calc_azza(Nside, center, north, return_inds=True)
+        assert np.all(za2 == za) and np.all(az2 == az) and np.all(pix2 == pix)
+        assert not za2.flags.writeable
+    assert len(os.listdir(cache_dir)) == 1
+
+    # A new cache reads the entry from disk. Changing the taper or fov changes the key.
+    obs.geometry_cache = observatory.GeometryCache(cache_dir=cache_dir)
+    za2 = obs.calc_azza(Nside, center, north)[0]
+    assert np.all(za2 == za)
+    obs.set_fov(30)
+    assert obs.calc_azza(Nside, center, north)[0].size < za.size
+    assert len(os.listdir(cache_dir)) == 2
+
+    # Entries beyond max_memory are dropped, least recently used first.
+    obs.geometry_cache = observatory.GeometryCache(max_memory=1.5 * 24 * za.size / 1e9)
+    obs.set_fov(40)
+    obs.calc_azza(Nside, center, north)
+    obs.calc_azza(Nside, [30.3, latitude], north)
+    assert len(obs.geometry_cache._entries) == 1
+
+
 def test_vis_calc():
     # Construct a shell with a single point source at the zenith and confirm against analytic calculation.
 
@@ -285,3 +339,512 @@ def test_az_za_astropy():
     print(np.degrees(za0 - za))
     assert np.allclose(za0, za, atol=1e-4)
     assert np.allclose(np.unwrap(az0 - az), 0.0, atol=3e-4)   # About 1 arcmin precision. Worst is at the southern horizon.
+
+
+def test_shared_output_buffer():
+    # Results written in place by several processes should match a single-process run,
+    # ordered by time then baseline.
+    Nside = 16
+    freqs = np.linspace(100e6, 110e6, 4)
+    bls = [observatory.Baseline(enu_vec=np.array(v)) for v in [[14.6, 0, 0], [0, 14.6, 0], [7.3, 12.6, 0]]]
+    centers = [[ra, latitude] for ra in np.linspace(10.3, 40.3, 5)]
+
+    obs = observatory.Observatory(latitude, longitude, array=bls, freqs=freqs)
+    obs.pointing_centers = centers
+    obs.times_jd = np.arange(len(centers)) + 2458000.
+    obs.set_fov(60)
+    obs.set_beam('gaussian', gauss_width=10)
+
+    np.random.seed(0)
+    sky = sky_model.SkyModel(Nside=Nside, freqs=freqs, Nskies=2, data=np.random.normal(size=(2, 12 * Nside**2, freqs.size)))
+
+    vis1, times1, bls1 = obs.make_visibilities(sky, Nprocs=1)
+    vis2, times2, bls2 = obs.make_visibilities(sky, Nprocs=3)
+    assert vis1.shape == (len(centers) * len(bls), 2, freqs.size)
+    assert np.allclose(vis1, vis2)
+    assert np.all(times1 == times2)
+    assert np.all(bls1 == np.tile(np.arange(len(bls)), len(centers)))
+    assert np.all(times1 == np.repeat(obs.times_jd, len(bls)))
+
+
+def test_worker_exception():
+    # An exception in a worker process should be raised in the parent, not hang the job.
+    freqs = np.array([100e6, 110e6])
+    bl = observatory.Baseline(enu_vec=np.array([14.6, 0, 0]))
+    obs = observatory.Observatory(latitude, longitude, array=[bl], freqs=freqs)
+    obs.pointing_centers = [[ra, latitude] for ra in np.linspace(10.3, 40.3, 6)]
+    obs.times_jd = np.arange(6) + 2458000.
+    obs.set_fov(60)
+
+    def bad_beam(za, freqs, **kwargs):
+        raise ValueError("bad beam")
+
+    obs.set_beam(bad_beam)
+    sky = sky_model.SkyModel(Nside=8, freqs=freqs, data=np.ones((12 * 8**2, freqs.size)))
+    with pytest.raises(RuntimeError, match='bad beam'):
+        obs.make_visibilities(sky, Nprocs=2, time_chunk=1)
+
+
+def test_make_fringes():
+    # Batched fringes agree with per-baseline fringes, and baseline chunking doesn't change visibilities.
+    Npix, Nfreqs = 50, 8
+    az = np.linspace(0, 2 * np.pi, Npix)
+    za = np.linspace(0, np.pi / 2, Npix)
+    freqs = np.linspace(100e6, 200e6, Nfreqs)
+    enus = np.array([[14.6, 0, 0], [0, 29.2, 0.3], [-7.3, 12.6, 0]])
+    fringes = observatory.make_fringes(az, za, freqs, enus)
+    assert fringes.shape == (Nfreqs, len(enus), Npix)
+    for bi, enu in enumerate(enus):
+        assert np.allclose(fringes[:, bi].T, observatory.make_fringe(az, za, freqs, enu))
+
+    bls = [observatory.Baseline(enu_vec=enu) for enu in enus]
+    obs = observatory.Observatory(latitude, longitude, array=bls, freqs=freqs)
+    obs.pointing_centers = [[20.3, latitude], [25.3, latitude]]
+    obs.times_jd = np.array([2458000., 2458000.1])
+    obs.set_fov(90)
+    obs.set_beam('airy', diameter=14)
+    np.random.seed(1)
+    sky = sky_model.SkyModel(Nside=16, freqs=freqs, data=np.random.normal(size=(12 * 16**2, Nfreqs)))
+    vis0 = obs.make_visibilities(sky)[0]
+    vis1 = obs.make_visibilities(sky, bl_chunk=1)[0]
+    assert np.allclose(vis0, vis1)
+
+
+def test_redundant_baselines():
+    enus = np.array([[14.6, 0, 0], [0, 14.6, 0], [14.6, 0.0002, 0], [29.2, 0, 0], [0, 14.6, 0]])
+    unique_enus, groups = observatory.group_redundant_baselines(enus, tol=1e-3)
+    assert unique_enus.shape == (3, 3)
+    assert np.all(groups == [0, 1, 0, 2, 1])
+    unique_enus, groups = observatory.group_redundant_baselines(enus, tol=None)
+    assert np.all(groups == np.arange(len(enus)))
+
+    # Redundant groups are simulated once, and agree with simulating every baseline.
+    freqs = np.linspace(100e6, 110e6, 3)
+    bls = [observatory.Baseline(enu_vec=enu) for enu in enus]
+    obs = observatory.Observatory(latitude, longitude, array=bls, freqs=freqs)
+    obs.pointing_centers = [[20.3, latitude], [25.3, latitude]]
+    obs.times_jd = np.array([2458000., 2458000.1])
+    obs.set_fov(90)
+    obs.set_beam('gaussian', gauss_width=10)
+    np.random.seed(2)
+    sky = sky_model.SkyModel(Nside=16, freqs=freqs, data=np.random.normal(size=(12 * 16**2, freqs.size)))
+    vis_red, times, bl_inds = obs.make_visibilities(sky)
+    assert obs.unique_enus.shape[0] == 3
+    vis_all = obs.make_visibilities(sky, redundant_tol=None)[0]
+    assert vis_red.shape == vis_all.shape
+    assert np.allclose(vis_red, vis_all, atol=1e-4 * np.abs(vis_all).max())
+    vis_red = vis_red.reshape(2, len(bls), 1, freqs.size)
+    assert np.all(vis_red[:, 1] == vis_red[:, 4])
+
+
+def test_fringe_recurrence():
+    Npix = 200
+    az = np.linspace(0, 2 * np.pi, Npix)
+    za = np.linspace(0, np.pi / 2, Npix)
+    freqs = np.linspace(100e6, 200e6, 300, endpoint=False)
+    enus = np.array([[14.6, 0, 0], [350.0, -820.0, 1.5]])
+    direct = observatory.make_fringes(az, za, freqs, enus)
+    fast = observatory.make_fringes(az, za, freqs, enus, recurrence=True)
+    assert np.allclose(direct, fast, rtol=0, atol=1e-9)
+    assert np.allclose(observatory.make_fringe(az, za, freqs, enus[1], recurrence=True),
+                       observatory.make_fringe(az, za, freqs, enus[1]), rtol=0, atol=1e-9)
+
+    # Non-uniform frequencies fall back to direct evaluation.
+    freqs = np.sort(np.random.uniform(100e6, 200e6, 20))
+    assert np.all(observatory.make_fringes(az, za, freqs, enus, recurrence=True) == observatory.make_fringes(az, za, freqs, enus))
+
+
+def test_work_buffers():
+    # Fringes can be written into a reusable buffer without changing the result.
+    workspace = {}
+    az = np.linspace(0, 2 * np.pi, 30)
+    za = np.linspace(0, np.pi / 2, 30)
+    freqs = np.linspace(100e6, 200e6, 5)
+    enus = np.array([[14.6, 0, 0], [0, 29.2, 0.3]])
+    buf = observatory._get_buffer(workspace, 'fringe', (5, 2, 30), complex)
+    fringe = observatory.make_fringes(az, za, freqs, enus, out=buf)
+    assert fringe is buf
+    assert np.allclose(fringe, observatory.make_fringes(az, za, freqs, enus))
+
+    # Smaller requests reuse the same memory.
+    buf2 = observatory._get_buffer(workspace, 'fringe', (5, 1, 30), complex)
+    assert np.shares_memory(buf, buf2)
+    assert buf2.flags['C_CONTIGUOUS']
+
+
+def test_pixel_blocks():
+    # Accumulating over pixel blocks matches a single block, and max_memory bounds the block sizes.
+    freqs = np.linspace(100e6, 110e6, 4)
+    enus = np.array([[14.6, 0, 0], [0, 14.6, 0], [7.3, 12.6, 0]])
+    bls = [observatory.Baseline(enu_vec=enu) for enu in enus]
+    obs = observatory.Observatory(latitude, longitude, array=bls, freqs=freqs)
+    obs.pointing_centers = [[20.3, latitude], [25.3, latitude]]
+    obs.times_jd = np.array([2458000., 2458000.1])
+    obs.set_fov(180)
+    obs.set_beam('airy', diameter=14)
+    np.random.seed(3)
+    sky = sky_model.SkyModel(Nside=16, freqs=freqs, Nskies=2, data=np.random.normal(size=(2, 12 * 16**2, freqs.size)))
+    vis0 = obs.make_visibilities(sky)[0]
+    vis1 = obs.make_visibilities(sky, pix_block=100, bl_chunk=2)[0]
+    assert np.allclose(vis0, vis1)
+    vis2 = obs.make_visibilities(sky, max_memory=2e-4)[0]
+    assert np.allclose(vis0, vis2)
+
+    obs.max_memory = 1e-2
+    pix_block, bl_chunk = obs._block_sizes(10**6, 2, 3)
+    assert bl_chunk == 3
+    assert pix_block < 10**6
+    assert pix_block * (8 * 4 * (2 + 3 * 2) + (16 * 4 + 8) * bl_chunk) <= 1e-2 * 1e9
+
+
+def test_single_precision():
+    freqs = np.linspace(100e6, 110e6, 4)
+    enus = np.array([[14.6, 0, 0], [0, 146.0, 0], [7.3, 12.6, 0]])
+    bls = [observatory.Baseline(enu_vec=enu) for enu in enus]
+    obs = observatory.Observatory(latitude, longitude, array=bls, freqs=freqs)
+    obs.pointing_centers = [[20.3, latitude], [25.3, latitude]]
+    obs.times_jd = np.array([2458000., 2458000.1])
+    obs.set_fov(120)
+    obs.set_beam('gaussian', gauss_width=10)
+    sky = sky_model.SkyModel(Nside=16, freqs=freqs, ref_chan=0, Nskies=1)
+    sky.make_flat_spectrum_shell(1.0, precision='single')
+    assert sky.data.dtype == np.float32
+
+    vis_double = obs.make_visibilities(sky)[0]
+    vis_single = obs.make_visibilities(sky, precision='single', pix_block=200)[0]
+    assert vis_double.dtype == np.complex128
+    assert vis_single.dtype == np.complex64
+    assert np.allclose(vis_single, vis_double, rtol=0, atol=1e-5 * np.abs(vis_double).max())
+
+    # Beams are made at the given precision.
+    obs.set_beam('gaussian', gauss_width=10, precision='single')
+    assert obs.beam.beam_val(np.zeros(3), np.zeros(3), freqs).dtype == np.float32
+    vis_single2 = obs.make_visibilities(sky, precision='single')[0]
+    assert np.allclose(vis_single2, vis_single, rtol=0, atol=1e-5 * np.abs(vis_double).max())
+
+    fringe = observatory.make_fringe(np.zeros(3), np.zeros(3), freqs, enus[1], precision='single')
+    assert fringe.dtype == np.complex64
+    assert np.allclose(fringe, 1.0)
+
+
+def test_topocentric_engine():
+    freqs = np.linspace(140e6, 150e6, 3)
+    # Baselines of up to 25 wavelengths, whose fringes vary on the scale of the sky pixels.
+    enus = np.array([[14.6, 0, 0], [0, 14.6, 0], [35., 35., 0], [50., 0, 0]])
+    bls = [observatory.Baseline(enu_vec=enu) for enu in enus]
+    obs = observatory.Observatory(latitude, longitude, array=bls, freqs=freqs)
+    obs.pointing_centers = [[20.3, latitude], [45.1, latitude], [80.7, latitude]]
+    obs.times_jd = np.array([2458000., 2458000.1, 2458000.2])
+    obs.set_fov(60)
+    obs.set_beam('gaussian', gauss_width=10)
+
+    # A sky with structure up to the resolution of the map.
+    Nside = 64
+    np.random.seed(0)
+    alm = hp.synalm(1.0 / (1. + np.arange(3 * Nside))**2, lmax=3 * Nside - 1)
+    data = np.repeat(hp.alm2map(alm, Nside)[np.newaxis, :, np.newaxis], len(freqs), axis=2)
+    sky = sky_model.SkyModel(Nside=Nside, freqs=freqs, data=data, Nskies=1)
+
+    # The only difference from the direct engine is the interpolation of the beam, independently of the baseline.
+    vis_direct = obs.make_visibilities(sky)[0].reshape(3, 4, 3)
+    vis_topo = obs.make_visibilities(sky, engine='topocentric')[0].reshape(3, 4, 3)
+    assert obs._topo is None
+    for bi in range(4):
+        scale = np.abs(vis_direct[:, bi]).max()
+        assert np.allclose(vis_topo[:, bi], vis_direct[:, bi], rtol=0, atol=1e-3 * scale)
+
+    # A coarse grid gives a warning.
+    obs._topo_table_bytes = 0
+    with pytest.warns(UserWarning, match='topocentric grid'):
+        obs.make_visibilities(sky, engine='topocentric', pix_block=500)
+
+    pytest.raises(ValueError, obs.make_visibilities, sky, engine='foo')
+
+
+def test_partial_sky():
+    freqs = np.linspace(100e6, 110e6, 4)
+    bls = [observatory.Baseline(enu_vec=enu) for enu in np.array([[14.6, 0, 0], [0, 14.6, 0]])]
+    obs = observatory.Observatory(latitude, longitude, array=bls, freqs=freqs)
+    obs.set_pointings(2458000. + np.arange(4) / 24.)
+    obs.set_fov(40)
+    obs.set_beam('gaussian', gauss_width=10)
+    Nside = 16
+    sky = sky_model.SkyModel(Nside=Nside, freqs=freqs, data=np.random.rand(1, 12 * Nside**2, 4), Nskies=1)
+
+    # A partial-sky SkyModel of the observed pixels gives the same visibilities.
+    pix = obs.observed_pixels(Nside)
+    assert 0 < pix.size < 12 * Nside**2
+    part = sky_model.SkyModel(Nside=Nside, freqs=freqs, indices=pix, data=sky.data[:, pix], Nskies=1)
+    for engine in ['direct', 'topocentric']:
+        vis = obs.make_visibilities(sky, engine=engine)[0]
+        vis_part = obs.make_visibilities(part, engine=engine, Nprocs=2)[0]
+        assert np.allclose(vis_part, vis)
+
+    # Pointings outside the partial sky.
+    part = sky_model.SkyModel(Nside=Nside, freqs=freqs, indices=pix[:10], data=sky.data[:, pix[:10]], Nskies=1)
+    pytest.raises(RuntimeError, obs.make_visibilities, part)
+
+
+def test_freq_chunk():
+    freqs = np.linspace(100e6, 110e6, 7)
+    bls = [observatory.Baseline(enu_vec=enu) for enu in np.array([[14.6, 0, 0], [0, 14.6, 0]])]
+    obs = observatory.Observatory(latitude, longitude, array=bls, freqs=freqs)
+    obs.set_pointings(2458000. + np.arange(2) / 24.)
+    obs.set_fov(40)
+    obs.set_beam('gaussian', gauss_width=10, ref_freq=100e6, spectral_index=-1.0)
+    sky = sky_model.SkyModel(Nside=16, freqs=freqs, data=np.random.rand(1, 12 * 16**2, 7), Nskies=1)
+
+    # Splitting the channels, or tiling time x frequency, gives the same visibilities.
+    for engine in ['direct', 'topocentric']:
+        vis = obs.make_visibilities(sky, engine=engine, beam_pol=['pI', 'pQ'])[0]
+        vis_f = obs.make_visibilities(sky, Nprocs=3, engine=engine, beam_pol=['pI', 'pQ'], freq_chunk=3)[0]
+        assert np.allclose(vis_f, vis)
+        vis_tf = obs.make_visibilities(sky, Nprocs=2, engine=engine, beam_pol=['pI', 'pQ'], freq_chunk=2, time_chunk=1)[0]
+        assert np.allclose(vis_tf, vis)
+    assert np.all(obs.freqs == freqs)
+
+
+def test_bl_tile():
+    freqs = np.linspace(100e6, 110e6, 4)
+    enus = np.array([[14.6 * i, 14.6 * j, 0] for i in range(1, 4) for j in range(3)])
+    bls = [observatory.Baseline(enu_vec=enu) for enu in enus]
+    obs = observatory.Observatory(latitude, longitude, array=bls, freqs=freqs)
+    obs.set_pointings(2458000. + np.arange(2) / 24.)
+    obs.set_fov(40)
+    obs.set_beam('gaussian', gauss_width=10)
+    sky = sky_model.SkyModel(Nside=16, freqs=freqs, data=np.random.rand(2, 12 * 16**2, 4), Nskies=2)
+
+    # Tiling time x baseline gives the same visibilities.
+    for engine in ['direct', 'topocentric']:
+        vis = obs.make_visibilities(sky, engine=engine, beam_pol=['pI', 'pQ'])[0]
+        for kwargs in [dict(bl_tile=2), dict(bl_tile=4, freq_chunk=3, time_chunk=1)]:
+            vis_t = obs.make_visibilities(sky, Nprocs=2, engine=engine, beam_pol=['pI', 'pQ'], **kwargs)[0]
+            assert np.allclose(vis_t, vis)
+
+    # The geometry and beam of each time are evaluated once per group of baseline tiles, not once per tile.
+    obs.make_visibilities(sky, Nprocs=1, beam_pol=['pI', 'pQ'], time_chunk=2, bl_tile=2)
+    stages = obs.report['workers']['0']['stages']
+    assert stages['geometry']['count'] == 2
+    assert stages['beam_val']['count'] == 2 * 2
+    assert obs.report['stages']['output']['count'] == 2 * 5
+    obs.make_visibilities(sky, Nprocs=2, beam_pol=['pI', 'pQ'], time_chunk=2, bl_tile=2)
+    assert obs.report['stages']['geometry']['count'] == 2 * 2
+
+    # Baselines are only split if there are too few tasks for the processes.
+    assert obs._bl_tile_size(1, 1000, 1, 1) == 1000
+    assert obs._bl_tile_size(8, 1000, 64, 1) == 1000
+    assert obs._bl_tile_size(8, 1000, 2, 1) == 250
+
+
+def test_checkpoint(tmpdir):
+    freqs = np.linspace(100e6, 110e6, 4)
+    bls = [observatory.Baseline(enu_vec=enu) for enu in np.array([[14.6, 0, 0], [0, 14.6, 0]])]
+    obs = observatory.Observatory(latitude, longitude, array=bls, freqs=freqs)
+    obs.set_pointings(2458000. + np.arange(2) / 24.)
+    obs.set_fov(40)
+    obs.set_beam('gaussian', gauss_width=10)
+    sky = sky_model.SkyModel(Nside=16, freqs=freqs, data=np.random.rand(1, 12 * 16**2, 4), Nskies=1)
+    vis = obs.make_visibilities(sky)[0]
+
+    # Every tile is saved and listed in the index.
+    checkpoint_dir = str(tmpdir.join('checkpoint'))
+    checkpoint = observatory.VisCheckpoint(checkpoint_dir, fingerprint='foo', interval=0)
+    vis_c = obs.make_visibilities(sky, Nprocs=2, time_chunk=1, freq_chunk=2, checkpoint=checkpoint)[0]
+    assert np.allclose(vis_c, vis)
+    index = checkpoint.read_index()
+    assert len(index['tiles']) == 4
+    assert index['tiling'] == {'time_chunk': 1, 'freq_chunk': 2, 'bl_tile': 2}
+
+    # Resuming loads the listed tiles and computes the rest, with the tiling of the checkpoint.
+    # Zero one listed tile, to check it is loaded rather than recomputed.
+    t0, t1, f0, f1, b0, b1 = index['tiles'][0]
+    np.save(checkpoint._tile_path(index['tiles'][0]), np.zeros((t1 - t0, b1 - b0, 1, 1, f1 - f0), dtype=complex))
+    index['tiles'] = index['tiles'][:2]
+    checkpoint._write_index(index)
+    checkpoint.resume = True
+    with pytest.warns(UserWarning, match='tiling of the checkpoint'):
+        vis_r = obs.make_visibilities(sky, checkpoint=checkpoint)[0].reshape(2, 2, 4)
+    assert np.allclose(vis_r[t0:t1, b0:b1, f0:f1], 0)
+    vis_r[t0:t1, b0:b1, f0:f1] = vis.reshape(2, 2, 4)[t0:t1, b0:b1, f0:f1]
+    assert np.allclose(vis_r.reshape(vis.shape), vis)
+    assert len(checkpoint.read_index()['tiles']) == 4
+
+    # The fingerprint must match to resume.
+    checkpoint.fingerprint = 'bar'
+    with pytest.raises(ValueError, match='fingerprint of the checkpoint'):
+        obs.make_visibilities(sky, checkpoint=checkpoint)
+
+    # Without resume, the checkpoint is started over.
+    checkpoint.resume = False
+    vis_c = obs.make_visibilities(sky, checkpoint=checkpoint)[0]
+    assert np.allclose(vis_c, vis)
+    assert checkpoint.read_index()['fingerprint'] == 'bar'
+    checkpoint.clear()
+    assert checkpoint.read_index() is None
+    assert len(os.listdir(checkpoint_dir)) == 0
+
+
+def test_block_callback(tmpdir):
+    freqs = np.linspace(100e6, 110e6, 4)
+    enus = np.array([[14.6, 0, 0], [0, 14.6, 0], [14.6, 0, 0]])
+    bls = [observatory.Baseline(enu_vec=enu) for enu in enus]
+    obs = observatory.Observatory(latitude, longitude, array=bls, freqs=freqs)
+    obs.set_pointings(2458000. + np.arange(5) / 24.)
+    obs.set_fov(40)
+    obs.set_beam('gaussian', gauss_width=10)
+    sky = sky_model.SkyModel(Nside=16, freqs=freqs, data=np.random.rand(2, 12 * 16**2, 4), Nskies=2)
+
+    for beam_pol in ['pI', ['pI', 'pQ']]:
+        vis = obs.make_visibilities(sky, beam_pol=beam_pol)[0]
+        out = np.zeros_like(vis)
+
+        def write(time_inds, block):
+            blt_inds = np.arange(time_inds[0] * 3, (time_inds[-1] + 1) * 3)
+            assert not np.any(out[blt_inds])
+            out[blt_inds] = block
+
+        res = obs.make_visibilities(sky, Nprocs=2, beam_pol=beam_pol, time_chunk=2, freq_chunk=3, block_callback=write)
+        assert res[0] is None
+        assert np.allclose(out, vis)
+
+    # Chunks loaded from a checkpoint are passed on too.
+    checkpoint = observatory.VisCheckpoint(str(tmpdir.join('checkpoint')), interval=0)
+    obs.make_visibilities(sky, beam_pol=beam_pol, time_chunk=2, checkpoint=checkpoint)
+    checkpoint.resume = True
+    out[:] = 0
+    obs.make_visibilities(sky, beam_pol=beam_pol, time_chunk=2, checkpoint=checkpoint, block_callback=write)
+    assert np.allclose(out, vis)
+
+
+def test_block_callback_slots(tmpdir, monkeypatch):
+    freqs = np.linspace(100e6, 110e6, 4)
+    enus = np.array([[14.6, 0, 0], [0, 14.6, 0], [14.6, 14.6, 0]])
+    bls = [observatory.Baseline(enu_vec=enu) for enu in enus]
+    obs = observatory.Observatory(latitude, longitude, array=bls, freqs=freqs)
+    obs.set_pointings(2458000. + np.arange(7) / 24.)
+    obs.set_fov(40)
+    obs.set_beam('gaussian', gauss_width=10)
+    sky = sky_model.SkyModel(Nside=16, freqs=freqs, data=np.random.rand(1, 12 * 16**2, 4), Nskies=1)
+    vis = obs.make_visibilities(sky, beam_pol=['pI', 'pQ'])[0]
+    out = np.zeros_like(vis)
+
+    def write(time_inds, block):
+        out[np.arange(time_inds[0] * 3, (time_inds[-1] + 1) * 3)] = block
+
+    # Workers write into a pool of 2 * Nprocs slots of one time chunk, not a buffer of all times.
+    shapes = []
+
+    class RecordingArray(utils.mparray):
+        def __new__(cls, shape, *args, **kwargs):
+            shapes.append(shape)
+            return utils.mparray.__new__(cls, shape, *args, **kwargs)
+
+    monkeypatch.setattr(observatory, 'mparray', RecordingArray)
+    obs.make_visibilities(sky, Nprocs=1, beam_pol=['pI', 'pQ'], time_chunk=2, bl_tile=2, block_callback=write)
+    assert shapes == [(2, 2, 3, 2, 1, 4)]
+    assert np.allclose(out, vis)
+
+    # With a checkpoint, the tiles of each chunk are saved from its slot.
+    checkpoint = observatory.VisCheckpoint(str(tmpdir.join('checkpoint')), interval=0)
+    out[:] = 0
+    obs.make_visibilities(sky, Nprocs=2, beam_pol=['pI', 'pQ'], time_chunk=2, bl_tile=2, checkpoint=checkpoint,
+                          block_callback=write)
+    assert np.allclose(out, vis)
+    index = checkpoint.read_index()
+    assert len(index['tiles']) == 4 * 2
+    checkpoint.resume = True
+    assert np.allclose(obs.make_visibilities(sky, beam_pol=['pI', 'pQ'], checkpoint=checkpoint)[0], vis)
+
+    # Resuming a partial checkpoint loads the finished tiles of a chunk into its slot.
+    index['tiles'] = [tile for tile in index['tiles'] if tile[0] != 2 and tile[4] != 0]
+    checkpoint._write_index(index)
+    out[:] = 0
+    obs.make_visibilities(sky, Nprocs=2, beam_pol=['pI', 'pQ'], checkpoint=checkpoint, block_callback=write)
+    assert np.allclose(out, vis)
+    assert obs.report['stages']['output']['count'] == 2 + 2 * 2 + 2 + 1
+
+
+def test_report():
+    freqs = np.linspace(100e6, 110e6, 4)
+    bls = [observatory.Baseline(enu_vec=enu) for enu in np.array([[14.6, 0, 0], [0, 14.6, 0]])]
+    obs = observatory.Observatory(latitude, longitude, array=bls, freqs=freqs)
+    obs.set_pointings(2458000. + np.arange(4) / 24.)
+    obs.set_fov(60)
+    obs.set_beam('gaussian', gauss_width=10)
+    sky = sky_model.SkyModel(Nside=16, freqs=freqs, data=np.random.rand(1, 12 * 16**2, 4), Nskies=1)
+
+    obs.make_visibilities(sky, Nprocs=2, time_chunk=1)
+    report = obs.report
+    assert set(report['workers'].keys()) == {'0', '1'}
+    for stage in ['pointing', 'geometry', 'beam_val', 'gather', 'fringe', 'contraction', 'output', 'assembly']:
+        assert stage in report['stages']
+    assert report['stages']['output']['count'] == 4
+    assert report['max_rss_GB'] > 0
+    json.dumps(report)
+
+    # Stages timed in this process are reported once.
+    obs.make_visibilities(sky)
+    assert 'pointing' not in obs.report['stages']
+
+
+def test_mmode_engine():
+    freqs = np.linspace(100e6, 110e6, 3)
+    enus = np.array([[14.6, 0, 0], [0, 14.6, 0], [14.6, 14.6, 0]])
+    bls = [observatory.Baseline(enu_vec=enu) for enu in enus]
+    obs = observatory.Observatory(latitude, longitude, array=bls, freqs=freqs)
+    obs.set_fov(60)
+    obs.set_beam('gaussian', gauss_width=5)
+
+    Nside = 32
+    np.random.seed(0)
+    alm = hp.synalm(np.exp(-np.arange(3 * Nside) / 10.), lmax=3 * Nside - 1)
+    data = np.array([hp.alm2map(alm, Nside) + 3, np.ones(hp.nside2npix(Nside))])
+    data = np.repeat(data[:, :, np.newaxis], len(freqs), axis=2)
+    sky = sky_model.SkyModel(Nside=Nside, freqs=freqs, data=data, Nskies=2)
+
+    # Pointings covering the full circle evenly (by FFT), and at arbitrary RAs.
+    for ras in [np.arange(40) * 9. + 3.3, np.random.uniform(0, 360, 10)]:
+        obs.pointing_centers = [[ra, latitude] for ra in ras]
+        obs.times_jd = 2458000. + np.arange(len(ras)) / 40.
+        vis_direct = obs.make_visibilities(sky)[0]
+        vis_mmode = obs.make_visibilities(sky, engine='mmode')[0]
+        assert vis_mmode.shape == vis_direct.shape
+        assert np.allclose(vis_mmode, vis_direct, rtol=0, atol=2e-3 * np.abs(vis_direct).max())
+
+    obs.pointing_centers = [[20.3, latitude], [25.3, latitude + 1]]
+    obs.times_jd = np.array([2458000., 2458000.1])
+    pytest.raises(ValueError, obs.make_visibilities, sky, engine='mmode')
+
+    # A drift scan over a day from set_pointings, whose ICRS declinations vary by precession.
+    obs.set_pointings(2458000. + np.arange(40) / 40.)
+    assert np.ptp(np.array(obs.pointing_centers)[:, 1]) > np.degrees(hp.nside2resol(Nside)) / 10.
+    vis_direct = obs.make_visibilities(sky)[0]
+    vis_mmode = obs.make_visibilities(sky, engine='mmode')[0]
+    assert np.allclose(vis_mmode, vis_direct, rtol=0, atol=2e-3 * np.abs(vis_direct).max())
+
+
+def test_multiple_pols():
+    freqs = np.linspace(100e6, 110e6, 3)
+    enus = np.array([[14.6, 0, 0], [0, 14.6, 0], [14.6, 14.6, 0], [29.2, 0, 0]])
+    bls = [observatory.Baseline(enu_vec=enu) for enu in enus]
+    obs = observatory.Observatory(latitude, longitude, array=bls, freqs=freqs)
+    obs.pointing_centers = [[ra, latitude] for ra in np.arange(12) * 30. + 3.3]
+    obs.times_jd = 2458000. + np.arange(12) / 12.
+    obs.set_fov(60)
+
+    def pol_beam(za, freqs, pol='xx', **kwargs):
+        width = {'xx': 0.1, 'yy': 0.15}[pol]
+        return np.exp(-za[:, np.newaxis]**2 / (2 * width**2)) * np.ones(len(freqs))
+
+    obs.set_beam(pol_beam)
+    sky = sky_model.SkyModel(Nside=16, freqs=freqs, data=np.random.uniform(1, 2, (2, 12 * 16**2, 3)), Nskies=2)
+
+    for kwargs in [dict(), dict(engine='topocentric'), dict(engine='mmode'), dict(pix_block=100, bl_chunk=2)]:
+        vis = obs.make_visibilities(sky, beam_pol=['xx', 'yy'], **kwargs)[0]
+        assert vis.shape == (12 * 4, 2, 3, 2)
+        for pi, pol in enumerate(['xx', 'yy']):
+            assert np.allclose(vis[..., pi], obs.make_visibilities(sky, beam_pol=pol, **kwargs)[0])
+    assert not np.allclose(vis[..., 0], vis[..., 1])
+    obs._topo_table_bytes = 0
+    vis2 = obs.make_visibilities(sky, beam_pol=['xx', 'yy'], engine='topocentric')[0]
+    assert np.allclose(vis2[..., 1], obs.make_visibilities(sky, beam_pol='yy', engine='topocentric')[0])
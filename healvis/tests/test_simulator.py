@@ -7,10 +7,12 @@ from __future__ import absolute_import, division, print_function
 import numpy as np
 import healpy as hp
 import os
+import json
 import pytest
 import six
 import yaml
 import shutil
+import h5py
 from astropy.cosmology import Planck15
 
 from pyuvdata import UVData
@@ -57,9 +59,10 @@ def test_run_simulation():
     param_dict['filing']['outdir'] = os.path.join(DATA_PATH, "sim_testing_out")
     param_dict['filing']['outfile_name'] = 'test_sim'
     param_dict['filing']['format'] = 'uvh5'
+    param_dict['filing']['timing_report'] = True
 
     # run simulation
-    simulator.run_simulation(param_dict, add_to_history='foo')
+    report = simulator.run_simulation(param_dict, add_to_history='foo')
 
     # load result
     uvd = UVData()
@@ -73,6 +76,12 @@ def test_run_simulation():
     assert 'foo' in uvd.history  # check add_to_history was propagated
     assert "SKYPARAM" in uvd.history  # check param_dict was written to history
 
+    # check the timing report
+    with open(os.path.join(param_dict['filing']['outdir'], "test_sim.uvh5.timing.json"), 'r') as jfile:
+        timing = json.load(jfile)
+    assert set(timing['stages'].keys()) == set(report['stages'].keys()) == {'sky_model', 'observatory', 'simulation', 'write'}
+    assert 'fringe' in timing['simulation']['stages']
+
     # test data_array ordering is correct--i.e. Nbls, Ntimes--by asserting that auto-correlation is purely real for all times
     assert np.isclose(uvd.get_data(0, 0).imag, 0.0).all()
 
@@ -80,6 +89,149 @@ def test_run_simulation():
     shutil.rmtree(param_dict['filing']['outdir'])
 
 
+def test_run_simulation_stream():
+    param_file = os.path.join(DATA_PATH, "configs/obsparam_test.yaml")
+    with open(param_file, 'r') as _f:
+        param_dict = yaml.safe_load(_f)
+    param_dict['telescope']['array_layout'] = os.path.join(DATA_PATH + '/configs', os.path.basename(param_dict['telescope']['array_layout']))
+    param_dict['beam']['beam_type'] = 'gaussian'
+    param_dict['beam']['gauss_width'] = 10.0
+    param_dict['skyparam']['sky_type'] = os.path.join(DATA_PATH, "gsm_nside32.hdf5")
+    param_dict['filing']['outdir'] = os.path.join(DATA_PATH, "sim_testing_out")
+    param_dict['filing']['format'] = 'uvh5'
+
+    param_dict['filing']['outfile_name'] = 'test_sim'
+    simulator.run_simulation(param_dict)
+    uvd = UVData()
+    uvd.read(os.path.join(param_dict['filing']['outdir'], "test_sim.uvh5"))
+
+    # Time blocks are written to the output file as they are finished.
+    param_dict['filing']['outfile_name'] = 'test_stream'
+    param_dict['filing']['stream'] = True
+    param_dict['filing']['timing_extra_keywords'] = True
+    param_dict['Nprocs'] = 2
+    report = simulator.run_simulation(param_dict)
+    uvd2 = UVData()
+    uvd2.read(os.path.join(param_dict['filing']['outdir'], "test_stream.uvh5"))
+    assert np.allclose(uvd2.data_array, uvd.data_array)
+    assert 'timing' in uvd2.extra_keywords
+    assert report['stages']['write']['count'] > 1
+
+    param_dict['filing']['format'] = 'miriad'
+    simtest.assert_raises_message(ValueError, 'requires the uvh5 format', simulator.run_simulation, param_dict)
+
+    shutil.rmtree(param_dict['filing']['outdir'])
+
+
+def test_run_simulation_checkpoint():
+    param_file = os.path.join(DATA_PATH, "configs/obsparam_test.yaml")
+    with open(param_file, 'r') as _f:
+        param_dict = yaml.safe_load(_f)
+    param_dict['telescope']['array_layout'] = os.path.join(DATA_PATH + '/configs', os.path.basename(param_dict['telescope']['array_layout']))
+    param_dict['beam']['beam_type'] = 'gaussian'
+    param_dict['beam']['gauss_width'] = 10.0
+    param_dict['skyparam']['sky_type'] = os.path.join(DATA_PATH, "gsm_nside32.hdf5")
+    param_dict['filing']['outdir'] = os.path.join(DATA_PATH, "sim_testing_out")
+    param_dict['filing']['outfile_name'] = 'test_sim'
+    param_dict['filing']['format'] = 'uvh5'
+    simtest.assert_raises_message(ValueError, 'requires the checkpoint_dir', simulator.run_simulation, param_dict, resume=True)
+
+    checkpoint_dir = os.path.join(param_dict['filing']['outdir'], 'checkpoint')
+    param_dict['checkpoint_dir'] = checkpoint_dir
+    param_dict['checkpoint_interval'] = 0
+    report = simulator.run_simulation(param_dict)
+    # Checkpointed runs are split into tiles of one time.
+    assert report['simulation']['time_chunk'] == 1
+    uvd = UVData()
+    uvd.read(os.path.join(param_dict['filing']['outdir'], "test_sim.uvh5"))
+    # The checkpoint is removed once the output is written.
+    assert os.listdir(checkpoint_dir) == []
+
+    # Resuming without a checkpoint runs the whole simulation.
+    param_dict['Nprocs'] = 2
+    simulator.run_simulation(param_dict, resume=True)
+    uvd2 = UVData()
+    uvd2.read(os.path.join(param_dict['filing']['outdir'], "test_sim.uvh5"))
+    assert np.allclose(uvd2.data_array, uvd.data_array)
+
+    # A checkpoint from a different simulation is not resumed.
+    checkpoint = observatory.VisCheckpoint(checkpoint_dir, fingerprint='foo')
+    checkpoint.start((1, 1, 1, 1, 1), np.complex128, {})
+    simtest.assert_raises_message(ValueError, 'fingerprint of the checkpoint', simulator.run_simulation, param_dict, resume=True)
+
+    shutil.rmtree(param_dict['filing']['outdir'])
+
+
+def test_shard_bounds():
+    # Blocks have equal lengths but the last, so every bound is a multiple of the block (and chunk) length.
+    for N, Nshards in [(10, 3), (10, 4), (10, 6), (7, 7), (5, 8), (12, 3)]:
+        bounds = simulator._shard_bounds(N, Nshards)
+        length = bounds[1] - bounds[0]
+        assert bounds[0] == 0 and bounds[-1] == N
+        assert len(bounds) - 1 <= Nshards
+        assert all(b % length == 0 for b in bounds[:-1])
+        assert np.all(np.diff(bounds[:-1]) == length) and bounds[-1] - bounds[-2] <= length
+    assert simulator._shard_bounds(10, 3) == [0, 4, 8, 10]
+
+
+def test_shards():
+    param_file = os.path.join(DATA_PATH, "configs/obsparam_test.yaml")
+    with open(param_file, 'r') as _f:
+        param_dict = yaml.safe_load(_f)
+    param_dict['telescope']['array_layout'] = os.path.join(DATA_PATH + '/configs', os.path.basename(param_dict['telescope']['array_layout']))
+    param_dict['beam']['beam_type'] = 'gaussian'
+    param_dict['beam']['gauss_width'] = 10.0
+    param_dict['skyparam']['sky_type'] = os.path.join(DATA_PATH, "gsm_nside32.hdf5")
+    param_dict['filing']['outdir'] = os.path.join(DATA_PATH, "sim_testing_out")
+    param_dict['filing']['format'] = 'uvh5'
+
+    # one-shot simulation for comparison
+    param_dict['filing']['outfile_name'] = 'test_sim'
+    simulator.run_simulation(param_dict)
+    uvd = UVData()
+    uvd.read(os.path.join(param_dict['filing']['outdir'], "test_sim.uvh5"))
+
+    # plan 3 x 2 shards
+    param_dict['filing']['outfile_name'] = 'test_shards'
+    param_dict['bl_tile'] = 2
+    plan = simulator.plan_shards(param_dict, Nfreq_shards=3, Ntime_shards=2)
+    plan_file = os.path.join(param_dict['filing']['outdir'], "test_shards.shards.json")
+    assert os.path.exists(plan_file)
+    assert len(plan['shards']) == 6
+    assert plan['run_kwargs']['bl_tile'] == 2
+    assert plan['run_kwargs']['precision'] == 'double'
+    assert plan['run_kwargs']['engine'] == 'direct'
+    # 10 channels in 3 shards: each shard's channels start at a chunk boundary of the output file.
+    freq_starts = [shard['freq_chans'][0] for shard in plan['shards']]
+    with h5py.File(plan['uvh5_file'], 'r') as h5f:
+        chunk_length = h5f['Data/visdata'].chunks[2]
+    assert sorted(set(freq_starts)) == [0, 4, 8]
+    assert all(start % chunk_length == 0 for start in freq_starts)
+    assert simulator.verify_shards(plan_file) == list(range(6))
+
+    # run all but one
+    for shard in range(5):
+        simulator.run_shard(plan_file, shard=shard)
+    assert simulator.verify_shards(plan_file) == [5]
+    simtest.assert_raises_message(ValueError, 'have not finished', simulator.merge_shards, plan_file)
+    os.environ['SLURM_ARRAY_TASK_ID'] = '5'
+    try:
+        simulator.run_shard(plan_file)
+    finally:
+        del os.environ['SLURM_ARRAY_TASK_ID']
+    reports = simulator.merge_shards(plan_file)
+    assert len(reports) == 6
+    assert os.path.exists(plan['uvh5_file'] + '.timing.json')
+    assert not os.path.exists(plan['uvh5_file'] + '.lock')
+
+    # compare to the one-shot simulation
+    uvd2 = UVData()
+    uvd2.read(plan['uvh5_file'])
+    assert np.allclose(uvd.data_array, uvd2.data_array)
+
+    shutil.rmtree(param_dict['filing']['outdir'])
+
+
 @pytest.mark.skipif(six.PY2, reason='Very slow on Python 2')
 def test_run_simulation_partial_freq():
     # read gsm test file
@@ -146,6 +298,16 @@ def test_setup_light_uvdata():
 
     assert np.all(obs_full.freqs == obs.freqs)
 
+    # Beams are made at, or copied to, the given precision.
+    obs = simulator.setup_observatory_from_uvdata(uvd, fov=30, beam='gaussian', beam_kwargs={'gauss_width': 10}, precision='single')
+    assert obs.beam.precision == 'single'
+    beam = beam_model.AnalyticBeam('gaussian', gauss_width=10)
+    obs = simulator.setup_observatory_from_uvdata(uvd, fov=30, beam=beam, precision='single')
+    assert obs.beam.precision == 'single' and beam.precision == 'double'
+    beam = beam_model.PowerBeam(os.path.join(DATA_PATH, "HERA_NF_dipole_power.beamfits"))
+    obs = simulator.setup_observatory_from_uvdata(uvd, fov=30, beam=beam, precision='single')
+    assert obs.beam.data_array.dtype == np.float32
+
 
 def test_parse_freq_params():
     # define global set of keys that all agree
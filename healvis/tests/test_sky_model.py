@@ -7,11 +7,13 @@ from __future__ import absolute_import, division, print_function
 import numpy as np
 import os
 import healpy as hp
+import h5py
 from astropy.cosmology import Planck15
 
 from healvis import sky_model, utils
 from healvis.data import DATA_PATH
 from healvis.tests import TESTDATA_PATH
+import healvis.tests as simtest
 import tempfile
 
 
@@ -62,8 +64,13 @@ def test_flat_spectrum():
     Nskies = 1
     maps = sky_model.flat_spectrum_noise_shell(sigma, freq_array, Nside, Nskies)
     assert maps.shape == (Nskies, Npix, Nfreqs)
+    assert maps.dtype == np.float64
     # any other checks?
 
+    maps = sky_model.flat_spectrum_noise_shell(sigma, freq_array, Nside, Nskies, shared_memory=True, precision='single')
+    assert maps.dtype == np.float32
+    assert isinstance(maps, utils.mparray)
+
 
 def test_write_read():
     dr = tempfile.mkdtemp()
@@ -94,6 +101,132 @@ def test_fewchannel_read():
     assert sky.freqs.size == 4
 
 
+def test_pixelselect_read():
+    filename = os.path.join(DATA_PATH, "gsm_nside32.hdf5")
+    chans = np.arange(4)
+    sky = sky_model.SkyModel()
+    sky.read_hdf5(filename, freq_chans=chans)
+    pix = np.concatenate([np.arange(100, 150), np.arange(3000, 3010)])
+    for shared in [False, True]:
+        part = sky_model.SkyModel()
+        part.read_hdf5(filename, freq_chans=chans, pixels=pix, shared_memory=shared)
+        verify_update(part)
+        assert part.Nside == sky.Nside
+        assert np.all(part.indices == pix)
+        assert np.all(part.data == sky.data[:, pix])
+
+    # Unsorted, non-contiguous channels.
+    unsorted = sky_model.SkyModel()
+    unsorted.read_hdf5(filename, freq_chans=np.array([3, 0]), pixels=pix)
+    assert np.all(unsorted.data == sky.data[:, pix][..., [3, 0]])
+
+    # Selecting from a partial-sky file.
+    testfilename = os.path.join(tempfile.mkdtemp(), 'test_partial.hdf5')
+    part.history = ''
+    part.write_hdf5(testfilename)
+    part2 = sky_model.SkyModel()
+    part2.read_hdf5(testfilename, pixels=pix[::2])
+    assert np.all(part2.indices == pix[::2])
+    assert np.all(part2.data == sky.data[:, pix[::2]])
+
+    # The Nside of a partial sky is not guessed from its number of pixels (48 would give Nside 2).
+    part2 = sky_model.SkyModel()
+    part2.read_hdf5(testfilename, pixels=pix[:48])
+    part2.history = ''
+    part2.write_hdf5(testfilename, clobber=True)
+    with h5py.File(testfilename, 'r+') as h5f:
+        del h5f.attrs['Nside']
+    for kwargs in [dict(), dict(pixels=pix[:10])]:
+        simtest.assert_raises_message(ValueError, 'no Nside attribute', sky_model.SkyModel().read_hdf5, testfilename, **kwargs)
+    os.remove(testfilename)
+
+    # Generated skies
+    sky = sky_model.construct_skymodel('monopole', freqs=sky.freqs, Nside=32, amplitude=1.0, pixels=pix)
+    assert sky.data.shape == (1, pix.size, 4)
+    sky = sky_model.construct_skymodel('flat_spec', freqs=sky.freqs, Nside=32, sigma=1.0, pixels=pix)
+    verify_update(sky)
+    assert sky.data.shape == (1, pix.size, 4)
+
+
+def test_mmap_read():
+    testfilename = os.path.join(tempfile.mkdtemp(), 'test_mmap.hdf5')
+    freq_array = np.linspace(167.0e6, 177.0e6, 10)
+    sky = sky_model.SkyModel(Nside=16, Nskies=2, freqs=freq_array, ref_chan=5)
+    sky.make_flat_spectrum_shell(sigma=2.0)
+    sky.write_hdf5(testfilename, compression=None)
+
+    sky2 = sky_model.SkyModel()
+    sky2.read_hdf5(testfilename, mmap=True)
+    assert isinstance(sky2.data, np.memmap)
+    sky2.history, sky.history = '', ''
+    assert sky == sky2
+
+    chans = np.arange(3, 7)
+    sky2 = sky_model.SkyModel()
+    sky2.read_hdf5(testfilename, freq_chans=chans, mmap=True)
+    assert np.all(sky2.data == sky.data[..., chans])
+    assert np.all(sky2.freqs == freq_array[chans])
+
+    simtest.assert_raises_message(ValueError, 'contiguous range', sky2.read_hdf5, testfilename, freq_chans=chans[::2], mmap=True)
+    simtest.assert_raises_message(ValueError, 'not available with mmap', sky2.read_hdf5, testfilename, pixels=chans, mmap=True)
+    sky.write_hdf5(testfilename, clobber=True)
+    simtest.assert_raises_message(ValueError, 'not stored contiguously', sky2.read_hdf5, testfilename, mmap=True)
+    os.remove(testfilename)
+
+
+def test_fingerprint():
+    testfilename = os.path.join(tempfile.mkdtemp(), 'test_fingerprint.hdf5')
+    freq_array = np.linspace(167.0e6, 177.0e6, 10)
+    sky = sky_model.SkyModel(Nside=16, Nskies=2, freqs=freq_array, ref_chan=5)
+    sky.make_flat_spectrum_shell(sigma=2.0)
+    sky.write_hdf5(testfilename, compression=None)
+
+    # Independent of how the data are read and hashed.
+    sky2 = sky_model.SkyModel()
+    sky2.read_hdf5(testfilename, mmap=True)
+    assert sky2.fingerprint(block_size=100) == sky.fingerprint()
+
+    sky.data[1, 0, 0] += 1
+    assert sky2.fingerprint() != sky.fingerprint()
+    os.remove(testfilename)
+
+
+def test_chunked_write_read():
+    testfilename = os.path.join(tempfile.mkdtemp(), 'test_chunked.hdf5')
+    freq_array = np.linspace(167.0e6, 177.0e6, 20)
+    sky = sky_model.SkyModel(Nside=16, Nskies=2, freqs=freq_array, ref_chan=5)
+    sky.make_flat_spectrum_shell(sigma=2.0)
+    sky.history = ''
+    for kwargs in [dict(compression='lzf', chunks=(1000, 4)), dict(compression_opts=1, chunks=(500, 3))]:
+        sky.write_hdf5(testfilename, clobber=True, **kwargs)
+        with h5py.File(testfilename, 'r') as f:
+            assert f['data'].chunks == (1,) + kwargs['chunks']
+        for chans in [np.arange(3, 9), np.array([0, 1, 7, 15, 16, 19]), np.array([12, 2, 5])]:
+            sky2 = sky_model.SkyModel()
+            sky2.read_hdf5(testfilename, freq_chans=chans)
+            assert np.all(sky2.data == sky.data[..., chans])
+    os.remove(testfilename)
+
+
+def test_iter_freq_blocks():
+    filename = os.path.join(DATA_PATH, "gsm_nside32.hdf5")
+    sky = sky_model.SkyModel()
+    sky.read_hdf5(filename)
+    assert sky_model._chans_to_slice(np.arange(3, 7)) == slice(3, 7)
+    assert not isinstance(sky_model._chans_to_slice(np.array([3, 5])), slice)
+
+    blocks = list(sky_model.iter_freq_blocks(filename, 3, shared_memory=True))
+    assert len(blocks) == int(np.ceil(sky.Nfreqs / 3.))
+    for chans, block in blocks:
+        assert np.all(block.freqs == sky.freqs[chans])
+        assert np.all(block.data == sky.data[..., chans])
+    assert np.all(np.concatenate([chans for chans, block in blocks]) == np.arange(sky.Nfreqs))
+
+    chans = np.array([0, 2, 4, 5, 9])
+    blocks = list(sky_model.iter_freq_blocks(filename, 2, freq_chans=chans))
+    assert np.all(np.concatenate([block.data for c, block in blocks], axis=-1) == sky.data[..., chans])
+
+
 def test_freqselect_read():
     # Using existing frequencies as selection on read
     sky = sky_model.SkyModel()
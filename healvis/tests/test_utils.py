@@ -6,7 +6,10 @@ from __future__ import absolute_import, division, print_function
 
 import numpy as np
 import multiprocessing as mp
+import fcntl
 import time
+import pickle
+import pytest
 
 from healvis import utils
 
@@ -48,6 +51,67 @@ def test_mparray():
         continue
 
 
+def _write_index(arr, ind):
+    arr[ind] = ind * 2
+
+
+def test_mparray_spawn():
+    # Spawned processes don't inherit memory, so this checks that the mparray
+    # is pickled as a handle to its shared memory block, not as a copy.
+    Nprocs = 3
+    mpah = utils.mparray((2, Nprocs), dtype=int)
+    mpah[()] = 100
+    assert mpah.is_shared
+
+    ctx = mp.get_context('spawn')
+    procs = [ctx.Process(target=_write_index, args=(mpah[1], ind)) for ind in range(Nprocs)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert np.all(mpah[0] == 100)
+    assert np.all(mpah[1] == 2 * np.arange(Nprocs))
+
+    # Unpickling in this process attaches to the same block.
+    view = pickle.loads(pickle.dumps(mpah[:, 1:]))
+    view[0, 0] = -1
+    assert mpah[0, 1] == -1
+
+    # Copies and arithmetic results are ordinary arrays.
+    cp = mpah.copy()
+    assert not cp.is_shared
+    assert type(mpah + 1) is np.ndarray
+    assert type(pickle.loads(pickle.dumps(cp))) is np.ndarray
+
+    name = mpah.shm_name
+    mpah.unlink()
+    assert_raises_message(FileNotFoundError, name, utils._attach_shared_memory, name)
+
+
+def test_mparray_fallback(monkeypatch):
+    # With too little space in /dev/shm, arrays fall back to a RawArray shared with forked processes.
+    monkeypatch.setattr(utils, '_shm_free_bytes', lambda: 0)
+    Nprocs = 3
+    mpah = utils.mparray((2, Nprocs), dtype=int)
+    mpah[()] = 100
+    assert mpah.is_shared
+    assert mpah.shm_name is None
+
+    ctx = mp.get_context('fork')
+    procs = [ctx.Process(target=_write_index, args=(mpah[1], ind)) for ind in range(Nprocs)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert np.all(mpah[0] == 100)
+    assert np.all(mpah[1] == 2 * np.arange(Nprocs))
+
+    # Without a name, pickling copies the data.
+    cp = pickle.loads(pickle.dumps(mpah))
+    assert type(cp) is np.ndarray
+    assert np.all(cp == mpah)
+
+
 def assert_raises_message(exception_type, message, func, *args, **kwargs):
     """
     Check that the correct error message is raised.
@@ -64,3 +128,45 @@ def assert_raises_message(exception_type, message, func, *args, **kwargs):
     except AssertionError as excp:
         print("{} not in {}".format(message, str(err.value)))
         raise excp
+
+
+def test_stage_timer():
+    timer = utils.StageTimer()
+    for i in range(3):
+        with timer.stage('a'):
+            time.sleep(0.01)
+    timer.add('b', 2.0)
+    report = timer.report()
+    assert list(report.keys()) == ['a', 'b']
+    assert report['a']['count'] == 3
+    assert report['a']['time'] >= 0.03
+
+    merged = utils.merge_stage_reports([report, report])
+    assert merged['b'] == {'time': 4.0, 'count': 2}
+    assert utils.max_rss_GB() > 0
+
+
+def _try_lock(path, result):
+    with open(path, 'a') as lfile:
+        try:
+            fcntl.lockf(lfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            result.value = 1
+        except (IOError, OSError):
+            result.value = 0
+
+
+def test_file_lock(tmpdir):
+    # The lock is a POSIX record lock, held against other processes.
+    path = str(tmpdir.join('test.lock'))
+    result = mp.Value('i', -1)
+    with utils.file_lock(path):
+        p = mp.Process(target=_try_lock, args=(path, result))
+        p.start()
+        p.join()
+        assert result.value == 0
+    p = mp.Process(target=_try_lock, args=(path, result))
+    p.start()
+    p.join()
+    assert result.value == 1
+    with utils.file_lock(None):
+        pass
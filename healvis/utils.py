@@ -6,6 +6,16 @@ from __future__ import absolute_import, division, print_function
 
 import numpy as np
 import multiprocessing as mp
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:     # Python < 3.8
+    shared_memory = None
+import os
+import time
+import resource
+import contextlib
+import fcntl
+from collections import OrderedDict
 from astropy.constants import c
 
 
@@ -77,18 +87,257 @@ def jy2Tsr(f, bm=1.0, mK=False):
     return 1e-23 * lam**2 / (2 * k_boltz * bm) * fac
 
 
+def precision_dtypes(precision='double'):
+    """
+    Get the real and complex dtypes corresponding to a precision.
+
+    Args:
+        precision : str, options=['single', 'double']
+
+    Returns:
+        real dtype, complex dtype
+    """
+    if precision == 'single':
+        return np.dtype(np.float32), np.dtype(np.complex64)
+    elif precision == 'double':
+        return np.dtype(np.float64), np.dtype(np.complex128)
+    raise ValueError("precision must be 'single' or 'double', not {}".format(precision))
+
+
+def _shm_free_bytes():
+    """
+    Free space [bytes] in /dev/shm, or None if it can't be found (e.g., there is no /dev/shm).
+    """
+    try:
+        st = os.statvfs('/dev/shm')
+    except OSError:
+        return None
+    return st.f_bavail * st.f_frsize
+
+
+class _SharedBlock(object):
+    """
+    A multiprocessing.shared_memory block, shared by an mparray and its views.
+
+    The process that created the block unlinks it once no array refers to it, or on unlink().
+    Blocks attached by name in other processes are only closed.
+
+    Without multiprocessing.shared_memory (Python < 3.8), or if /dev/shm has too little free space
+    (where the pages of a SharedMemory block would fail with SIGBUS when touched), the block is a
+    multiprocessing.RawArray instead. Its heap falls back to a temporary file when /dev/shm is too small.
+    It is only shared with forked processes, and has no name.
+    """
+
+    def __init__(self, nbytes=None, name=None):
+        self.shm = None
+        self.owner_pid = None
+        if name is not None:
+            self.shm = _attach_shared_memory(name)
+        else:
+            nbytes = max(int(nbytes), 1)
+            free = _shm_free_bytes()
+            if shared_memory is not None and (free is None or free >= nbytes):
+                self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+                self.owner_pid = os.getpid()
+        if self.shm is not None:
+            self.name = self.shm.name
+            self.buf = self.shm.buf
+        else:
+            self.name = None
+            self._raw = mp.RawArray('B', nbytes)
+            self.buf = memoryview(self._raw).cast('B')
+        self.address = np.frombuffer(self.buf, dtype=np.uint8).__array_interface__['data'][0]
+        self.size = len(self.buf)
+
+    def contains(self, arr):
+        """
+        Whether the data of arr lie in this block.
+        """
+        start = arr.__array_interface__['data'][0]
+        return self.address <= start < self.address + self.size
+
+    def unlink(self):
+        """
+        Remove the block's name, if this process created it, so no new process can attach to it.
+        The memory is freed once every process has released it.
+        """
+        if self.shm is not None and self.owner_pid == os.getpid():
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+            self.owner_pid = None
+
+    def __del__(self):
+        self.unlink()
+        if self.shm is None:
+            return
+        try:
+            self.shm.close()
+        except BufferError:     # An array is still being deallocated. The mapping is released with it.
+            pass
+
+
+def _attach_shared_memory(name):
+    """
+    Attach to an existing shared memory block by name, without registering it with this
+    process's resource tracker (which would otherwise unlink it when this process exits).
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:   # Python < 3.13 always registers, so skip it here.
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def _attach_mparray(name, offset, shape, strides, dtype):
+    """
+    Rebuild a pickled mparray by attaching to its shared memory block. See mparray.__reduce_ex__.
+    """
+    block = _SharedBlock(name=name)
+    obj = np.ndarray.__new__(mparray, shape, dtype=dtype, buffer=block.buf, offset=offset, strides=strides)
+    obj._block = block
+    return obj
+
+
 class mparray(np.ndarray):
     """
-    A multiprocessing RawArray accessible with numpy array slicing.
+    A numpy array in shared memory (multiprocessing.shared_memory), for sharing data among processes.
+
+    mparray(shape, dtype=float) allocates a new block. Forked processes inherit it, and in
+    any other process (e.g., spawned ones), an unpickled mparray attaches to the same block:
+    mparrays and their views pickle as a handle to the block, not as their data.
+
+    The block lives until the creating process drops its last mparray (or view) of it, or calls unlink().
+    Results of arithmetic on an mparray are ordinary ndarrays.
+
+    If shared memory blocks are not available, or /dev/shm is too small, the array is in a
+    multiprocessing.RawArray, shared only with forked processes (shm_name is None). See _SharedBlock.
+    """
+
+    def __new__(cls, shape, dtype=float):
+        dtype = np.dtype(dtype)
+        block = _SharedBlock(nbytes=int(np.prod(shape)) * dtype.itemsize)
+        obj = np.ndarray.__new__(cls, shape, dtype=dtype, buffer=block.buf)
+        obj._block = block
+        return obj
+
+    def __array_finalize__(self, obj):
+        # Views share the block of the array they are taken from. Copies don't.
+        block = getattr(obj, '_block', None)
+        self._block = block if block is not None and block.contains(self) else None
+
+    def __array_wrap__(self, arr, context=None, *args):
+        arr = super(mparray, self).__array_wrap__(arr, context, *args)
+        if isinstance(arr, mparray) and arr._block is None:
+            return arr.view(np.ndarray)
+        return arr
+
+    @property
+    def is_shared(self):
+        """
+        Whether this array's data are in shared memory. (Copies of an mparray are not.)
+        """
+        return self._block is not None
+
+    @property
+    def shm_name(self):
+        """
+        Name of the shared memory block, or None if not shared.
+        """
+        return self._block.name if self.is_shared else None
+
+    def unlink(self):
+        """
+        Unlink the shared memory block now, rather than when the last array using it is deleted.
+        This process and those already attached can keep using the data, but no new process can attach.
+        """
+        if self._block is not None:
+            self._block.unlink()
+
+    def __reduce_ex__(self, protocol):
+        if not self.is_shared or self._block.name is None:
+            return np.array(self).__reduce_ex__(protocol)
+        offset = self.__array_interface__['data'][0] - self._block.address
+        return (_attach_mparray, (self._block.name, offset, self.shape, self.strides, self.dtype.str))
+
+    def __reduce__(self):
+        return self.__reduce_ex__(2)
+
+
+class StageTimer(object):
+    """
+    Accumulate the wall-clock time [s] and number of calls of named stages of a calculation.
+
+    Usage:
+        timer = StageTimer()
+        with timer.stage('fringe'):
+            ...
     """
-    # TODO --- replace this. numpy no longer supports assignment to the data attribute:
-    # https://stackoverflow.com/questions/7894791/use-numpy-array-in-shared-memory-for-multiprocessing
 
-    def __init__(self, *args, **kwargs):
-        ctype = np.sctype2char(self.dtype)
-        arr = mp.RawArray(ctype, self.size)
-        self.data = arr
-        self.reshape(self.shape)
+    def __init__(self):
+        self.times = OrderedDict()
+        self.counts = OrderedDict()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - t0)
+
+    def add(self, name, seconds, count=1):
+        self.times[name] = self.times.get(name, 0.) + seconds
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def report(self):
+        """
+        Returns:
+            dict of {stage name : {'time': seconds, 'count': number of calls}}
+        """
+        return OrderedDict((name, {'time': self.times[name], 'count': self.counts[name]}) for name in self.times)
+
+
+def merge_stage_reports(reports):
+    """
+    Sum a list of StageTimer reports, stage by stage.
+    """
+    timer = StageTimer()
+    for rep in reports:
+        for name, stage in rep.items():
+            timer.add(name, stage['time'], count=stage['count'])
+    return timer.report()
+
+
+def max_rss_GB():
+    """
+    Peak resident memory of this process [GB].
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e6
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive lock on the file at path (created if needed), or do nothing if path is None.
+
+    This is a POSIX record lock (fcntl.lockf), which, unlike flock, is seen by processes on other
+    nodes of shared filesystems such as NFS and Lustre (if mounted with locking enabled).
+    """
+    if path is None:
+        yield
+        return
+    with open(path, 'a') as lfile:
+        fcntl.lockf(lfile, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(lfile, fcntl.LOCK_UN)
 
 
 def enu_array_to_layout(enu_arr, fname):
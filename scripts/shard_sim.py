@@ -0,0 +1,56 @@
+#!/bin/env python
+# -*- mode: python; coding: utf-8 -*
+# Copyright (c) 2019 Radio Astronomy Software Group
+# Licensed under the 3-clause BSD License
+
+"""
+Run a healvis simulation split into frequency x time shards, e.g. as a SLURM job array:
+
+    shard_sim.py plan obsparam.yaml --Nfreq_shards 8 --Ntime_shards 4
+    sbatch --array=0-31 --wrap "shard_sim.py run out/healvis.shards.json"
+    shard_sim.py merge out/healvis.shards.json
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import sys
+
+from healvis import simulator
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+subparsers = parser.add_subparsers(dest='command')
+
+plan_parser = subparsers.add_parser('plan', help='Create the output file and write a plan of shards.')
+plan_parser.add_argument('param_file', help='obsparam yaml file')
+plan_parser.add_argument('--Nfreq_shards', type=int, default=1, help='Number of blocks of channels.')
+plan_parser.add_argument('--Ntime_shards', type=int, default=1, help='Number of blocks of times.')
+plan_parser.add_argument('--plan_file', default=None, help='Path of the plan. Default is next to the output file.')
+
+run_parser = subparsers.add_parser('run', help='Run one shard of a plan.')
+run_parser.add_argument('plan_file', help='JSON plan file')
+run_parser.add_argument('--shard', type=int, default=None, help='Shard index. Default is SLURM_ARRAY_TASK_ID.')
+run_parser.add_argument('--Nprocs', type=int, default=None, help='Number of processes. Default is SLURM_CPUS_PER_TASK, or 1.')
+
+merge_parser = subparsers.add_parser('merge', help='Check all shards have finished and collect their timing reports.')
+merge_parser.add_argument('plan_file', help='JSON plan file')
+merge_parser.add_argument('--keep', action='store_true', help='Keep the shard marker files.')
+
+args = parser.parse_args()
+
+if args.command == 'plan':
+    plan = simulator.plan_shards(args.param_file, Nfreq_shards=args.Nfreq_shards,
+                                 Ntime_shards=args.Ntime_shards, plan_file=args.plan_file)
+elif args.command == 'run':
+    Nprocs = args.Nprocs
+    if Nprocs is None:
+        Nprocs = int(os.environ.get('SLURM_CPUS_PER_TASK', 1))
+    simulator.run_shard(args.plan_file, shard=args.shard, Nprocs=Nprocs)
+elif args.command == 'merge':
+    missing = simulator.verify_shards(args.plan_file)
+    if len(missing) > 0:
+        print("Shards not finished: {}".format(', '.join(map(str, missing))))
+        sys.exit(1)
+    simulator.merge_shards(args.plan_file, cleanup=not args.keep)
+else:
+    parser.print_help()
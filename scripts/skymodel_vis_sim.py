@@ -27,6 +27,7 @@ import healvis
 parser = argparse.ArgumentParser()
 parser.add_argument(dest='param', help='obsparam yaml file')
 parser.add_argument('-n', dest='Nproc', help='Number of processes (overrides SLURM Ncpus)', type=int)
+parser.add_argument('--resume', action='store_true', help='Resume from the checkpoint in the checkpoint_dir obsparam key.')
 args = parser.parse_args()
 
 param_file = args.param
@@ -44,4 +45,4 @@ if 'SLURM_JOB_ID' in os.environ:
     sjob_id = os.environ['SLURM_JOB_ID']
 
 
-healvis.simulator.run_simulation(param_file, Nprocs=Nprocs, sjob_id=sjob_id)
+healvis.simulator.run_simulation(param_file, Nprocs=Nprocs, sjob_id=sjob_id, resume=args.resume)